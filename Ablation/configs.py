@@ -1,12 +1,15 @@
 import os
 import os
 import json
-import base64
-from io import BytesIO
-from PIL import Image
 import re
 import glob
+from functools import lru_cache
 from tqdm import tqdm
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from oddgrid_common.image_cache import Base64LRUCache, png_b64
+from oddgrid_common.token_budget import image_size, visual_tokens
 # models_dir = "../models/"
 max_new_tokens = 2048
 
@@ -19,6 +22,15 @@ SAVE_DIR = "./results"  #
 
 EXAMPLE_DIR = "./examples"  # 正样本和负样本
 
+# vllm_infer_dire 直连推理：每次 llm.chat 提交的条数 / 图片数上限
+batch_size = 8
+max_batch_images = 24
+# Transformers 兜底（Qwen3.5、Gemma-4）每次 generate 的图片数上限：整组按最长样本 padding，比 vLLM 的小
+hf_max_batch_images = 12
+
+IMAGE_CACHE = Base64LRUCache(encode_fn=png_b64)
+PREFETCH_LOOKAHEAD = 2
+
 
 def extract_answer(predict_answer):
     if not predict_answer:
@@ -37,12 +49,8 @@ def extract_answer(predict_answer):
 def encode_image(image_path):
     if not os.path.exists(image_path):
         return None
-    with Image.open(image_path) as img:
-        if img.mode not in ("RGB", "RGBA"):
-            img = img.convert("RGB")
-        buf = BytesIO()
-        img.save(buf, format="PNG")
-        return base64.b64encode(buf.getvalue()).decode("utf-8")
+    # PNG 重编码结果按 (path, mtime) 缓存，示例图不再每条样本都重编码
+    return IMAGE_CACHE.get(image_path)
 
 
 def find_example_image(original_path, target_type="Normal"):
@@ -54,7 +62,14 @@ def find_example_image(original_path, target_type="Normal"):
     """
     if not original_path:
         return None
-    
+    # 示例图只取决于所在目录（数据集 / 类别），同一类别只查一次文件系统
+    return _find_example_in_dir(os.path.dirname(original_path), target_type)
+
+
+@lru_cache(maxsize=None)
+def _find_example_in_dir(original_dir, target_type):
+    original_path = os.path.join(original_dir, "_")
+
     # 1. 分割路径
     parts = original_path.split(os.sep)
     if len(parts) < 2:
@@ -86,13 +101,43 @@ def find_example_image(original_path, target_type="Normal"):
     return None
 
 
-def build_multimodal_prompt(mode, img_path, current_img_base64):
-    """构建多模态对话消息列表"""
+def prefix_key(mode, img_path):
+    """few-shot 前缀的身份：(模式, Normal 示例, Anomaly 示例)。相同 key 的请求前缀逐字节相同。"""
+    pos_path = find_example_image(img_path, target_type="Normal") if mode in ["one-example", "two-examples"] else None
+    neg_path = find_example_image(img_path, target_type="Anomaly") if mode == "two-examples" else None
+    return mode, pos_path, neg_path
+
+
+# prefix_key -> 示例对话轮次（base64 与 data URL 每个类别只构建一次，各请求共用）
+_PREFIX_MESSAGES = {}
+
+
+def example_prefix(mode, img_path):
+    key = prefix_key(mode, img_path)
+    if key not in _PREFIX_MESSAGES:
+        _PREFIX_MESSAGES[key] = _build_example_prefix(*key)
+    return _PREFIX_MESSAGES[key]
+
+
+def estimate_prefix_tokens(model_name, mode, img_path):
+    """前缀的估算 token 数：示例图的视觉 token + 文本按 4 字符 / token"""
+    _, pos_path, neg_path = prefix_key(mode, img_path)
+    tokens = 0
+    for path in (pos_path, neg_path):
+        if path:
+            tokens += visual_tokens(model_name, *image_size(path))
+    for msg in example_prefix(mode, img_path):
+        content = msg["content"]
+        texts = [content] if isinstance(content, str) else [p.get("text", "") for p in content]
+        tokens += sum(len(t) for t in texts) // 4
+    return tokens
+
+
+def _build_example_prefix(mode, pos_path, neg_path):
     messages = []
-    
+
     # 1. 正常参考
-    if mode in ["one-example", "two-examples"]:
-        pos_path = find_example_image(img_path, target_type="Normal")
+    if pos_path:
         pos_b64 = encode_image(pos_path)
         if pos_b64:
             messages.append({"role": "user", "content": [
@@ -102,8 +147,7 @@ def build_multimodal_prompt(mode, img_path, current_img_base64):
             messages.append({"role": "assistant", "content": "Understood. I have analyzed the normal sample and will use it as a reference."})
 
     # 2. 异常参考
-    if mode == "two-examples":
-        neg_path = find_example_image(img_path, target_type="Anomaly")
+    if neg_path:
         neg_b64 = encode_image(neg_path)
         if neg_b64:
             messages.append({"role": "user", "content": [
@@ -111,6 +155,12 @@ def build_multimodal_prompt(mode, img_path, current_img_base64):
                 {"type": "text", "text": "This is an [Anomalous Sample] that contains defects. Please note these irregular features."}
             ]})
             messages.append({"role": "assistant", "content": "Understood. I have identified the defective features for comparison."})
+    return messages
+
+
+def build_multimodal_prompt(mode, img_path, current_img_base64):
+    """构建多模态对话消息列表：共用的示例前缀 + 当前样本"""
+    messages = list(example_prefix(mode, img_path))
 
     output_relu = f"""Strictly adhere to the following output rules\n
     1.You may perform observation and comparative analysis before answering.
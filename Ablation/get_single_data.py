@@ -1,17 +1,24 @@
 import json
 import shutil
 import os
+import sys
 from pathlib import Path
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from oddgrid_common.blob_store import BlobStore, materialize_file
+
 # ======================
 # 配置参数
 # ======================
 ONLY_ANOMALY = False    
 CLEAR_TARGET = False   
+LINK_MODE = "auto"        # auto（reflink，不支持时复制）/ reflink / copy / hardlink（与源文件共用 inode，显式开启）
+BLOB_STORE_ROOT = None    # 例如 "../.blob_store"；None 表示直接从源文件链接
 
-def extract_original_images_and_record(source_data, json_path, output_root, data_type):
+def extract_original_images_and_record(source_data, json_path, output_root, data_type, store=None):
     """
-    处理单个 JSON 任务，物理拷贝图片并返回该任务对应的 metadata 字典
+    处理单个 JSON 任务，把图片 reflink（文件系统不支持时拷贝）
+    到 output_root 并返回该任务对应的 metadata 字典
     """
     json_path = Path(json_path)
     if not json_path.exists():
@@ -77,12 +84,10 @@ def extract_original_images_and_record(source_data, json_path, output_root, data
             scale = cell.get("resize_scale", 1.0)
             local_metadata[meta_key]["resize_scale"].append(scale)
 
-            # --- 物理拷贝 ---
+            # --- 链接到目标目录 ---
             print(f"   >> 处理图片: {src_file} | 目标: {dst_file} | 异常: {is_anomaly}")
             if src_file.exists():
-                if not dst_file.exists():
-                    dst_dir.mkdir(parents=True, exist_ok=True)
-                    shutil.copy2(src_file, dst_file)
+                if materialize_file(src_file, dst_file, store=store, mode=LINK_MODE):
                     count += 1
                     if is_anomaly:
                         anomaly_count += 1
@@ -98,13 +103,15 @@ def main(DATA_NAME, SOURCE_ROOT="../Test_data", TARGET_ROOT="single_data"):
         ("iol", SOURCE_ROOT / DATA_NAME / "A_iol_type_data" / "all_iol_combined_metadata.json"),
     ]
     print(tasks)
+    store = BlobStore(BLOB_STORE_ROOT, mode=LINK_MODE) if BLOB_STORE_ROOT else None
     for d_type, json_path in tasks:
-        # 1. 提取并拷贝
+        # 1. 提取并链接
         meta, c, ac = extract_original_images_and_record(
             source_data=SOURCE_ROOT, 
             json_path=json_path, 
             output_root=TARGET_DIR, 
-            data_type=d_type
+            data_type=d_type,
+            store=store,
         )
         # 2. 如果有数据，则保存对应的 JSON 文件
         if meta:
@@ -115,6 +122,8 @@ def main(DATA_NAME, SOURCE_ROOT="../Test_data", TARGET_ROOT="single_data"):
             with open(out_json_path, 'w', encoding='utf-8') as f:
                 json.dump(meta, f, indent=4, ensure_ascii=False)
             print(f"   >> 已生成 JSON: {out_json_name} (拷贝 {c} 张)")
+    if store is not None:
+        store.close()
 
 if __name__ == "__main__":
     # datasets = ["VisA", "BTech_Dataset_transformed", "mvtec", "ELPV","MPDD","RAD", "GOODADS"]
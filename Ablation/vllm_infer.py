@@ -1,12 +1,16 @@
 import os
 os.environ.setdefault("VLLM_USE_V1", "0")
 import json
-import base64
-import requests
 import argparse
 from tqdm import tqdm
 from pathlib import Path
 from configs import BASE_DATA_DIR, SAVE_DIR, MODEL_PATH, max_new_tokens, build_multimodal_prompt, extract_answer, encode_image
+from configs import IMAGE_CACHE, PREFETCH_LOOKAHEAD, prefix_key, estimate_prefix_tokens
+from oddgrid_common.batching import group_by_prefix
+from oddgrid_common.image_cache import iter_with_prefetch
+from oddgrid_common.async_client import run_ordered
+from oddgrid_common.early_stop import DEFAULT_GRACE_TOKENS
+from oddgrid_common.response_cache import ResponseCache
 
 # ================= 配置区 =================
 API_URL = "http://localhost:8081/v1/chat/completions"
@@ -16,8 +20,8 @@ def is_qwen35_model(model_name):
     return "qwen3.5" in os.path.basename(model_name).lower()
 
 
-def call_vllm_api(messages, model_name):
-    """通过 HTTP API 调用部署好的 vLLM 服务"""
+def build_payload(messages, model_name):
+    """构建 vLLM 服务的请求体"""
     # 这里的 model 字段需要与你启动 vllm serve 时指定的名称一致
     full_model_path = os.path.join(MODEL_PATH, model_name)
     
@@ -30,17 +34,36 @@ def call_vllm_api(messages, model_name):
 
     if is_qwen35_model(model_name):
         payload["chat_template_kwargs"] = {"enable_thinking": False}
+    return payload
 
-    try:
-        response = requests.post(API_URL, json=payload, timeout=300)
-        response.raise_for_status()
-        data = response.json()
-        return data["choices"][0]["message"]["content"]
-    except Exception as e:
-        print(f"\n[ERROR] API 请求失败: {e}")
+
+def build_item_payload(img_path, mode, model_name):
+    """在 run_ordered 的工作线程里执行：编码当前待测图片 + 构建消息体"""
+    # 使用与本地脚本相同的 build_multimodal_prompt 构建消息体
+    # 注意：build_multimodal_prompt 内部会调用 find_example_image
+    current_b64 = encode_image(img_path)
+    if not current_b64:
         return None
+    return build_payload(build_multimodal_prompt(mode, img_path, current_b64), model_name)
+
+def estimate_reusable_prefix(jobs, mode, model_name):
+    """按当前顺序估算 APC 可复用的前缀 token：连续同前缀的请求只有第一条需要 prefill 前缀"""
+    reusable = 0
+    last_key = None
+    per_key = {}
+    for info, img_path in jobs:
+        key = prefix_key(mode, img_path)
+        if key == last_key and (key[1] or key[2]):
+            if key not in per_key:
+                per_key[key] = estimate_prefix_tokens(model_name, mode, img_path)
+            reusable += per_key[key]
+        last_key = key
+    return reusable
+
 
-def run_inference(data_type, dataset_name, model_name, mode):
+def run_inference(data_type, dataset_name, model_name, mode,
+                  concurrency=8, api_url=API_URL, timeout=300, max_retries=3,
+                  use_cache=True, cache_ttl=None, early_stop=None, order="prefix"):
     # --- 1. 构建输入与输出路径 ---
     json_input_path = os.path.join(BASE_DATA_DIR, f"{dataset_name}_{data_type}.json")
     
@@ -74,7 +97,8 @@ def run_inference(data_type, dataset_name, model_name, mode):
     # --- 3. 遍历索引进行 API 推理 ---
     print(f"\n[START] 模式: {mode} | 任务: {dataset_name} | 类型: {data_type}")
 
-    for meta_key, info in tqdm(image_metadata.items()):
+    jobs = []
+    for meta_key, info in image_metadata.items():
         img_path = info.get("physical_path")
         if not img_path or not os.path.exists(img_path) or img_path in processed_paths:
             continue
@@ -82,50 +106,86 @@ def run_inference(data_type, dataset_name, model_name, mode):
         label = info.get("label", "").lower()
         if label not in ["anomaly", "normal"]:
             continue
+        jobs.append((info, img_path))
 
-        try:
-            # 编码当前待测图片
-            current_b64 = encode_image(img_path)
-            
-            # 使用与本地脚本相同的 build_multimodal_prompt 构建消息体
-            # 注意：build_multimodal_prompt 内部会调用 find_example_image
-            messages = build_multimodal_prompt(mode, img_path, current_b64)
-            
-            # 调用 API (传入完整的 messages 列表)
-            predict_answer = call_vllm_api(messages, model_name)
-            
-            if predict_answer is None:
-                continue
-                
-            extract_ans = extract_answer(predict_answer)
-            
-            # 构造结果项
-            res_item = {
-                "filename": info.get("filename"),
-                "path": img_path,
-                "gt_label": info.get("label"),
-                "predict": predict_answer,
-                "mode": mode,
-                "data_type": data_type,
-                "dataset_name": dataset_name,
-                "model_name": model_name,
-                "extract_answer": extract_ans,
-                "gt": "no" if info.get("label") == "normal" else "yes",
-                "resize_scale": info.get("resize_scale"),
-                "original_count": info.get("count")
-            }
-            
-            # --- 4. 实时保存 ---
-            all_results.append(res_item)
-            with open(save_path, "w", encoding="utf-8") as f:
-                json.dump(all_results, f, ensure_ascii=False, indent=4)
-            
-            processed_paths.add(img_path)
-            
-        except Exception as e:
-            print(f"\n[ERROR] 处理失败 {img_path}: {e}")
-            continue
+    # few-shot 模式下同一类别的请求共用示例前缀：排在一起让服务端前缀缓存连续命中
+    if order == "prefix" and mode != "zero-shot":
+        reusable_before = estimate_reusable_prefix(jobs, mode, model_name)
+        jobs, groups = group_by_prefix(jobs, lambda job: prefix_key(mode, job[1]))
+        print(
+            f"[PREFIX] {len(groups)} prefix groups over {len(jobs)} requests; "
+            f"est. reusable prefix tokens {reusable_before} -> {estimate_reusable_prefix(jobs, mode, model_name)}"
+        )
+    # 服务端实际命中的前缀 token（vllm serve --enable-prompt-tokens-details 时 usage 里才有）
+    prefix_stats = {"prompt_tokens": 0, "cached_tokens": 0, "reported": 0}
+
+    response_cache = ResponseCache(ttl=cache_ttl, enabled=use_cache)
+    pbar = tqdm(total=len(jobs))
+
+    def on_result(job, result):
+        pbar.update(1)
+        info, img_path = job
+        predict_answer = result["text"]
+        if predict_answer is None:
+            print(f"\n[ERROR] API 请求失败 {img_path}: {result['error']}")
+            return
+
+        extract_ans = extract_answer(predict_answer)
+        usage = result.get("usage") or {}
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        if cached_tokens is not None:
+            prefix_stats["reported"] += 1
+            prefix_stats["cached_tokens"] += cached_tokens
+            prefix_stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        
+        # 构造结果项
+        res_item = {
+            "filename": info.get("filename"),
+            "path": img_path,
+            "gt_label": info.get("label"),
+            "predict": predict_answer,
+            "mode": mode,
+            "data_type": data_type,
+            "dataset_name": dataset_name,
+            "model_name": model_name,
+            "extract_answer": extract_ans,
+            "gt": "no" if info.get("label") == "normal" else "yes",
+            "resize_scale": info.get("resize_scale"),
+            "original_count": info.get("count"),
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "cached_tokens": cached_tokens,
+        }
+        
+        # --- 4. 实时保存（按输入顺序回调）---
+        all_results.append(res_item)
+        with open(save_path, "w", encoding="utf-8") as f:
+            json.dump(all_results, f, ensure_ascii=False, indent=4)
+        
+        processed_paths.add(img_path)
+
+    run_ordered(
+        iter_with_prefetch(jobs, lambda job: [job[1]], IMAGE_CACHE, PREFETCH_LOOKAHEAD),
+        lambda job: build_item_payload(job[1], mode, model_name),
+        on_result,
+        api_url,
+        concurrency=concurrency,
+        timeout=timeout,
+        max_retries=max_retries,
+        cache=response_cache,
+        # 提前停止靠断开流式连接实现
+        stream=early_stop is not None,
+        early_stop=early_stop,
+    )
+    pbar.close()
+    response_cache.report()
+    if prefix_stats["reported"]:
+        s = prefix_stats
+        print(
+            f"[PREFIX] server cached_tokens={s['cached_tokens']}/{s['prompt_tokens']} prompt tokens "
+            f"({s['cached_tokens'] / max(s['prompt_tokens'], 1):.1%}) over {s['reported']} requests"
+        )
     
+    IMAGE_CACHE.report()
     print(f"\n[SUCCESS] 处理完成，结果保存在: {save_path}")
 
 if __name__ == "__main__":
@@ -136,6 +196,22 @@ if __name__ == "__main__":
     # 增加 mode 参数
     parser.add_argument("--mode", type=str, default="two-examples", 
                         choices=["zero-shot", "one-example", "two-examples"])
+    parser.add_argument("--api_url", type=str, default=API_URL)
+    parser.add_argument("--concurrency", type=int, default=8, help="同时在飞的请求数")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--max_retries", type=int, default=3)
+    parser.add_argument("--no_cache", action="store_true", help="不读写推理结果缓存")
+    parser.add_argument("--cache_ttl", type=float, default=None, help="缓存有效期（秒），默认不过期")
+    parser.add_argument("--order", type=str, default="prefix", choices=["prefix", "input"],
+                        help="prefix：同一 few-shot 前缀的请求排在一起（命中 vLLM 前缀缓存）；input：按索引顺序")
+    parser.add_argument("--early_stop", action="store_true", help="答案 \\boxed{} 闭合后断开流式请求（会改用流式接口）")
+    parser.add_argument("--early_stop_grace", type=int, default=DEFAULT_GRACE_TOKENS,
+                        help="boxed 闭合后再收多少个 token 没有新 boxed 就停")
     args = parser.parse_args()
 
-    run_inference(args.type, args.dataset, args.model_name, args.mode)
\ No newline at end of file
+    run_inference(args.type, args.dataset, args.model_name, args.mode,
+                  concurrency=args.concurrency, api_url=args.api_url,
+                  timeout=args.timeout, max_retries=args.max_retries,
+                  use_cache=not args.no_cache, cache_ttl=args.cache_ttl,
+                  early_stop=args.early_stop_grace if args.early_stop else None,
+                  order=args.order)
\ No newline at end of file
@@ -8,8 +8,9 @@ import re
 import glob
 from tqdm import tqdm
 from vllm import LLM, SamplingParams
-from types import SimpleNamespace
 from configs import MODEL_PATH, BASE_DATA_DIR, SAVE_DIR, max_new_tokens, encode_image, extract_answer, build_multimodal_prompt
+from configs import batch_size, max_batch_images, hf_max_batch_images
+from oddgrid_common.batching import ThroughputMeter, plan_batches, run_batched
 
 # 配置路径
 EXAMPLE_DIR = "./examples"
@@ -32,60 +33,16 @@ def is_internvl_model(model_name):
     return "internvl" in os.path.basename(model_name).lower()
 
 
-class TransformersChatModel:
-    def __init__(self, model_path):
-        from transformers import AutoModelForImageTextToText, AutoProcessor
-
-        self.processor = AutoProcessor.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-        )
-        self.model = AutoModelForImageTextToText.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-            torch_dtype=torch.bfloat16,
-            device_map="auto",
-        )
-        self.model.eval()
-
-    def chat(self, messages, sampling_params, **kwargs):
-        template_kwargs = kwargs.pop("chat_template_kwargs", {})
-        kwargs.update(template_kwargs)
-        inputs = self.processor.apply_chat_template(
-            messages,
-            add_generation_prompt=True,
-            tokenize=True,
-            return_dict=True,
-            return_tensors="pt",
-            **kwargs,
-        )
-        inputs = {
-            key: value.to(self.model.device) if hasattr(value, "to") else value
-            for key, value in inputs.items()
-        }
-        input_len = inputs["input_ids"].shape[-1]
-        with torch.inference_mode():
-            generated = self.model.generate(
-                **inputs,
-                do_sample=False,
-                max_new_tokens=sampling_params.max_tokens,
-            )
-        text = self.processor.decode(
-            generated[0][input_len:],
-            skip_special_tokens=True,
-        )
-        return [SimpleNamespace(outputs=[SimpleNamespace(text=text)])]
-
-
 def get_vllm_model(model_name):
     global _VLLM_MODEL
     if _VLLM_MODEL is None:
         tp = torch.cuda.device_count()
         model_path = os.path.join(MODEL_PATH, model_name)
-        # if needs_transformers_fallback(model_name):
-        #     print(f"[INFO] {model_name} is not supported by vLLM 0.8.x; using Transformers fallback.")
-        #     _VLLM_MODEL = TransformersChatModel(model_path)
-        #     return _VLLM_MODEL
+        if needs_transformers_fallback(model_name):
+            print(f"[INFO] {model_name} is not supported by vLLM 0.8.x; using Transformers fallback.")
+            from oddgrid_common.hf_fallback import TransformersChatModel
+            _VLLM_MODEL = TransformersChatModel(model_path, max_batch_size=batch_size, max_batch_images=hf_max_batch_images)
+            return _VLLM_MODEL
 
         llm_kwargs = {
             "model": model_path,
@@ -145,51 +102,66 @@ def run_inference(data_type, dataset_name, model_name, mode):
 
     print(f"[INFO] 剩余待处理 {len(pending_items)} 条记录，开始加载模型")
     llm = get_vllm_model(model_name)
-    
-    for meta_key, info in tqdm(pending_items):
-        img_path = info.get("physical_path")
 
-        try:
-            image_base64 = encode_image(img_path)
-            # 动态构建包含示例的消息
-            messages = build_multimodal_prompt(mode, img_path, image_base64)
-            chat_kwargs = {}
-            if is_qwen35_model(model_name):
-                chat_kwargs["chat_template_kwargs"] = {"enable_thinking": False}
-
-            outputs = llm.chat(
-                messages=messages, 
-                sampling_params=SamplingParams(temperature=0, max_tokens=max_new_tokens),
-                **chat_kwargs,
-            )
-            
-            predict_answer = outputs[0].outputs[0].text
-            extract_ans = extract_answer(predict_answer)
-            
-            res_item = {
-                "filename": info.get("filename"),
-                "path": img_path,
-                "gt_label": info.get("label"),
-                "predict": predict_answer,
-                "data_type": data_type,
-                "dataset_name": dataset_name,
-                "model_name": model_name,
-                "extract_answer": extract_ans,
-                "gt": "no" if info.get("label") == "normal" else "yes",
-                # 保留新模式中的扩展字段
-                "resize_scale": info.get("resize_scale"),
-                "original_count": info.get("count")
-            }
-            
-            all_results.append(res_item)
-            with open(save_path, "w", encoding="utf-8") as f:
-                json.dump(all_results, f, ensure_ascii=False, indent=4)
-            
-            processed_paths.add(img_path)
-
-        except Exception as e:
-            print(f"\n[ERROR] {img_path}: {e}")
-            continue
+    chat_kwargs = {}
+    if is_qwen35_model(model_name):
+        chat_kwargs["chat_template_kwargs"] = {"enable_thinking": False}
+    sampling_params = SamplingParams(temperature=0, max_tokens=max_new_tokens)
+
+    # 每次 llm.chat 提交一组 conversation（条数 / 图片数预算见 configs）；图片数 = 示例图 + 当前图
+    # run_batched：整组失败（坏图、超长 prompt）时逐条重试，只丢真正失败的那条
+    n_images = 1 + {"zero-shot": 0, "one-example": 1}.get(mode, 2)
+    items = [
+        {"key": info.get("physical_path"), "meta_key": meta_key, "info": info, "num_images": n_images}
+        for meta_key, info in pending_items
+    ]
+    batch_kwargs = {"max_batch_size": batch_size, "max_images": max_batch_images}
+
+    def submit(batch):
+        conversations = [
+            build_multimodal_prompt(mode, item["key"], encode_image(item["key"]))   # 动态构建包含示例的消息
+            for item in batch
+        ]
+        outputs = llm.chat(messages=conversations, sampling_params=sampling_params, **chat_kwargs)
+        return [output.outputs[0].text for output in outputs]
+
+    def on_result(item, predict_answer):
+        pbar.update(1)
+        if predict_answer is None:
+            return
+        info = item["info"]
+        img_path = item["key"]
+        extract_ans = extract_answer(predict_answer)
+
+        res_item = {
+            "filename": info.get("filename"),
+            "path": img_path,
+            "gt_label": info.get("label"),
+            "predict": predict_answer,
+            "data_type": data_type,
+            "dataset_name": dataset_name,
+            "model_name": model_name,
+            "extract_answer": extract_ans,
+            "gt": "no" if info.get("label") == "normal" else "yes",
+            # 保留新模式中的扩展字段
+            "resize_scale": info.get("resize_scale"),
+            "original_count": info.get("count")
+        }
+
+        all_results.append(res_item)
+        processed_paths.add(img_path)
+
+    pbar = tqdm(total=len(items))
+    meter = ThroughputMeter()
+    for batch in plan_batches(items, **batch_kwargs):
+        run_batched(batch, submit, on_result, batch_kwargs=batch_kwargs, meter=meter)
+        # 每组写一次（原来每条样本整文件重写）
+        with open(save_path, "w", encoding="utf-8") as f:
+            json.dump(all_results, f, ensure_ascii=False, indent=4)
+    pbar.close()
+    meter.report()
+    if hasattr(llm, "report"):
+        llm.report()    # Transformers 兜底：generate 分组统计
 
 if __name__ == "__main__":
     import argparse
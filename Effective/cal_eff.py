@@ -27,6 +27,39 @@ def get_num_images(item, data_type):
     return 1
 
 
+# 逐请求指标：inference_time 为整体耗时，其余来自流式接口（旧结果文件里没有则跳过）
+# cache_hit=True 的记录（--use_cache 命中）时延是缓存里别的运行留下的，所有耗时 / 吞吐统计都不计入
+LATENCY_KEYS = ["inference_time", "ttft", "itl", "decode_tps", "encode_time"]
+PERCENTILES = [50, 90, 99]
+
+
+def percentile(values, q):
+    """线性插值百分位（与 numpy.percentile 默认一致）"""
+    values = sorted(values)
+    if not values:
+        return None
+    pos = (len(values) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def measured(data):
+    return [item for item in data if not item.get("cache_hit")]
+
+
+def latency_stats(data):
+    data = measured(data)
+    stats = {}
+    for key in LATENCY_KEYS:
+        values = [item[key] for item in data if isinstance(item.get(key), (int, float))]
+        stats[f"{key}_avg"] = round(sum(values) / len(values), 4) if values else ""
+        for q in PERCENTILES:
+            v = percentile(values, q)
+            stats[f"{key}_p{q}"] = round(v, 4) if v is not None else ""
+    return stats
+
+
 def process_file(file_path, data_type):
     with open(file_path, "r", encoding="utf-8") as f:
         data = json.load(f)
@@ -36,7 +69,7 @@ def process_file(file_path, data_type):
     has_output_tokens = False
     total_images = 0
 
-    for item in data:
+    for item in measured(data):
         t = item.get("inference_time", None)
         if t is None:
             continue
@@ -56,11 +89,13 @@ def process_file(file_path, data_type):
     return {
         "file": os.path.basename(file_path),
         "samples": len(data),
+        "cache_hits": len(data) - len(measured(data)),
         "total_images": total_images,
         "total_time": round(total_time, 4),
         "avg_per_image_time": round(total_time / total_images, 2),
         "total_output_tokens": total_output_tokens if has_output_tokens else "",
-        "avg_per_image_output_tokens": round(total_output_tokens / total_images, 2) if has_output_tokens else ""
+        "avg_per_image_output_tokens": round(total_output_tokens / total_images, 2) if has_output_tokens else "",
+        **latency_stats(data),
     }
 
 
@@ -82,7 +117,11 @@ def main():
 
             rows.append(res)
 
-            print(f"{res['file']} -> {res['avg_per_image_time']}")
+            print(
+                f"{res['file']} -> {res['avg_per_image_time']} | "
+                f"latency p50/p90/p99: {res['inference_time_p50']}/{res['inference_time_p90']}/{res['inference_time_p99']} | "
+                f"ttft p50/p99: {res['ttft_p50']}/{res['ttft_p99']}"
+            )
 
         # ===== 写该类型的 CSV =====
         csv_path = os.path.join(SAVE_DIR, f"{t}.csv")
@@ -91,11 +130,14 @@ def main():
             writer = csv.DictWriter(f, fieldnames=[
                 "file",
                 "samples",
+                "cache_hits",
                 "total_images",
                 "total_time",
                 "avg_per_image_time",
                 "total_output_tokens",
-                "avg_per_image_output_tokens"
+                "avg_per_image_output_tokens",
+                *[f"{key}_{stat}" for key in LATENCY_KEYS
+                  for stat in ["avg"] + [f"p{q}" for q in PERCENTILES]],
             ])
             writer.writeheader()
             writer.writerows(rows)
@@ -1,27 +1,40 @@
 import os
+import sys
 import argparse
 import json
-import base64
-import requests
 import random
 import time
+from itertools import takewhile
 from tqdm import tqdm
 
 from configs_iol import get_configs, max_new_tokens
 from utils_iol import *
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from oddgrid_common.async_client import run_ordered
+from oddgrid_common.early_stop import DEFAULT_GRACE_TOKENS
+from oddgrid_common.image_cache import Base64LRUCache, iter_with_prefetch
+from oddgrid_common.response_cache import ResponseCache
+from oddgrid_common.results_store import ResultsWriter, load_processed_keys, compact_results, iter_results, update_header
+from oddgrid_common.screening import stratified_order
+from oddgrid_common.sequential import SequentialStopper
+from oddgrid_common.warehouse import score_sample
+
 API_URL = "http://localhost:8081/v1/chat/completions"
 
+# base64 LRU 缓存 + 后台预取下一条样本的图片
+IMAGE_CACHE = Base64LRUCache()
+PREFETCH_LOOKAHEAD = 2
+
 def is_qwen35_model(model_path):
     return "qwen3.5" in os.path.basename(model_path).lower()
 
 
-def call_vllm_server(prompt, image_paths, model_path):
+def build_payload(prompt, image_paths, model_path):
     messages = [{"role": "user", "content": []}]
 
     for img_path in image_paths:
-        with open(img_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode("utf-8")
+        b64 = IMAGE_CACHE.get(img_path)
         messages[0]["content"].append({
             "type": "image_url",
             "image_url": {"url": f"data:image/png;base64,{b64}"}
@@ -42,17 +55,12 @@ def call_vllm_server(prompt, image_paths, model_path):
     if is_qwen35_model(model_path):
         payload["chat_template_kwargs"] = {"enable_thinking": False}
 
-    resp = None
-    try:
-        resp = requests.post(API_URL, json=payload, timeout=600)
-        resp.raise_for_status()
-        data = resp.json()
-        usage = data.get("usage", {})
-        return data["choices"][0]["message"]["content"], usage
-    except Exception as e:
-        msg = resp.text[:300] if resp is not None else str(e)
-        print(f"[ERROR] vLLM request failed: {msg}")
-        return None, {}
+    return payload
+
+
+def get_image_paths(data, image_dir):
+    image_names = [data.get("image")]
+    return [os.path.join(image_dir, img_name) for img_name in image_names]
 
 
 def run_vllm_http(args):
@@ -67,16 +75,11 @@ def run_vllm_http(args):
 
     # ===== 已处理数据 =====
     processed_ids = set()
-    all_results = []
-
-    if os.path.exists(save_json_path):
-        with open(save_json_path, "r", encoding="utf-8") as f:
-            try:
-                all_results = json.load(f)
-                processed_ids = {item["id"] for item in all_results if "id" in item}
-                print(f"[INFO] Resume: {len(processed_ids)} processed")
-            except:
-                print("[WARNING] Failed to load existing results")
+    try:
+        processed_ids = load_processed_keys(save_json_path)
+        print(f"[INFO] Resume: {len(processed_ids)} processed")
+    except Exception:
+        print("[WARNING] Failed to load existing results")
 
     # ===== 读取数据 =====
     with open(json_path, 'r', encoding='utf-8') as f:
@@ -92,7 +95,19 @@ def run_vllm_http(args):
     # ===== 随机采样：只补足到 sample_num，总量不重复超过目标数 =====
     remaining_quota = max(args.sample_num - len(processed_ids), 0)
     random.seed(42)
-    if len(valid_data) > remaining_quota:
+    stopper = None
+    if getattr(args, "target_precision", None):
+        # 序贯评测：分层随机顺序，EM / F1 置信区间够窄就停；sample_num 仍是上限
+        valid_data = stratified_order(valid_data, strata_key, 42)[:remaining_quota]
+        stopper = SequentialStopper(
+            args.target_precision,
+            confidence=getattr(args, "confidence", 0.95),
+            metric=getattr(args, "sequential_metric", "EM"),
+            population=min(args.sample_num, len(json_data)),
+        )
+        for record in iter_results(save_json_path):
+            stopper.add(*score_sample(record, "iol"))
+    elif len(valid_data) > remaining_quota:
         valid_data = random.sample(valid_data, remaining_quota)
 
     print(f"[INFO] Target samples: {args.sample_num}")
@@ -104,27 +119,36 @@ def run_vllm_http(args):
     token_list = []
     image_count_list = []
 
-    for data in tqdm(valid_data):
-        id = data.get("id")
-
-        image_names = [data.get("image")]
-        image_paths = [os.path.join(configs_para["image_dir"], img_name) for img_name in image_names]
+    writer = ResultsWriter(save_json_path)
+    image_dir = configs_para["image_dir"]
+    jobs = []
+    for data in valid_data:
         grid_size = data.get("grid_size") or [1, 1]
-        image_count = grid_size[0] * grid_size[1] if isinstance(grid_size, (list, tuple)) and len(grid_size) >= 2 else 1
-
-        prompt = build_prompt(data)
-
-        # ===== 单条计时 =====
-        start_time = time.time()
-
-        predict_answer, usage = call_vllm_server(prompt, image_paths, model_path)
-
-        end_time = time.time()
-        elapsed_time = end_time - start_time
+        jobs.append({
+            "data": data,
+            "prompt": build_prompt(data),
+            "image_paths": get_image_paths(data, image_dir),
+            "image_count": grid_size[0] * grid_size[1] if isinstance(grid_size, (list, tuple)) and len(grid_size) >= 2 else 1,
+        })
 
+    early_stop = getattr(args, "early_stop_grace", DEFAULT_GRACE_TOKENS) if getattr(args, "early_stop", False) else None
+    if early_stop is not None and getattr(args, "no_stream", False):
+        print("[WARN] --early_stop 需要流式接口，--no_stream 下不生效")
+    response_cache = ResponseCache(
+        ttl=getattr(args, "cache_ttl", None),
+        enabled=getattr(args, "use_cache", False),   # 效率测评默认不走缓存：命中时时延字段是旧值
+    )
+    pbar = tqdm(total=len(jobs))
+
+    def on_result(job, result):
+        # run_ordered 按 jobs 顺序回调，写盘顺序与串行版本一致
+        pbar.update(1)
+        predict_answer, usage = result["text"], result["usage"]
         if predict_answer is None:
-            continue
+            print(f"[ERROR] vLLM request failed: {result['error']}")
+            return
 
+        data = job["data"]
         extract_answer = extract_answer_from_response(predict_answer)
 
         # GT
@@ -134,10 +158,10 @@ def run_vllm_http(args):
             rows_cols.append((odd.get("row"), odd.get("col")))
 
         save_item = {
-            "id": id,
+            "id": data.get("id"),
             "image": data.get("image"),
             "class": data.get("class", ""),
-            "prompt": prompt,
+            "prompt": job["prompt"],
             "predict_answer": predict_answer,
             "extract_answer": extract_answer,
             "answer": rows_cols if rows_cols else data.get("odd_rows_cols", []),
@@ -146,23 +170,57 @@ def run_vllm_http(args):
             "grid_size": str(data.get("grid_size")),
 
             # 🔥 新增
-            "inference_time": elapsed_time,
+            "inference_time": result["latency"],
             "prompt_tokens": usage.get("prompt_tokens"),
             "completion_tokens": usage.get("completion_tokens"),
-            "total_tokens": usage.get("total_tokens")
+            "total_tokens": usage.get("total_tokens"),
+
+            # 流式指标（--no_stream 时为 None）
+            "ttft": result.get("ttft"),
+            "itl": result.get("itl"),
+            "decode_tps": result.get("decode_tps"),
+            "encode_time": result.get("encode_time"),
+            "cache_hit": result.get("cache_hit"),
+            "early_stopped": result.get("early_stopped"),
         }
 
-        all_results.append(save_item)
-        time_list.append(elapsed_time)
+        writer.write(save_item)
+        if stopper is not None:
+            stopper.add(*score_sample(save_item, "iol"))
+        if not result.get("cache_hit"):
+            time_list.append(result["latency"])
         if usage.get("total_tokens") is not None:
             token_list.append(usage["total_tokens"])
-            image_count_list.append(image_count)
-
-        # ===== 实时保存 =====
-        with open(save_json_path, "w", encoding="utf-8") as f:
-            json.dump(all_results, f, ensure_ascii=False, indent=4)
-
-        processed_ids.add(id)
+            image_count_list.append(job["image_count"])
+
+        processed_ids.add(data.get("id"))
+
+    job_iter = iter_with_prefetch(jobs, lambda job: job["image_paths"], IMAGE_CACHE, PREFETCH_LOOKAHEAD)
+    if stopper is not None:
+        # 序贯评测：停了之后不再拉新任务（在飞的请求照常写盘）
+        job_iter = takewhile(lambda job: not stopper.stopped, job_iter)
+    run_ordered(
+        job_iter,
+        lambda job: build_payload(job["prompt"], job["image_paths"], model_path),
+        on_result,
+        getattr(args, "api_url", API_URL),
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        max_retries=args.max_retries,
+        stream=not getattr(args, "no_stream", False),
+        cache=response_cache,
+        early_stop=early_stop,
+    )
+    pbar.close()
+    response_cache.report()
+
+    writer.close()
+    compact_results(save_json_path)
+    if stopper is not None:
+        stopper.report()
+        update_header(save_json_path, sequential=stopper.header())
+    else:
+        update_header(save_json_path, sequential=None)
 
     # ===== 统计 =====
     total_time = time.time() - global_start
@@ -185,6 +243,7 @@ def run_vllm_http(args):
             print(f"总token: {total_tokens}")
             print(f"平均每图token: {total_tokens / total_images:.2f}")
 
+    IMAGE_CACHE.report()
     print(f"\n[SUCCESS] Saved to {save_json_path}")
 
 
@@ -197,6 +256,22 @@ def main():
 
     # 🔥 新增参数
     parser.add_argument("--sample_num", type=int, default=100)
+    parser.add_argument("--api_url", type=str, default=API_URL)
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="同时在飞的请求数；>1 时 inference_time 包含服务端排队 / 批处理的影响")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--max_retries", type=int, default=3)
+    parser.add_argument("--no_stream", action="store_true", help="不用流式接口（不记录 TTFT / ITL）")
+    parser.add_argument("--use_cache", action="store_true",
+                        help="读写推理结果缓存；命中的记录带 cache_hit=True，时延是缓存里的旧值，cal_eff 不计入")
+    parser.add_argument("--cache_ttl", type=float, default=None, help="缓存有效期（秒），默认不过期")
+    parser.add_argument("--early_stop", action="store_true", help="答案 \\boxed{} 闭合后断开流式请求（需要流式接口）")
+    parser.add_argument("--early_stop_grace", type=int, default=DEFAULT_GRACE_TOKENS,
+                        help="boxed 闭合后再收多少个 token 没有新 boxed 就停")
+    parser.add_argument("--target_precision", type=float, default=None,
+                        help="序贯评测：置信区间半宽（百分点）达到后停止，例如 1.5；--sample_num 仍是上限")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--sequential_metric", choices=["EM", "F1", "both"], default="EM")
 
     args = parser.parse_args()
 
@@ -0,0 +1,304 @@
+import os
+import argparse
+import asyncio
+import csv
+import json
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+
+from PIL import Image
+
+import iol_eff
+import soi_eff
+import single_eff
+from configs_iol import get_configs as get_iol_configs
+from configs_soi import get_configs as get_soi_configs
+from cal_eff import percentile
+from oddgrid_common.async_client import AsyncChatClient
+from oddgrid_common.stub_openai_server import start_stub_server
+
+# ======================
+# 并发扫描 / Poisson 到达率压测
+# ======================
+# 请求混合与 iol_eff / soi_eff / single_eff 实际发出的请求一致（同样的 prompt + 原图），
+# 所有 payload 在压测开始前构建好，测量的只是服务端。
+#
+#   闭环：--concurrency 1,2,4,...,128  每档保持 c 条在飞，共 --requests_per_level 条
+#   开环：--rates 1,2,4               每秒到达数，指数分布间隔，不等前一条返回
+#
+# 输出 <out_dir>/load_bench.json 与 load_bench.csv（吞吐-延迟曲线、错误率、token 吞吐）。
+# --stub 启动本地假服务（CI 用）；找不到测试集时用合成图片代替。
+
+DEFAULT_LEVELS = "1,2,4,8,16,32,64,128"
+
+
+# ======================
+# 请求池
+# ======================
+def _load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iol_payloads(data_type, model_name, n, rng):
+    configs = get_iol_configs(SimpleNamespace(data_type=data_type, model_name=model_name, image_type="normal"))
+    if not os.path.exists(configs["json_path"]):
+        return []
+    data = _load_json(configs["json_path"])
+    out = []
+    for d in rng.sample(data, min(n, len(data))):
+        image_paths = iol_eff.get_image_paths(d, configs["image_dir"])
+        out.append(("iol", iol_eff.build_payload(iol_eff.build_prompt(d), image_paths, configs["model_path"])))
+    return out
+
+
+def soi_payloads(data_type, model_name, n, rng):
+    configs = get_soi_configs(SimpleNamespace(data_type=data_type, model_name=model_name, image_type="normal"))
+    if not os.path.exists(configs["json_path"]):
+        return []
+    data = _load_json(configs["json_path"])
+    out = []
+    for d in rng.sample(data, min(n, len(data))):
+        image_paths = soi_eff.get_image_paths(d, configs["image_dir"])
+        out.append(("soi", soi_eff.build_payload(soi_eff.build_prompt(image_paths), image_paths, configs["model_path"])))
+    return out
+
+
+def single_payloads(data_type, dataset, model_name, mode, n, rng):
+    json_path = os.path.join(single_eff.BASE_DATA_DIR, f"{dataset}_{data_type}.json")
+    if not os.path.exists(json_path):
+        return []
+    items = list(_load_json(json_path).values())
+    out = []
+    for info in rng.sample(items, min(n, len(items))):
+        payload = single_eff.build_item_payload("../Ablation/" + info["physical_path"], mode, model_name)
+        if payload is not None:
+            out.append(("single", payload))
+    return out
+
+
+def synthetic_payloads(model_name, n, rng, tmp_dir):
+    """测试集不在本机时（CI）：合成网格 / 图标 / 单图，prompt 仍来自各脚本的 build_prompt"""
+    model_path = os.path.join(single_eff.MODEL_PATH, model_name)
+    out = []
+    for i in range(n):
+        rows = cols = rng.choice([3, 4, 5])
+        grid = os.path.join(tmp_dir, f"grid_{i}.png")
+        Image.new("RGB", (cols * 64, rows * 64), tuple(rng.randrange(256) for _ in range(3))).save(grid)
+        out.append(("iol", iol_eff.build_payload(
+            iol_eff.build_prompt({"grid_size": [rows, cols]}), [grid], model_path)))
+
+        icons = []
+        for k in range(rng.choice([6, 9, 12])):
+            icon = os.path.join(tmp_dir, f"icon_{i}_{k}.png")
+            Image.new("RGB", (64, 64), tuple(rng.randrange(256) for _ in range(3))).save(icon)
+            icons.append(icon)
+        out.append(("soi", soi_eff.build_payload(soi_eff.build_prompt(icons), icons, model_path)))
+
+        single = os.path.join(tmp_dir, f"single_{i}.png")
+        Image.new("RGB", (256, 256), tuple(rng.randrange(256) for _ in range(3))).save(single)
+        out.append(("single", single_eff.build_payload(
+            single_eff.build_multimodal_prompt("zero-shot", single, single_eff.encode_image(single)), model_name)))
+    return out
+
+
+def build_request_pool(args, rng, tmp_dir):
+    pool = []
+    kinds = set(args.kinds.split(","))
+    if "iol" in kinds:
+        pool += iol_payloads(args.data_type, args.model_name, args.samples_per_kind, rng)
+    if "soi" in kinds:
+        pool += soi_payloads(args.data_type, args.model_name, args.samples_per_kind, rng)
+    if "single" in kinds:
+        pool += single_payloads(args.single_type, args.single_dataset, args.model_name,
+                                args.single_mode, args.samples_per_kind, rng)
+    if not pool:
+        print("[WARN] 找不到测试集，使用合成请求")
+        pool = [p for p in synthetic_payloads(args.model_name, args.samples_per_kind, rng, tmp_dir)
+                if p[0] in kinds]
+    rng.shuffle(pool)
+    return pool
+
+
+# ======================
+# 压测
+# ======================
+async def _send(client, kind, payload, stream, records, t0):
+    start = time.perf_counter()
+    result = await client.chat(payload, stream=stream)
+    records.append({
+        "kind": kind,
+        "start": start - t0,
+        "end": time.perf_counter() - t0,
+        **result,
+    })
+
+
+async def run_closed_loop(client, pool, concurrency, n_requests, stream):
+    """保持 concurrency 条在飞，直到发完 n_requests 条"""
+    records = []
+    counter = iter(range(n_requests))
+    t0 = time.perf_counter()
+
+    async def worker():
+        for i in counter:
+            kind, payload = pool[i % len(pool)]
+            await _send(client, kind, payload, stream, records, t0)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return records, time.perf_counter() - t0
+
+
+async def run_open_loop(client, pool, rate, n_requests, stream, rng):
+    """Poisson 到达：间隔 ~ Exp(rate)，不等待前面的请求返回"""
+    records = []
+    tasks = []
+    t0 = time.perf_counter()
+    next_at = 0.0
+    for i in range(n_requests):
+        next_at += rng.expovariate(rate)
+        delay = next_at - (time.perf_counter() - t0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind, payload = pool[i % len(pool)]
+        tasks.append(asyncio.create_task(_send(client, kind, payload, stream, records, t0)))
+    await asyncio.gather(*tasks)
+    return records, time.perf_counter() - t0
+
+
+def summarize(mode, level, records, duration):
+    ok = [r for r in records if r["text"] is not None]
+    latencies = [r["latency"] for r in ok if r.get("latency") is not None]
+    ttfts = [r["ttft"] for r in ok if r.get("ttft") is not None]
+    itls = [r["itl"] for r in ok if r.get("itl") is not None]
+    out_tokens = sum(r["usage"].get("completion_tokens") or 0 for r in ok)
+    all_tokens = sum(r["usage"].get("total_tokens") or 0 for r in ok)
+
+    def pct(values, q):
+        v = percentile(values, q)
+        return round(v, 4) if v is not None else None
+
+    row = {
+        "mode": mode,
+        "level": level,
+        "requests": len(records),
+        "ok": len(ok),
+        "errors": len(records) - len(ok),
+        "error_rate": round((len(records) - len(ok)) / max(len(records), 1), 4),
+        "duration": round(duration, 3),
+        "throughput_rps": round(len(ok) / duration, 3) if duration > 0 else None,
+        "output_tok_s": round(out_tokens / duration, 2) if duration > 0 else None,
+        "total_tok_s": round(all_tokens / duration, 2) if duration > 0 else None,
+        "latency_mean": round(sum(latencies) / len(latencies), 4) if latencies else None,
+    }
+    for q in (50, 90, 99):
+        row[f"latency_p{q}"] = pct(latencies, q)
+    for q in (50, 99):
+        row[f"ttft_p{q}"] = pct(ttfts, q)
+    row["itl_p50"] = pct(itls, 50)
+
+    by_kind = {}
+    for r in records:
+        k = by_kind.setdefault(r["kind"], {"requests": 0, "errors": 0})
+        k["requests"] += 1
+        k["errors"] += r["text"] is None
+    row["by_kind"] = by_kind
+    return row
+
+
+async def run_bench(args, pool):
+    levels = [float(x) if args.rates else int(x) for x in (args.rates or args.concurrency).split(",")]
+    mode = "poisson" if args.rates else "closed"
+    rng = random.Random(args.seed)
+    rows = []
+
+    max_conn = max(int(max(levels)) if mode == "closed" else args.max_connections, 1)
+    async with AsyncChatClient(args.api_url, concurrency=max_conn,
+                               timeout=args.timeout, max_retries=args.max_retries) as client:
+        if args.warmup:
+            await run_closed_loop(client, pool, min(4, len(pool)), args.warmup, args.stream)
+
+        for level in levels:
+            if mode == "closed":
+                records, duration = await run_closed_loop(client, pool, level, args.requests_per_level, args.stream)
+            else:
+                records, duration = await run_open_loop(client, pool, level, args.requests_per_level, args.stream, rng)
+            row = summarize(mode, level, records, duration)
+            rows.append(row)
+            print(
+                f"[BENCH] {mode}={level} | {row['throughput_rps']} req/s | {row['output_tok_s']} out tok/s | "
+                f"p50/p99 {row['latency_p50']}/{row['latency_p99']}s | ttft p50 {row['ttft_p50']}s | "
+                f"errors {row['errors']}/{row['requests']}"
+            )
+    return rows
+
+
+def save_report(rows, meta, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    json_path = os.path.join(out_dir, "load_bench.json")
+    csv_path = os.path.join(out_dir, "load_bench.csv")
+
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": rows}, f, ensure_ascii=False, indent=4)
+
+    fieldnames = [k for k in rows[0] if k != "by_kind"] if rows else []
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"[SAVED] {json_path}")
+    print(f"[SAVED] {csv_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency sweep / Poisson load benchmark")
+    parser.add_argument("--api_url", type=str, default=iol_eff.API_URL)
+    parser.add_argument("--model_name", type=str, default="Qwen3-VL-8B-Instruct")
+    parser.add_argument("--kinds", type=str, default="iol,soi,single")
+    parser.add_argument("--data_type", type=str, default="MVTEC", help="IOL / SOI 测试集")
+    parser.add_argument("--single_type", type=str, default="iol")
+    parser.add_argument("--single_dataset", type=str, default="mvtec")
+    parser.add_argument("--single_mode", type=str, default="zero-shot",
+                        choices=["zero-shot", "one-example", "two-examples"])
+    parser.add_argument("--samples_per_kind", type=int, default=32)
+
+    parser.add_argument("--concurrency", type=str, default=DEFAULT_LEVELS, help="闭环并发档位")
+    parser.add_argument("--rates", type=str, default="", help="开环到达率（req/s），给出时忽略 --concurrency")
+    parser.add_argument("--requests_per_level", type=int, default=128)
+    parser.add_argument("--max_connections", type=int, default=256, help="开环时连接池上限")
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--max_retries", type=int, default=0, help="压测默认不重试，错误率如实统计")
+    parser.add_argument("--no_stream", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out_dir", type=str, default="./load_bench")
+
+    parser.add_argument("--stub", action="store_true", help="启动本地假服务并压测它")
+    parser.add_argument("--stub_delay", type=float, default=0.05)
+    parser.add_argument("--stub_token_delay", type=float, default=0.002)
+    args = parser.parse_args()
+    args.stream = not args.no_stream
+
+    server = None
+    if args.stub:
+        server, args.api_url = start_stub_server(delay=args.stub_delay, token_delay=args.stub_token_delay)
+        print(f"[INFO] Stub server: {args.api_url}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pool = build_request_pool(args, random.Random(args.seed), tmp_dir)
+        print(f"[INFO] Request pool: {len(pool)} ({', '.join(sorted({k for k, _ in pool}))})")
+        rows = asyncio.run(run_bench(args, pool))
+
+    if server is not None:
+        server.shutdown()
+
+    meta = {k: v for k, v in vars(args).items()}
+    meta["pool_size"] = len(pool)
+    save_report(rows, meta, args.out_dir)
+
+
+if __name__ == "__main__":
+    main()
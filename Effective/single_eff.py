@@ -1,7 +1,5 @@
 import os
 import json
-import base64
-import requests
 import argparse
 import random
 import time
@@ -12,6 +10,11 @@ import sys
 # 允许从上级目录 import
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from Ablation.configs import extract_answer
+from oddgrid_common.results_store import ResultsWriter, load_processed_keys, compact_results
+from oddgrid_common.image_cache import Base64LRUCache, iter_with_prefetch
+from oddgrid_common.async_client import run_ordered
+from oddgrid_common.early_stop import DEFAULT_GRACE_TOKENS
+from oddgrid_common.response_cache import ResponseCache
 
 # ================= 基础配置 =================
 max_new_tokens = 2048
@@ -22,6 +25,8 @@ BASE_DATA_DIR = "../Ablation/single_data"
 SAVE_DIR_BASE = "./single_results"  # 结果保存根目录
 EXAMPLE_DIR = "../Ablation/examples"         # 示例图片根目录
 API_URL = "http://localhost:8081/v1/chat/completions"
+IMAGE_CACHE = Base64LRUCache()               # (path, mtime) -> base64
+PREFETCH_LOOKAHEAD = 2
 # ================= 工具函数 =================
 
 def is_qwen35_model(model_name):
@@ -83,8 +88,8 @@ def build_multimodal_prompt(mode, img_path, current_img_base64):
 def encode_image(image_path):
     if not image_path or not os.path.exists(image_path):
         return None
-    with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+    # 示例图每条样本都会用到，缓存后只读一次
+    return IMAGE_CACHE.get(image_path)
 
 def find_example_image(original_path, target_type="Normal"):
     """将推理路径映射到 example 路径"""
@@ -119,8 +124,7 @@ def find_example_image(original_path, target_type="Normal"):
     return None
 
 
-def call_vllm_api(messages, model_name):
-    """通过 API 发送消息列表"""
+def build_payload(messages, model_name):
     full_model_path = os.path.join(MODEL_PATH, model_name)
     payload = {
         "model": full_model_path,
@@ -131,20 +135,21 @@ def call_vllm_api(messages, model_name):
 
     if is_qwen35_model(model_name):
         payload["chat_template_kwargs"] = {"enable_thinking": False}
+    return payload
 
-    try:
-        response = requests.post(API_URL, json=payload, timeout=300)
-        response.raise_for_status()
-        data = response.json()
-        usage = data.get("usage", {})
-        return data["choices"][0]["message"]["content"], usage
-    except Exception as e:
-        print(f"\n[ERROR] API 请求失败: {e}")
-        return None, {}
+
+def build_item_payload(img_path, mode, model_name):
+    """在 run_ordered 的工作线程里执行：编码当前图片 + 构建多图消息体"""
+    current_b64 = encode_image(img_path)
+    if not current_b64:
+        return None
+    return build_payload(build_multimodal_prompt(mode, img_path, current_b64), model_name)
 
 # ================= 主推理函数 =================
 
-def run_inference(data_type, dataset_name, model_name, sample_num, mode):
+def run_inference(data_type, dataset_name, model_name, sample_num, mode,
+                  concurrency=1, api_url=API_URL, timeout=300, max_retries=3, stream=True,
+                  use_cache=False, cache_ttl=None, early_stop=None):
     global_start = time.time()
 
     # 根据 mode 区分保存路径
@@ -163,16 +168,13 @@ def run_inference(data_type, dataset_name, model_name, sample_num, mode):
     with open(json_input_path, "r", encoding="utf-8") as f:
         image_metadata = json.load(f)
 
-    all_results = []
     processed_paths = set()
 
-    if os.path.exists(save_path):
-        try:
-            with open(save_path, "r", encoding="utf-8") as f:
-                all_results = json.load(f)
-                processed_paths = {item["path"] for item in all_results}
-                print(f"[INFO] 载入进度，跳过已处理 {len(processed_paths)} 条")
-        except: pass
+    try:
+        processed_paths = load_processed_keys(save_path, key="path")
+        if processed_paths:
+            print(f"[INFO] 载入进度，跳过已处理 {len(processed_paths)} 条")
+    except Exception: pass
 
     # 过滤与路径修复
     valid_items = []
@@ -198,21 +200,20 @@ def run_inference(data_type, dataset_name, model_name, sample_num, mode):
     time_list = []
     token_list = []
     image_count_list = []
-    for meta_key, info in tqdm(valid_items):
-        img_path = "../Ablation/" + info["physical_path"]
-        print(f"\n[INFO] Processing: {img_path}")
-        # 构建当前图片的 Base64
-        current_b64 = encode_image(img_path)
-        if not current_b64: continue
-
-        # 根据模式构建多图消息体
-        messages = build_multimodal_prompt(mode, img_path, current_b64)
-
-        start_time = time.time()
-        predict_answer, usage = call_vllm_api(messages, model_name)
-        elapsed_time = time.time() - start_time
-
-        if predict_answer is None: continue
+    writer = ResultsWriter(save_path)
+    jobs = [(info, "../Ablation/" + info["physical_path"]) for _, info in valid_items]
+    if early_stop is not None and not stream:
+        print("[WARN] --early_stop 需要流式接口，--no_stream 下不生效")
+    response_cache = ResponseCache(ttl=cache_ttl, enabled=use_cache)
+    pbar = tqdm(total=len(jobs))
+
+    def on_result(job, result):
+        pbar.update(1)
+        info, img_path = job
+        predict_answer, usage = result["text"], result["usage"]
+        if predict_answer is None:
+            print(f"\n[ERROR] API 请求失败 {img_path}: {result['error']}")
+            return
 
         extract_ans = extract_answer(predict_answer)
 
@@ -226,22 +227,46 @@ def run_inference(data_type, dataset_name, model_name, sample_num, mode):
             "mode": mode,
             "dataset_name": dataset_name,
             "model_name": model_name,
-            "inference_time": elapsed_time,
+            "inference_time": result["latency"],
             "prompt_tokens": usage.get("prompt_tokens"),
             "completion_tokens": usage.get("completion_tokens"),
             "total_tokens": usage.get("total_tokens"),
+            "ttft": result.get("ttft"),
+            "itl": result.get("itl"),
+            "decode_tps": result.get("decode_tps"),
+            "encode_time": result.get("encode_time"),
+            "cache_hit": result.get("cache_hit"),
+            "early_stopped": result.get("early_stopped"),
             "resize_scale": info.get("resize_scale"),
             "original_count": info.get("count")
         }
 
-        all_results.append(res_item)
-        time_list.append(elapsed_time)
+        writer.write(res_item)
+        if not result.get("cache_hit"):
+            time_list.append(result["latency"])
         if usage.get("total_tokens") is not None:
             token_list.append(usage["total_tokens"])
             image_count_list.append(1)
 
-        with open(save_path, "w", encoding="utf-8") as f:
-            json.dump(all_results, f, ensure_ascii=False, indent=4)
+    run_ordered(
+        iter_with_prefetch(jobs, lambda job: [job[1]], IMAGE_CACHE, PREFETCH_LOOKAHEAD),
+        lambda job: build_item_payload(job[1], mode, model_name),
+        on_result,
+        api_url,
+        concurrency=concurrency,
+        timeout=timeout,
+        max_retries=max_retries,
+        cache=response_cache,
+        early_stop=early_stop,
+        stream=stream,
+    )
+    pbar.close()
+    response_cache.report()
+
+    writer.close()
+    compact_results(save_path, key="path")
+
+    IMAGE_CACHE.report()
 
     # 统计逻辑保持不变...
     total_time = time.time() - global_start
@@ -261,6 +286,18 @@ if __name__ == "__main__":
     # 新增模式参数
     parser.add_argument("--mode", type=str, default="one-example", 
                         choices=["zero-shot", "one-example", "two-examples"])
+    parser.add_argument("--api_url", type=str, default=API_URL)
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="同时在飞的请求数；>1 时 inference_time 包含服务端排队 / 批处理的影响")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--max_retries", type=int, default=3)
+    parser.add_argument("--use_cache", action="store_true",
+                        help="读写推理结果缓存；命中的记录带 cache_hit=True，时延是缓存里的旧值，cal_eff 不计入")
+    parser.add_argument("--cache_ttl", type=float, default=None, help="缓存有效期（秒），默认不过期")
+    parser.add_argument("--early_stop", action="store_true", help="答案 \\boxed{} 闭合后断开流式请求（需要流式接口）")
+    parser.add_argument("--early_stop_grace", type=int, default=DEFAULT_GRACE_TOKENS,
+                        help="boxed 闭合后再收多少个 token 没有新 boxed 就停")
+    parser.add_argument("--no_stream", action="store_true", help="不用流式接口（不记录 TTFT / ITL）")
 
     args = parser.parse_args()
 
@@ -269,5 +306,13 @@ if __name__ == "__main__":
         args.dataset,
         args.model_name,
         args.sample_num,
-        args.mode
+        args.mode,
+        concurrency=args.concurrency,
+        api_url=args.api_url,
+        timeout=args.timeout,
+        max_retries=args.max_retries,
+        stream=not args.no_stream,
+        use_cache=args.use_cache,
+        cache_ttl=args.cache_ttl,
+        early_stop=args.early_stop_grace if args.early_stop else None,
     )
\ No newline at end of file
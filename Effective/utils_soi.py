@@ -1,21 +1,5 @@
-import json
-import os
 import re
 
-def write_json(save_json_path, save_json_data):
-    if os.path.exists(save_json_path):
-        with open(save_json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        if isinstance(data, list):
-            data.append(save_json_data)
-        else:
-            data = [data, save_json_data]
-    else:
-        data = [save_json_data]
-
-    with open(save_json_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
-
 _IMAGE_PATTERN = re.compile(r'image\d+')
 
 def extract_answer_from_response(response_text):
@@ -103,3 +87,8 @@ def build_prompt(image_paths: list):
     )
 
     return prompt
+
+
+def strata_key(data):
+    """分层抽样的层：图片数 × 异常数"""
+    return data.get("total_icons"), data.get("num_odds")
@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 import argparse
 import csv
-import json
-import re
+import sys
 from collections import Counter
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parents[1]
 OUT_ROOT = Path(__file__).resolve().parent
 
+sys.path.append(str(ROOT))
+from oddgrid_common.warehouse import open_warehouse
+
 MODEL_ROWS = [
     ("Qwen3-VL-32B", "Qwen3-VL-32B-Instruct"),
     ("Qwen3.5-VL-27B", "Qwen3.5-27B"),
@@ -40,71 +42,6 @@ ERROR_TYPES = [
     ("extract_failed", "Output Format Violation"),
 ]
 
-IOL_COORD_RE = re.compile(r"^\((\d+),(\d+)\)$")
-SOI_IMAGE_RE = re.compile(r"^image(\d+)$")
-
-
-def normalize_iol_gt(answer):
-    out = []
-    for item in answer or []:
-        if isinstance(item, (list, tuple)) and len(item) == 2:
-            out.append((int(item[0]), int(item[1])))
-    return out
-
-
-def normalize_iol_pred(extract_answer):
-    if extract_answer == "" or extract_answer is None or not isinstance(extract_answer, list):
-        return None
-    out = []
-    for item in extract_answer:
-        if not isinstance(item, str):
-            return None
-        match = IOL_COORD_RE.match(item.strip())
-        if not match:
-            return None
-        out.append((int(match.group(1)), int(match.group(2))))
-    return out
-
-
-def normalize_soi_gt(answer):
-    return [int(x) for x in (answer or [])]
-
-
-def normalize_soi_pred(extract_answer):
-    if extract_answer is None:
-        return None
-    if extract_answer == []:
-        return []
-    if isinstance(extract_answer, list):
-        parts = extract_answer
-    elif isinstance(extract_answer, str) and extract_answer.strip():
-        parts = [p.strip() for p in extract_answer.split(",")]
-    else:
-        return None
-    out = []
-    for item in parts:
-        if not isinstance(item, str):
-            return None
-        match = SOI_IMAGE_RE.match(item.strip())
-        if not match:
-            return None
-        out.append(int(match.group(1)))
-    return out
-
-
-def classify_error(pred, gt):
-    if pred is None:
-        return "extract_failed"
-
-    pred_set = set(pred)
-    gt_set = set(gt)
-    if pred_set == gt_set:
-        return "exact"
-    if not (pred_set & gt_set):
-        return "no_overlap"
-    return "partial"
-
-
 def empty_stats():
     return {"n": 0, "counts": Counter()}
 
@@ -119,40 +56,15 @@ def merge_stats(items):
     return merged if merged["n"] else None
 
 
-def eval_json_file(path, task):
-    try:
-        data = json.loads(Path(path).read_text(encoding="utf-8"))
-    except Exception as exc:
-        print(f"[WARN] skip {path}: {exc}")
-        return None
-    if not isinstance(data, list):
-        return None
-
-    stats = empty_stats()
-    for sample in data:
-        if task == "iol":
-            gt = normalize_iol_gt(sample.get("answer", []))
-            pred = normalize_iol_pred(sample.get("extract_answer", ""))
-        else:
-            gt = normalize_soi_gt(sample.get("answer", []))
-            pred = normalize_soi_pred(sample.get("extract_answer", ""))
-        stats["counts"][classify_error(pred, gt)] += 1
-        stats["n"] += 1
-    return stats if stats["n"] else None
-
-
 def collect_results(eval_dir, task):
-    results = {}
-    for dataset_dir in sorted(Path(eval_dir).glob("*_output")):
-        if not dataset_dir.is_dir():
-            continue
-        dataset_results = {}
-        for json_path in sorted(dataset_dir.glob("*.json")):
-            stats = eval_json_file(json_path, task)
-            if stats is not None:
-                dataset_results[json_path.stem] = stats
-        if dataset_results:
-            results[dataset_dir.name] = dataset_results
+    # 逐条错误类型由 oddgrid_common/warehouse.py 统一解析（partial 细分为 under / over / mixed），这里合并成 partial
+    results = open_warehouse().error_stats(eval_dir, task)
+    for dataset_results in results.values():
+        for stats in dataset_results.values():
+            counts = Counter()
+            for error_type, count in stats["counts"].items():
+                counts["partial" if error_type.startswith("partial") else error_type] += count
+            stats["counts"] = counts
     return results
 
 
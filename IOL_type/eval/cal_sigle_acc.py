@@ -1,8 +1,13 @@
 import json
 import csv
+import os
 import re
+import sys
 from pathlib import Path
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from oddgrid_common.bitmask_metrics import MaskEncoder, iol_total_count, parse_grid_size, score, summarize
+
 
 # =========================
 # 工具函数：标准化坐标
@@ -50,106 +55,6 @@ def normalize_pred(extract_answer):
     return None
 
 
-def parse_grid_size(grid_size):
-    """
-    兼容:
-    - [3, 3]
-    - "[3, 3]"
-    - 缺失时默认 [3, 3]
-    """
-    if grid_size is None:
-        return [3, 3]
-
-    if isinstance(grid_size, str):
-        try:
-            grid_size = json.loads(grid_size)
-        except Exception:
-            return [3, 3]
-
-    if isinstance(grid_size, list) and len(grid_size) == 2:
-        return [int(grid_size[0]), int(grid_size[1])]
-
-    return [3, 3]
-
-
-def get_total_count(sample, grid_size):
-    """
-    优先使用 sample["total_count"]。
-    如果没有 total_count，则尝试从 source_cells 里统计 original_name 不为 null 的数量。
-    如果还没有，则回退到 grid_size[0] * grid_size[1]。
-    """
-    if sample.get("total_count") is not None:
-        return int(sample["total_count"])
-
-    source_cells = sample.get("source_cells", None)
-    if isinstance(source_cells, list):
-        return sum(
-            1 for cell in source_cells
-            if cell.get("original_name") is not None
-        )
-
-    return int(grid_size[0]) * int(grid_size[1])
-
-
-def valid_cells_from_total_count(grid_size, total_count):
-    """
-    按 row-major 顺序生成有效 cell。
-    例如 grid_size=[3,3], total_count=7:
-    有效 cell 为:
-    (1,1),(1,2),(1,3),
-    (2,1),(2,2),(2,3),
-    (3,1)
-    """
-    rows, cols = grid_size
-    valid_cells = []
-
-    for idx in range(total_count):
-        r = idx // cols + 1
-        c = idx % cols + 1
-
-        # 防止 total_count 异常超过完整 grid
-        if r <= rows:
-            valid_cells.append((r, c))
-
-    return valid_cells
-
-
-# =========================
-# 核心计算逻辑：基于有效单元格的二分类指标
-# =========================
-def compute_cell_confusion_matrix(pred_set, gt_set, grid_size, total_count):
-    """
-    只统计 total_count 个有效 cell，而不是完整 grid_size。
-    """
-    tp, fp, tn, fn = 0, 0, 0, 0
-
-    is_invalid = pred_set is None
-    current_pred = pred_set if not is_invalid else set()
-
-    valid_cells = valid_cells_from_total_count(grid_size, total_count)
-    valid_cell_set = set(valid_cells)
-
-    # 如果模型预测了缺失 cell，应该算 FP
-    # 例如 total_count=7，但预测了 (3,3)，这个位置不存在，算错误预测
-    extra_pred_cells = current_pred - valid_cell_set
-    fp += len(extra_pred_cells)
-
-    for cell in valid_cells:
-        is_pred_odd = cell in current_pred
-        is_gt_odd = cell in gt_set
-
-        if is_gt_odd and is_pred_odd:
-            tp += 1
-        elif is_gt_odd and not is_pred_odd:
-            fn += 1
-        elif not is_gt_odd and is_pred_odd:
-            fp += 1
-        else:
-            tn += 1
-
-    return tp, fp, tn, fn
-
-
 # =========================
 # 文件与目录处理
 # =========================
@@ -160,38 +65,21 @@ def eval_json_file(json_path: Path):
     if not isinstance(data, list):
         data = [data]
 
-    total_tp, total_fp, total_tn, total_fn = 0, 0, 0, 0
-    img_count = len(data)
-
+    # 只统计 total_count 个有效 cell（行优先），预测到缺失 / 越界 cell 记 FP；整文件一次性位运算
+    encoder = MaskEncoder("iol")
     for sample in data:
-        gt_set = normalize_gt(sample.get("answer", []))
-        pred_set = normalize_pred(sample.get("extract_answer", ""))
-
         grid_size = parse_grid_size(sample.get("grid_size", [3, 3]))
-        total_count = get_total_count(sample, grid_size)
-
-        tp, fp, tn, fn = compute_cell_confusion_matrix(
-            pred_set=pred_set,
-            gt_set=gt_set,
+        encoder.add(
+            normalize_gt(sample.get("answer", [])),
+            normalize_pred(sample.get("extract_answer", "")),
             grid_size=grid_size,
-            total_count=total_count
+            total_count=iol_total_count(sample, grid_size),
         )
-
-        total_tp += tp
-        total_fp += fp
-        total_tn += tn
-        total_fn += fn
-
-    total_cells = total_tp + total_fp + total_tn + total_fn
-
-    acc = (total_tp + total_tn) / total_cells if total_cells > 0 else 0
-    precision = total_tp / (total_tp + total_fp) if (total_tp + total_fp) > 0 else 0
-    recall = total_tp / (total_tp + total_fn) if (total_tp + total_fn) > 0 else 0
-    f1 = (
-        2 * precision * recall / (precision + recall)
-        if (precision + recall) > 0
-        else 0
-    )
+    m = summarize(score(encoder.batch()))
+    img_count = len(data)
+    total_tp, total_fp, total_tn, total_fn = m["tp"], m["fp"], m["tn"], m["fn"]
+    total_cells = m["units"]
+    acc, precision, recall, f1 = m["acc"], m["cell_precision"], m["cell_recall"], m["cell_f1"]
 
     return {
         "images": img_count,
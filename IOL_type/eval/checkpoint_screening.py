@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from configs import get_configs, models_dir
+from vllm_infer_dire import run_vllm_http, score_record
+from utils import strata_key
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from oddgrid_common.eval_daemon import expand_models
+from oddgrid_common.results_store import iter_results
+from oddgrid_common.screening import stratified_order, successive_halving, compute_saving, print_round
+
+# ======================
+# checkpoint 逐轮减半筛选
+# ======================
+# 所有 checkpoint 先在每个数据集的小分层子集（按 grid 大小 × 异常数分层）上评测，
+# 每轮按 EM / F1 宏平均去掉较差的一半、子集翻倍，只有 finalists 跑全量。
+#
+#   python checkpoint_screening.py --models 'Qwen3_vl_4B_TOTAL_EM_*' \
+#       --data_types icon mnist hanzi MVTEC VisA BTech MPDD RAD GOODADS --n0 32 --finalists 2
+#
+# 子集轮次的结果写到 screening/<data_type>_output/（不混进正式结果目录）；
+# finalists 的全量评测写正式目录，子集里已经跑过的样本走推理结果缓存。
+
+DATA_TYPES = ["icon", "mnist", "hanzi", "MVTEC", "VisA", "BTech", "MPDD", "RAD", "GOODADS"]
+
+
+def load_order(data_type, image_type, seed):
+    configs_para = get_configs(SimpleNamespace(model_name="", data_type=data_type, image_type=image_type))
+    with open(configs_para["json_path"], "r", encoding="utf-8") as f:
+        json_data = json.load(f)
+    return [data.get("id") for data in stratified_order(json_data, strata_key, seed)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Successive-halving checkpoint screening on stratified eval subsets")
+    parser.add_argument("--models", nargs="+", required=True, help="checkpoint 目录名，可用通配符")
+    parser.add_argument("--data_types", nargs="+", default=DATA_TYPES)
+    parser.add_argument("--image_type", default="normal")
+    parser.add_argument("--metric", choices=["EM", "F1"], default="F1")
+    parser.add_argument("--n0", type=int, default=32, help="第 0 轮每个数据集的样本数")
+    parser.add_argument("--finalists", type=int, default=2, help="跑全量的 checkpoint 数")
+    parser.add_argument("--eta", type=int, default=2, help="每轮保留 1/eta，子集扩大 eta 倍")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--screen_root", type=str, default="screening", help="子集轮次的结果目录")
+    parser.add_argument("--out_dir", type=str, default="results_total/screening")
+    args = parser.parse_args()
+
+    models = expand_models(args.models, models_dir)
+    if not models:
+        raise ValueError("no checkpoint to screen")
+    orders = {d: load_order(d, args.image_type, args.seed) for d in args.data_types}
+    sizes = {d: len(ids) for d, ids in orders.items()}
+    print(f"[SCREEN] {len(models)} checkpoint(s), datasets: " + ", ".join(f"{d}={n}" for d, n in sizes.items()))
+
+    def evaluate(model, data_type, ids):
+        full = len(ids) >= sizes[data_type]
+        run = run_vllm_http(SimpleNamespace(
+            model_name=model,
+            image_type=args.image_type,
+            data_type=data_type,
+            sample_ids=None if full else set(ids),
+            result_root=None if full else os.path.join(args.screen_root, f"{data_type}_output/"),
+        ))
+        metric_idx = 0 if args.metric == "EM" else 1
+        scores = {r.get("id"): score_record(r)[metric_idx] for r in iter_results(run["save_path"])}
+        return [scores[i] for i in ids if i in scores]
+
+    start = time.perf_counter()
+    final, rounds, evaluated = successive_halving(
+        models, orders, evaluate, n0=args.n0, finalists=args.finalists, eta=args.eta, on_round=print_round)
+    elapsed = time.perf_counter() - start
+
+    used, full = compute_saving(evaluated, models, sizes)
+    print(f"[SCREEN] best: {final[0]['candidate']} {args.metric}={final[0]['score'] * 100:.2f}")
+    print(f"[SCREEN] evaluated {used} samples vs {full} for a full sweep ({full / max(used, 1):.1f}x less), {elapsed:.0f}s")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    out_path = os.path.join(args.out_dir, f"screening_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "metric": args.metric,
+            "models": models,
+            "sizes": sizes,
+            "rounds": rounds,
+            "evaluated_samples": used,
+            "full_sweep_samples": full,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"[INFO] Saved screening log to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+import os
+import sys
+from types import SimpleNamespace
+
+from configs import models_dir
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from oddgrid_common.eval_daemon import adapter_base, daemon_main
+
+# ======================
+# 常驻评测服务（vllm_infer_dire 离线引擎）
+# ======================
+# 一个进程消费任务队列，尽量少换模型；LoRA checkpoint 挂在已加载的 base 上跑。
+#
+#   python eval_daemon.py submit --models 'Qwen3_vl_4B_TOTAL_*_step_200' --data_types mnist MVTEC VisA
+#   python eval_daemon.py serve                # 常驻；--exit_when_idle 跑空后退出
+#   python eval_daemon.py status               # 另一个 shell 里看进度
+#
+# 调度策略与假后端见 oddgrid_common/eval_daemon.py。
+
+
+class VllmBackend:
+    supports_lora = True
+
+    def __init__(self):
+        self.loaded_base = None
+        self.loaded_model = None
+
+    def base_of(self, model):
+        base = adapter_base(os.path.join(models_dir, model))
+        if base is None:
+            return model
+        # base 就在 models 目录下时用目录名，和直接提交 base 的任务算同一个
+        if os.path.dirname(os.path.abspath(base)) == os.path.abspath(models_dir):
+            return os.path.basename(base)
+        return base
+
+    def load(self, model, enable_lora=False):
+        from vllm_infer_dire import get_vllm_model
+
+        get_vllm_model(os.path.join(models_dir, model), enable_lora=enable_lora)
+        self.loaded_base = self.base_of(model)
+        self.loaded_model = model
+
+    def run(self, job, progress):
+        from vllm_infer_dire import run_vllm_http
+
+        run_vllm_http(SimpleNamespace(
+            model_name=job["model"],
+            image_type=job["image_type"],
+            data_type=job["data_type"],
+            progress=progress,
+        ))
+
+    def release(self):
+        if "vllm_infer_dire" in sys.modules:
+            sys.modules["vllm_infer_dire"].release_vllm_model()
+        self.loaded_base = self.loaded_model = None
+
+
+if __name__ == "__main__":
+    daemon_main(VllmBackend, queue_name="IOL", models_dir=models_dir)
@@ -12,6 +12,8 @@ def main():
     parser.add_argument("--model_name", required=True)
     parser.add_argument("--image_type", default="normal")
     parser.add_argument("--data_types", nargs="+", required=True)
+    parser.add_argument("--dry_run", "--dry-run", action="store_true",
+                        help="只统计各数据集待跑样本数，不加载模型")
     args = parser.parse_args()
 
     print("=" * 80)
@@ -27,6 +29,7 @@ def main():
             model_name=args.model_name,
             image_type=args.image_type,
             data_type=data_type,
+            dry_run=args.dry_run,
         ))
 
     print("=" * 80)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import json
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+from vllm_infer_dire import run_vllm_http
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from oddgrid_common.warehouse import score_sample
+
+TASK = "iol"
+
+# ======================
+# 视觉 token 预算扫描
+# ======================
+# 同一个模型（只加载一次）在多个预算 × 多个数据集上跑 vllm_infer_dire，
+# 汇总 EM / F1、平均视觉 token、估算 prefill token 与每条样本的平均耗时，
+# 画出 精度 vs prefill token、耗时 vs prefill token（每个数据集一条曲线）。
+#
+#   python token_budget_sweep.py --model_name Qwen3-VL-8B-Instruct \
+#       --data_types mnist MVTEC VisA --budgets 0,1024,2048,4096
+#
+# 预算 0 表示原分辨率。各预算的结果文件是 <model>_tb<预算>.json，可以断点续跑；
+# 续跑时已完成的组合没有耗时数据，表格里留空。扫描不读写推理结果缓存（耗时曲线要的是真实推理）。
+
+
+def load_records(save_path):
+    with open(save_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def summarize_run(data_type, budget, run):
+    save_path = Path(run["save_path"])
+    records = load_records(save_path)
+    scores = [score_sample(r, TASK) for r in records]
+    em = sum(e for e, _ in scores) / len(scores) if scores else 0.0
+    f1 = sum(f for _, f in scores) / len(scores) if scores else 0.0
+
+    n = max(len(records), 1)
+    visual = sum(r.get("visual_tokens") or 0 for r in records) / n
+    # 文本 token 按 4 字符 / token 粗估
+    prefill = visual + sum(len(r.get("prompt", "")) for r in records) / 4 / n
+
+    throughput = run.get("throughput")
+    latency = throughput["elapsed"] / throughput["samples"] if throughput and throughput["samples"] else None
+    return {
+        "data_type": data_type,
+        "budget": budget or "",
+        "samples": len(records),
+        "EM": em * 100,
+        "F1": f1 * 100,
+        "avg_visual_tokens": visual,
+        "avg_prefill_tokens_est": prefill,
+        "sec_per_sample": latency,
+    }
+
+
+def plot_sweep(rows, out_png):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("[WARN] matplotlib not installed, skip chart")
+        return
+
+    fig, (ax_acc, ax_lat) = plt.subplots(1, 2, figsize=(12, 4.5))
+    for data_type in dict.fromkeys(r["data_type"] for r in rows):
+        pts = sorted((r for r in rows if r["data_type"] == data_type), key=lambda r: r["avg_prefill_tokens_est"])
+        xs = [r["avg_prefill_tokens_est"] for r in pts]
+        ax_acc.plot(xs, [r["F1"] for r in pts], marker="o", label=f"{data_type} F1")
+        ax_acc.plot(xs, [r["EM"] for r in pts], marker="x", linestyle="--", label=f"{data_type} EM")
+        lat = [(x, r["sec_per_sample"]) for x, r in zip(xs, pts) if r["sec_per_sample"] is not None]
+        if lat:
+            ax_lat.plot(*zip(*lat), marker="o", label=data_type)
+
+    ax_acc.set_xlabel("prefill tokens / sample (est.)")
+    ax_acc.set_ylabel("score (%)")
+    ax_acc.set_title("Accuracy vs prefill tokens")
+    ax_acc.legend(fontsize=7)
+    ax_lat.set_xlabel("prefill tokens / sample (est.)")
+    ax_lat.set_ylabel("seconds / sample")
+    ax_lat.set_title("Latency vs prefill tokens")
+    ax_lat.legend(fontsize=7)
+    fig.tight_layout()
+    fig.savefig(out_png, dpi=150)
+    print(f"[INFO] Saved chart to {out_png}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep per-request visual token budgets for one model")
+    parser.add_argument("--model_name", required=True)
+    parser.add_argument("--image_type", default="normal")
+    parser.add_argument("--data_types", nargs="+", required=True)
+    parser.add_argument("--budgets", type=str, default="0,1024,2048,4096", help="逗号分隔，0 表示原分辨率")
+    parser.add_argument("--out_dir", type=str, default="results_total/token_budget_sweep")
+    args = parser.parse_args()
+
+    budgets = [int(b) for b in args.budgets.split(",") if b.strip()]
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    rows = []
+    for budget in budgets:
+        for data_type in args.data_types:
+            print("-" * 80)
+            print(f"[SWEEP] model={args.model_name} data_type={data_type} token_budget={budget or 'original'}")
+            print("-" * 80)
+            run = run_vllm_http(SimpleNamespace(
+                model_name=args.model_name,
+                image_type=args.image_type,
+                data_type=data_type,
+                token_budget=budget or None,
+                no_cache=True,   # 命中推理结果缓存的样本不经过推理，sec_per_sample 就没有意义
+            ))
+            rows.append(summarize_run(data_type, budget, run))
+
+    out_csv = os.path.join(args.out_dir, f"{args.model_name}.csv")
+    with open(out_csv, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        for r in rows:
+            writer.writerow({
+                k: (f"{v:.3f}" if isinstance(v, float) else ("" if v is None else v))
+                for k, v in r.items()
+            })
+    print(f"[INFO] Saved sweep table to {out_csv}")
+
+    for r in rows:
+        lat = f"{r['sec_per_sample']:.3f}s" if r["sec_per_sample"] is not None else "-"
+        print(
+            f"{r['data_type']:<12} budget={str(r['budget'] or 'orig'):<6} "
+            f"EM={r['EM']:.2f} F1={r['F1']:.2f} visual={r['avg_visual_tokens']:.0f} "
+            f"prefill≈{r['avg_prefill_tokens_est']:.0f} latency={lat}"
+        )
+
+    plot_sweep(rows, os.path.join(args.out_dir, f"{args.model_name}.png"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,5 @@
-import json
-import os
 import re
 
-def write_json(save_json_path, save_json_data):
-    if os.path.exists(save_json_path):
-        with open(save_json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        if isinstance(data, list):
-            data.append(save_json_data)
-        else:
-            data = [data, save_json_data]
-    else:
-        data = [save_json_data]
-
-    with open(save_json_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
-        
 _COORD_PATTERN = re.compile(r'\(\d+,\d+\)')
 
 def extract_answer_from_response(response_text):
@@ -152,3 +136,8 @@ def build_prompt_same_angle_real(data):
         "- No anomalies: \\boxed{{}}\n"
     )
     return prompt
+
+
+def strata_key(data):
+    """分层抽样的层：grid 大小 × 异常数（checkpoint_screening / 序贯评测用）"""
+    return str(data.get("grid_size")), data.get("odd_count")
@@ -1,4 +1,5 @@
 import os
+import sys
 os.environ.setdefault("VLLM_USE_V1", "0")
 import argparse
 import json
@@ -9,14 +10,18 @@ from tqdm import tqdm
 from configs import get_configs, max_new_tokens
 from utils import *
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from oddgrid_common.dispatcher import run_dispatch, report_endpoints
+from oddgrid_common.results_store import ResultsWriter, load_processed_keys, compact_results
+
 # 可以按需改成环境变量
 API_URL = "http://localhost:8081/v1/chat/completions"
 
 def is_qwen35_model(model_path):
     return "qwen3.5" in os.path.basename(model_path).lower()
 
-def call_vllm_server(prompt, image_paths, model_path):
-    """通过 vLLM REST API 调用模型"""
+def build_payload(prompt, image_paths, model_path):
+    """构建 vLLM REST API 的请求体"""
     messages = [{"role": "user", "content": []}]
 
     # 图像转 base64
@@ -44,6 +49,13 @@ def call_vllm_server(prompt, image_paths, model_path):
     if is_qwen35_model(model_path):
         payload["chat_template_kwargs"] = {"enable_thinking": False}
 
+    return payload
+
+
+def call_vllm_server(prompt, image_paths, model_path):
+    """通过 vLLM REST API 调用模型（单条、同步）"""
+    payload = build_payload(prompt, image_paths, model_path)
+
     resp = None
     try:
         resp = requests.post(API_URL, json=payload, timeout=600)
@@ -72,12 +84,7 @@ def run_vllm_http(args):
         raise ValueError(f"Unknown model_name: {args.model_name}")
     # print(configs_para)
     # 已有结果 -> 去重
-    processed_ids = set()
-    if os.path.exists(save_json_path):
-        with open(save_json_path, "r", encoding="utf-8") as f:
-            for item in json.load(f):
-                if "id" in item:
-                    processed_ids.add(item["id"])
+    processed_ids = load_processed_keys(save_json_path)
 
     # 读测试集
     with open(json_path, 'r', encoding='utf-8') as f:
@@ -85,7 +92,9 @@ def run_vllm_http(args):
 
     print(f"[INFO] Total samples: {len(json_data)}; processed: {len(processed_ids)}")
 
-    for data in tqdm(json_data):
+    writer = ResultsWriter(save_json_path)
+    jobs = []
+    for data in json_data:
         id = data.get("id")
         if id in processed_ids:
             continue
@@ -99,8 +108,16 @@ def run_vllm_http(args):
             prompt = build_prompt_same_angle_synthesis(data)
         else:
             prompt = build_prompt_same_angle_real(data)
+        jobs.append((data, prompt, image_paths))
 
-        predict_answer = call_vllm_server(prompt, image_paths, model_path)
+    pbar = tqdm(total=len(jobs))
+
+    def on_result(job, result):
+        pbar.update(1)
+        data, prompt, image_paths = job
+        predict_answer = result["text"]
+        if predict_answer is None:
+            print(f"[ERROR] vLLM request failed: {result['error']}")
         extract_answer = extract_answer_from_response(predict_answer)
         rows_cols = []
 
@@ -120,7 +137,7 @@ def run_vllm_http(args):
             )
               
         save_item = {
-            "id": id,
+            "id": data.get("id"),
             "image":data.get("image"),
             "class": data.get("class", ""),
             "prompt": prompt,
@@ -131,10 +148,26 @@ def run_vllm_http(args):
             "total_count": total_count,
             "odd_count": data.get("odd_count"),
             "grid_size": str(data.get("grid_size")),
+            "endpoint": result.get("endpoint"),
         }
-        write_json(save_json_path, save_item)
-        # break  # --- IGNORE: 先测试一条，确认流程正确 ---
+        writer.write(save_item)
+
+    # 多个 endpoint 共享任务队列（work stealing），结果按完成顺序追加，compact 时按 id 去重
+    api_urls = [u.strip() for u in getattr(args, "api_urls", API_URL).split(",") if u.strip()]
+    stats = run_dispatch(
+        jobs,
+        lambda job: build_payload(job[1], job[2], model_path),
+        on_result,
+        api_urls,
+        concurrency=getattr(args, "concurrency", 1),
+        health_interval=getattr(args, "health_interval", 10.0),
+        timeout=600,
+    )
+    pbar.close()
+    report_endpoints(stats)
 
+    writer.close()
+    compact_results(save_json_path)
     print(f"[INFO] ✅ Done! Saved results to {save_json_path}")
 
 
@@ -153,6 +186,10 @@ def main():
         default="GOODADS",
         help="icon, mnist, hanzi,VisA, BTech, MVTEC, ELPV, GOODADS, RAD, MPDD, MVTEC_loco"
     )
+    parser.add_argument("--api_urls", type=str, default=API_URL,
+                        help="逗号分隔的多个 endpoint（同一个模型），共享任务队列分发")
+    parser.add_argument("--concurrency", type=int, default=1, help="每个 endpoint 同时在飞的请求数")
+    parser.add_argument("--health_interval", type=float, default=10.0, help="健康检查间隔（秒）")
     
     args = parser.parse_args()
 
@@ -0,0 +1,241 @@
+import argparse
+import json
+import random
+from pathlib import Path
+from typing import Dict, Any, List
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from get_png import FONT_DIR, sample_pair_style
+
+
+# ===============================
+# Glyph atlas
+# ===============================
+# 每个字符在每个字体下只光栅化一次（参考字号 REF_FONT_SIZE，居中），
+# 存成一张打包的 uint8 覆盖率 atlas：
+#   <atlas>.npy         (M, size, size) uint8，0 = 背景，255 = 笔画
+#   <atlas>.index.json  {"size", "ref_font_size", "fonts", "index": {"char\tfont\tsize": offset}}
+# pair-level style（scale / tx / ty / fill / background）在采样时用
+# 向量化仿射变换 + 颜色混合完成，不再逐字写 PNG。
+
+REF_FONT_SIZE = 52  # sample_pair_style 的最大 font_size，只做缩小
+
+
+def atlas_key(char: str, font_name: str, font_size: int) -> str:
+    return f"{char}\t{font_name}\t{font_size}"
+
+
+def list_fonts(font_dir: Path) -> List[Path]:
+    return sorted(
+        p for p in Path(font_dir).iterdir()
+        if p.suffix.lower() in {".ttf", ".ttc", ".otf"}
+    )
+
+
+def rasterize_glyph(char: str, font: ImageFont.FreeTypeFont, size: int) -> np.ndarray:
+    """与 render_hanzi_png 相同的居中方式，输出 (size, size) 覆盖率。"""
+    img = Image.new("L", (size, size), color=0)
+    draw = ImageDraw.Draw(img)
+
+    bbox = draw.textbbox((0, 0), char, font=font)
+    text_w = bbox[2] - bbox[0]
+    text_h = bbox[3] - bbox[1]
+
+    x = (size - text_w) / 2
+    y = (size - text_h) / 2
+
+    draw.text((x, y), char, font=font, fill=255, anchor="lt")
+    return np.asarray(img, dtype=np.uint8)
+
+
+def pair_chars(pairs) -> List[str]:
+    return sorted({
+        c for pair in pairs for c in pair
+        if isinstance(c, str) and len(c) == 1
+    })
+
+
+def build_atlas(pairs, font_dir: Path, atlas_path: Path, size: int = 60):
+    chars = pair_chars(pairs)
+    fonts = list_fonts(font_dir)
+    if not fonts:
+        raise FileNotFoundError(f"No font files found in {font_dir}")
+
+    atlas = np.zeros((len(chars) * len(fonts), size, size), dtype=np.uint8)
+    index = {}
+
+    offset = 0
+    for font_file in fonts:
+        font = ImageFont.truetype(font=str(font_file), size=REF_FONT_SIZE)
+        for char in chars:
+            atlas[offset] = rasterize_glyph(char, font, size)
+            index[atlas_key(char, font_file.name, REF_FONT_SIZE)] = offset
+            offset += 1
+
+    atlas_path = Path(atlas_path)
+    atlas_path.parent.mkdir(parents=True, exist_ok=True)
+    np.save(atlas_path.with_suffix(".npy"), atlas)
+    with atlas_path.with_suffix(".index.json").open("w", encoding="utf-8") as f:
+        json.dump({
+            "size": size,
+            "ref_font_size": REF_FONT_SIZE,
+            "fonts": [p.name for p in fonts],
+            "index": index,
+        }, f, ensure_ascii=False)
+
+    print(f"[INFO] Atlas: {len(chars)} chars x {len(fonts)} fonts -> {atlas_path.with_suffix('.npy')}")
+
+
+def load_atlas(atlas_path: Path):
+    atlas_path = Path(atlas_path)
+    atlas = np.load(atlas_path.with_suffix(".npy"), mmap_mode="r")
+    with atlas_path.with_suffix(".index.json").open("r", encoding="utf-8") as f:
+        meta = json.load(f)
+    meta["atlas"] = atlas
+    return meta
+
+
+def atlas_missing(pairs, font_dir: Path, atlas_path: Path, size: int = 60) -> str:
+    """
+    已有 atlas 能否覆盖这批 pairs：返回缺失原因，全部覆盖时返回空串。
+    字符 / 字体 / size 任一对不上都要重建，否则 render_pair 会在 index 上 KeyError。
+    """
+    atlas_path = Path(atlas_path)
+    index_path = atlas_path.with_suffix(".index.json")
+    if not atlas_path.with_suffix(".npy").exists() or not index_path.exists():
+        return "no atlas"
+    with index_path.open("r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("size") != size or meta.get("ref_font_size") != REF_FONT_SIZE:
+        return f"size {meta.get('size')}/{meta.get('ref_font_size')} != {size}/{REF_FONT_SIZE}"
+    fonts = [p.name for p in list_fonts(font_dir)]
+    if meta.get("fonts") != fonts:
+        return "font list changed"
+    index = meta.get("index", {})
+    missing = [c for c in pair_chars(pairs) if atlas_key(c, fonts[0], REF_FONT_SIZE) not in index] if fonts else []
+    if missing:
+        return f"{len(missing)} chars missing (e.g. {''.join(missing[:10])})"
+    return ""
+
+
+# ===============================
+# 向量化 style 采样
+# ===============================
+
+def warp_coverage(masks: np.ndarray, scale: float, tx: float, ty: float) -> np.ndarray:
+    """
+    masks: (k, S, S) uint8，以画布中心缩放 scale 后平移 (tx, ty)，双线性采样。
+    同一 pair 的所有字共用一次坐标计算。
+    """
+    k, S, _ = masks.shape
+    c = (S - 1) / 2.0
+
+    grid = np.arange(S, dtype=np.float32)
+    src_x = (grid - c - tx) / scale + c
+    src_y = (grid - c - ty) / scale + c
+
+    x0 = np.floor(src_x).astype(np.int64)
+    y0 = np.floor(src_y).astype(np.int64)
+    wx = (src_x - x0)[None, None, :]
+    wy = (src_y - y0)[None, :, None]
+
+    # 越界按 0（背景）处理
+    padded = np.zeros((k, S + 2, S + 2), dtype=np.float32)
+    padded[:, 1:-1, 1:-1] = masks
+    x0p = np.clip(x0 + 1, 0, S + 1)
+    x1p = np.clip(x0 + 2, 0, S + 1)
+    y0p = np.clip(y0 + 1, 0, S + 1)
+    y1p = np.clip(y0 + 2, 0, S + 1)
+
+    r0, r1 = padded[:, y0p], padded[:, y1p]
+    top = r0[:, :, x0p] * (1 - wx) + r0[:, :, x1p] * wx
+    bot = r1[:, :, x0p] * (1 - wx) + r1[:, :, x1p] * wx
+    return top * (1 - wy) + bot * wy
+
+
+def render_pair(atlas_meta, chars: List[str], font_name: str, style: Dict[str, Any]) -> np.ndarray:
+    """chars 同一 pair、同一字体 -> (k, S, S, 3) uint8 RGB"""
+    ref = atlas_meta["ref_font_size"]
+    offsets = [atlas_meta["index"][atlas_key(c, font_name, ref)] for c in chars]
+    masks = np.asarray(atlas_meta["atlas"][offsets])
+
+    # 与 render_hanzi_png 一致：实际字号 = int(font_size * scale)
+    font_size = int(style.get("font_size", 48) * style.get("scale", 1.0))
+    alpha = warp_coverage(
+        masks,
+        scale=font_size / ref,
+        tx=style.get("tx", 0.0),
+        ty=style.get("ty", 0.0),
+    )[..., None] / 255.0
+
+    fill = np.array(ImageColor.getrgb(style.get("fill", "black")), dtype=np.float32)
+    background = np.array(ImageColor.getrgb(style.get("background", "white")), dtype=np.float32)
+
+    out = background * (1 - alpha) + fill * alpha
+    return np.clip(out + 0.5, 0, 255).astype(np.uint8)
+
+
+def pick_pair_font(pair_id: int, fonts: List[str]) -> str:
+    # get_png.py 每个 pair 随机选一个字体；这里按 pair_id 固定下来，保证可复现
+    return random.Random(f"font-{pair_id}").choice(fonts)
+
+
+# ===============================
+# 导出为 Test_data/glyph_pool 的 npy 池
+# ===============================
+
+def export_pool(pairs, atlas_meta, pool_dir: Path):
+    """
+    每个 pair 写成 <pair_id>.npy + <pair_id>.names.json，
+    与 hanzi_png/<pair_id>/<char>.png 目录一一对应，
+    IOL_main.py / SOI_main.py 用 --pool_cache 直接读取。
+    """
+    pool_dir = Path(pool_dir)
+    pool_dir.mkdir(parents=True, exist_ok=True)
+
+    for pair_id, pair in enumerate(pairs):
+        chars = [c for c in pair if isinstance(c, str) and len(c) == 1]
+        if not chars:
+            print(f"⚠️ 跳过空 pair {pair_id}")
+            continue
+
+        style = sample_pair_style(seed=pair_id)
+        font_name = pick_pair_font(pair_id, atlas_meta["fonts"])
+        arr = render_pair(atlas_meta, chars, font_name, style)
+
+        np.save(pool_dir / f"{pair_id}.npy", arr)
+        with (pool_dir / f"{pair_id}.names.json").open("w", encoding="utf-8") as f:
+            json.dump([f"{c}.png" for c in chars], f, ensure_ascii=False)
+
+    print(f"[INFO] Exported {len(pairs)} pairs -> {pool_dir}")
+
+
+# ===============================
+# CLI
+# ===============================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pairs_json", type=str, default="similar_chars.json")
+    parser.add_argument("--font_dir", type=str, default=str(FONT_DIR))
+    parser.add_argument("--atlas", type=str, default="hanzi_atlas")
+    parser.add_argument("--size", type=int, default=60)
+    parser.add_argument("--pool_dir", type=str, default="hanzi_pool",
+                        help="导出 glyph_pool 格式的 npy 池；为空则只构建 atlas")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="忽略已有 atlas 重新光栅化（已有 atlas 缺字 / 字体或 size 变化时也会自动重建）")
+    args = parser.parse_args()
+
+    with open(args.pairs_json, "r", encoding="utf-8") as f:
+        pairs = json.load(f)
+    assert isinstance(pairs, list), "JSON 顶层必须是 list"
+
+    reason = "--rebuild" if args.rebuild else atlas_missing(pairs, Path(args.font_dir), Path(args.atlas), size=args.size)
+    if reason:
+        print(f"[INFO] Building atlas ({reason})")
+        build_atlas(pairs, Path(args.font_dir), Path(args.atlas), size=args.size)
+
+    if args.pool_dir:
+        export_pool(pairs, load_atlas(Path(args.atlas)), Path(args.pool_dir))
@@ -2,9 +2,13 @@ import json
 import csv
 import re
 import os
+import sys
 from pathlib import Path
 from tqdm import tqdm
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from oddgrid_common.bitmask_metrics import MaskEncoder, score, summarize
+
 # =========================
 # 1. 标准化工具
 # =========================
@@ -43,59 +47,27 @@ def normalize_pred(extract_answer):
     return indices
 
 # =========================
-# 2. 核心计算逻辑 (Cell/Unit Level)
-# =========================
-def compute_soi_metrics(pred_set, gt_set, total_count):
-    """
-    计算混淆矩阵：TP, FP, TN, FN
-    """
-    tp, fp, tn, fn = 0, 0, 0, 0
-    
-    # 如果格式错误 (None)，视为模型在该样本中没提供任何有效预测
-    # 此时所有 GT 中的 Odd 变为 FN，所有 Normal 变为 TN
-    current_pred = pred_set if pred_set is not None else set()
-
-    for i in range(1, total_count + 1):
-        is_pred_odd = i in current_pred
-        is_gt_odd = i in gt_set
-        
-        if is_gt_odd and is_pred_odd:
-            tp += 1
-        elif is_gt_odd and not is_pred_odd:
-            fn += 1
-        elif not is_gt_odd and is_pred_odd:
-            fp += 1
-        else:
-            tn += 1
-            
-    return tp, fp, tn, fn
-
-# =========================
-# 3. 评估逻辑
+# 2. 评估逻辑
 # =========================
 def eval_json_file(json_path: Path):
     with open(json_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
 
-    t_tp, t_fp, t_tn, t_fn = 0, 0, 0, 0
-    
+    # 混淆矩阵按 1..total_count 逐位统计；格式错误视为空预测（GT 里的 Odd 记 FN），超出范围的编号不计
+    encoder = MaskEncoder("soi")
     for sample in data:
         gt = normalize_gt(sample.get("answer", []))
         pred = normalize_pred(sample.get("extract_answer", ""))
-        
+
         # 自动获取该组图片的数量，默认 9
         total_imgs = sample.get("total_images") or sample.get("image_num") or 9
         # if total_imgs != 8:
         #     continue
-        tp, fp, tn, fn = compute_soi_metrics(pred, gt, int(total_imgs))
-        t_tp += tp; t_fp += fp; t_tn += tn; t_fn += fn
+        encoder.add(gt, pred, total_count=int(total_imgs))
 
-    # 计算最终比率
-    total_units = t_tp + t_fp + t_tn + t_fn
-    acc = (t_tp + t_tn) / total_units if total_units > 0 else 0
-    precision = t_tp / (t_tp + t_fp) if (t_tp + t_fp) > 0 else 0
-    recall = t_tp / (t_tp + t_fn) if (t_tp + t_fn) > 0 else 0
-    f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0
+    m = summarize(score(encoder.batch()))
+    t_tp, t_fp, t_tn, t_fn = m["tp"], m["fp"], m["tn"], m["fn"]
+    acc, precision, recall, f1 = m["acc"], m["cell_precision"], m["cell_recall"], m["cell_f1"]
 
     return {
         "count": len(data),
@@ -142,7 +114,7 @@ def run_soi_evaluation(dir_list):
         print(f"✅ 完成！结果已保存至: {csv_file}")
 
 # =========================
-# 4. 入口
+# 3. 入口
 # =========================
 if __name__ == "__main__":
     # 在此填入你的 SOI 结果目录名
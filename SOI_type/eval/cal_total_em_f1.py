@@ -1,135 +1,14 @@
-import json
 import csv
+import os
 import re
+import sys
 from pathlib import Path
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from oddgrid_common.warehouse import open_warehouse
 
-# =========================
-# Normalize GT: answer -> List[int]
-# =========================
-def normalize_gt(answer):
-    if not answer:
-        return []
-    return [int(x) for x in answer]
-
-
-# =========================
-# Normalize Pred: extract_answer -> List[int] | None
-# None 表示格式错误
-# =========================
-_IMAGE_RE = re.compile(r"^image(\d+)$")
-
-def normalize_pred(extract_answer):
-    """
-    合法：
-      "image2" -> [2]
-      "image2, image5" -> [2,5]
-      ["image2", "image5"] -> [2,5]
-      [] -> []
-    非法：
-      "" / None / 乱格式 -> None
-    """
-    if extract_answer is None:
-        return None
-
-    # 空 list：合法，表示无异常
-    if extract_answer == []:
-        return []
-
-    indices = []
-
-    # -------- case 1: list[str] --------
-    if isinstance(extract_answer, list):
-        for p in extract_answer:
-            if not isinstance(p, str):
-                return None
-            m = _IMAGE_RE.match(p.strip())
-            if not m:
-                return None
-            indices.append(int(m.group(1)))
-        return indices
-
-    # -------- case 2: str --------
-    if not isinstance(extract_answer, str):
-        return None
-
-    s = extract_answer.strip()
-    if s == "":
-        return None
-
-    parts = [p.strip() for p in s.split(",")]
-    for p in parts:
-        m = _IMAGE_RE.match(p)
-        if not m:
-            return None
-        indices.append(int(m.group(1)))
-
-    return indices
-
-
-# =========================
-# EM / F1
-# =========================
-def compute_em_f1(pred, gt):
-    """
-    pred: List[int] | None
-    gt:   List[int]
-    """
-    # 格式错误
-    if pred is None:
-        return 0, 0.0
-
-    pred_set = set(pred)
-    gt_set = set(gt)
-
-    # 无异常 & 判断正确
-    if len(gt_set) == 0 and len(pred_set) == 0:
-        return 1, 1.0
-
-    # EM
-    em = int(pred_set == gt_set)
-
-    # F1
-    tp = len(pred_set & gt_set)
-    fp = len(pred_set - gt_set)
-    fn = len(gt_set - pred_set)
-
-    precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
-    recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
-
-    f1 = (
-        2 * precision * recall / (precision + recall)
-        if (precision + recall) > 0
-        else 0.0
-    )
-
-    return em, f1
-
-
-# =========================
-# Evaluate one json file
-# =========================
-def eval_json_file(json_path: Path):
-    data = json.loads(json_path.read_text(encoding="utf-8"))
-
-    em_sum = 0.0
-    f1_sum = 0.0
-    n = 0
-
-    for sample in data:
-        gt = normalize_gt(sample.get("answer", []))
-        pred = normalize_pred(sample.get("extract_answer", ""))
-
-        em, f1 = compute_em_f1(pred, gt)
-        print(f"ID: {sample.get('id')}, EM: {em}, F1: {f1:.3f}, GT: {gt}, Pred: {pred}")
-        em_sum += em
-        f1_sum += f1
-        n += 1
+TASK = "soi"
 
-    return (
-        em_sum / n if n else 0.0,
-        f1_sum / n if n else 0.0,
-    )
 
 def model_size_key(model_name: str):
     """
@@ -149,9 +28,14 @@ def eval_json_dir(json_dir: str, out_csv: str):
 
     results = {}
 
+    # 解析结果缓存在 oddgrid_common/warehouse.py 的 sqlite 里，文件没变时不再重读
+    warehouse = open_warehouse()
     for jp in json_files:
-        em, f1 = eval_json_file(jp)
-        results[jp.stem] = {"EM": em, "F1": f1}
+        m = warehouse.file_metrics(jp, TASK)
+        if m is None and warehouse.is_stopped_early(jp, TASK):
+            continue   # 序贯评测提前停止，只跑了部分样本
+        m = m or {"EM": 0.0, "F1": 0.0}
+        results[jp.stem] = {"EM": m["EM"], "F1": m["F1"]}
 
     with open(out_csv, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
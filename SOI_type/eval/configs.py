@@ -2,6 +2,25 @@ import os
 # models_dir = "../models/"
 max_new_tokens = 2048
 
+# vllm_infer_dire 离线批量推理：样本数 / 图片数 / prompt 字符数 三个预算
+batch_size = 16
+max_batch_images = 64
+max_batch_prompt_chars = 64000
+# Transformers 兜底（Qwen3.5、Gemma-4）每次 generate 的图片数上限：整组按最长样本 padding，比 vLLM 的小
+hf_max_batch_images = 16
+
+# --early_stop：第一个 \boxed{} 闭合后再生成多少个 token 没有新 boxed 就停
+early_stop_grace = 8
+
+# LoRA checkpoint（目录里有 adapter_config.json）挂在 base 上推理时的最大 rank
+max_lora_rank = 64
+
+# 每条请求的视觉 token 上限（客户端按比例预缩放图片），按模型名配置；None / 不配置表示不缩放。
+# 命令行 --token_budget 优先。设置了预算时结果文件名带 _tb<预算>，不会覆盖原分辨率的结果。
+token_budgets = {
+    # "Qwen3-VL-8B-Instruct": 4096,
+}
+
 CUR_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.abspath(os.path.join(CUR_DIR, "../../../"))
 models_dir = os.path.join(ROOT_DIR, "models")
@@ -42,14 +61,17 @@ def get_configs(args):
     #     json_path = "../../Abaltion_data/Nanfang/soi_test_data/soi_test_data.json"
 
     # 输出路径
-    Result_root = args.data_type + "_output/"
+    Result_root = getattr(args, "result_root", None) or args.data_type + "_output/"
 
     if args.image_type == "with_number":
         image_dir = image_dir.replace("image", "image_number")
         Result_root = "output_number/"
         
     if not os.path.exists(Result_root):
-        os.mkdir(Result_root)
+        os.makedirs(Result_root)
+
+    token_budget = getattr(args, "token_budget", None) or token_budgets.get(args.model_name)
+    save_name = args.model_name if not token_budget else f"{args.model_name}_tb{token_budget}"
     return {
         "image_type": args.image_type,
         "data_type": args.data_type,
@@ -59,5 +81,6 @@ def get_configs(args):
         "Result_root": Result_root,
         "models_dir": models_dir,
         "model_path": os.path.join(models_dir, args.model_name),
-        "save_path": os.path.join(Result_root, f"{args.model_name}.json"),
+        "save_path": os.path.join(Result_root, f"{save_name}.json"),
+        "token_budget": token_budget,
     }
\ No newline at end of file
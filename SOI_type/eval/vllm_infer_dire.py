@@ -1,24 +1,63 @@
 import os
 os.environ.setdefault("VLLM_USE_V1", "0")
 import argparse
+import gc
 import json
-import base64
-from io import BytesIO
-from PIL import Image
+import time
 from tqdm import tqdm
-import torch
 
-from configs import get_configs, max_new_tokens
-from utils import *
+import sys
+from configs import get_configs, max_new_tokens, batch_size, max_batch_images, max_batch_prompt_chars, early_stop_grace, max_lora_rank, hf_max_batch_images
+from utils import (
+    extract_answer_from_response, build_prompt_different_angle, build_prompt_same_angle_synthesis,
+    build_prompt_same_angle_real, strata_key,
+)
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from oddgrid_common.batching import run_batched
+from oddgrid_common.early_stop import BoxedStopLogitsProcessor, generated_text
+from oddgrid_common.eval_daemon import adapter_base
+from oddgrid_common.image_cache import load_pil_image, raw_b64, pil_png_b64
+from oddgrid_common.response_cache import ResponseCache, request_key
+from oddgrid_common.results_store import ResultsWriter, load_processed_keys, compact_results, iter_results, update_header
+from oddgrid_common.screening import stratified_order
+from oddgrid_common.sequential import SequentialStopper
+from oddgrid_common.token_budget import image_size, plan_scale, resize_image, TokenBudgetLog
+from oddgrid_common.trace_replay import Trace, TraceWriter, direct_key
+from oddgrid_common.warehouse import score_sample
 
-# ===== 新增：vLLM =====
-from vllm import LLM, SamplingParams
 from types import SimpleNamespace
 
 # ===============================
 # vLLM 初始化（全局，只初始化一次）
 # ===============================
 _VLLM_MODEL = None
+_VLLM_BASE = None        # 已加载的 base 模型路径
+_VLLM_LORA = False       # 加载时是否打开了 LoRA
+_LORA_IDS = {}
+
+# vLLM / torch 在第一次推理时才 import：--dry_run、续跑检查、配置校验，
+# 以及 import run_vllm_http 的脚本（eval_rl_models_persistent 等）都不付这几秒。
+# 入口模块的 import 耗时用 oddgrid_common/import_check.py 检查。
+_VLLM = None
+
+
+def vllm_backend():
+    """import vllm（只一次），返回 SimpleNamespace(LLM, SamplingParams, LoRARequest, pil_input)"""
+    global _VLLM
+    if _VLLM is None:
+        from vllm import LLM, SamplingParams
+        try:
+            from vllm.entrypoints.chat_utils import CustomChatCompletionContentPILImageParam  # noqa: F401
+            pil_input = True
+        except ImportError:
+            pil_input = False
+        try:
+            from vllm.lora.request import LoRARequest
+        except ImportError:
+            LoRARequest = None
+        _VLLM = SimpleNamespace(LLM=LLM, SamplingParams=SamplingParams, LoRARequest=LoRARequest, pil_input=pil_input)
+    return _VLLM
 
 def is_qwen35_model(model_path):
     return "qwen3.5" in os.path.basename(model_path).lower()
@@ -36,123 +75,265 @@ def is_internvl_model(model_path):
     return "internvl" in os.path.basename(model_path).lower()
 
 
-class TransformersChatModel:
-    def __init__(self, model_path):
-        from transformers import AutoModelForImageTextToText, AutoProcessor
-
-        self.processor = AutoProcessor.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-        )
-        self.model = AutoModelForImageTextToText.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-            torch_dtype=torch.bfloat16,
-            device_map="auto",
-        )
-        self.model.eval()
-
-    def chat(self, messages, sampling_params, **kwargs):
-        template_kwargs = kwargs.pop("chat_template_kwargs", {})
-        kwargs.update(template_kwargs)
-        inputs = self.processor.apply_chat_template(
-            messages,
-            add_generation_prompt=True,
-            tokenize=True,
-            return_dict=True,
-            return_tensors="pt",
-            **kwargs,
-        )
-        inputs = {
-            key: value.to(self.model.device) if hasattr(value, "to") else value
-            for key, value in inputs.items()
-        }
-        input_len = inputs["input_ids"].shape[-1]
-        with torch.inference_mode():
-            generated = self.model.generate(
-                **inputs,
-                do_sample=False,
-                max_new_tokens=sampling_params.max_tokens,
-            )
-        text = self.processor.decode(
-            generated[0][input_len:],
-            skip_special_tokens=True,
-        )
-        return [SimpleNamespace(outputs=[SimpleNamespace(text=text)])]
-
-
-def get_vllm_model(model_path):
-    global _VLLM_MODEL
-    tp = torch.cuda.device_count()
+def get_vllm_model(model_path, enable_lora=False):
+    """
+    model_path 是 LoRA adapter 目录时加载它的 base（打开 LoRA），推理时按 adapter 挂上去；
+    已加载的 base 不同（或需要 LoRA 但加载时没开）时先释放再加载。
+    """
+    global _VLLM_MODEL, _VLLM_BASE, _VLLM_LORA
+    base_path = adapter_base(model_path)
+    enable_lora = enable_lora or base_path is not None
+    base_path = base_path or model_path
+    if _VLLM_MODEL is not None and (_VLLM_BASE != base_path or (enable_lora and not _VLLM_LORA)):
+        print(f"[INFO] Swap model: {_VLLM_BASE} -> {base_path}")
+        release_vllm_model()
     if _VLLM_MODEL is None:
-        # if needs_transformers_fallback(model_path):
-        #     print(f"[INFO] {os.path.basename(model_path)} is not supported by vLLM 0.8.x; using Transformers fallback.")
-        #     _VLLM_MODEL = TransformersChatModel(model_path)
-        #     return _VLLM_MODEL
+        if needs_transformers_fallback(base_path):
+            if enable_lora:
+                raise RuntimeError(f"{model_path}: the Transformers fallback cannot apply LoRA adapters; merge it first")
+            print(f"[INFO] {os.path.basename(base_path)} is not supported by vLLM 0.8.x; using Transformers fallback.")
+            from oddgrid_common.hf_fallback import TransformersChatModel
+            _VLLM_MODEL = TransformersChatModel(base_path, max_batch_size=batch_size, max_batch_images=hf_max_batch_images)
+            _VLLM_BASE, _VLLM_LORA = base_path, False
+            return _VLLM_MODEL
+
+        import torch
+        tp = torch.cuda.device_count()
 
         llm_kwargs = {
-            "model": model_path,
+            "model": base_path,
             "max_model_len": 12000,
             "trust_remote_code": True,
             "tensor_parallel_size": tp,
             "gpu_memory_utilization": 0.8,
         }
-        if is_internvl_model(model_path):
+        if is_internvl_model(base_path):
             llm_kwargs["mm_processor_kwargs"] = {"max_dynamic_patch": 1}
 
-        _VLLM_MODEL = LLM(**llm_kwargs)
+        if enable_lora:
+            llm_kwargs.update(enable_lora=True, max_lora_rank=max_lora_rank)
+
+        _VLLM_MODEL = vllm_backend().LLM(**llm_kwargs)
+        _VLLM_BASE, _VLLM_LORA = base_path, enable_lora
     return _VLLM_MODEL
 
 
-def call_vllm_server(prompt, image_paths, model_path):
-    llm = get_vllm_model(model_path)
+def release_vllm_model():
+    """释放当前引擎（常驻进程里换 base 用）"""
+    global _VLLM_MODEL, _VLLM_BASE, _VLLM_LORA
+    if _VLLM_MODEL is None:
+        return
+    _VLLM_MODEL = None
+    _VLLM_BASE, _VLLM_LORA = None, False
+    _LORA_IDS.clear()
+    try:
+        from vllm.distributed.parallel_state import destroy_model_parallel, destroy_distributed_environment
+        destroy_model_parallel()
+        destroy_distributed_environment()
+    except Exception as e:
+        print(f"[WARN] vLLM distributed cleanup failed: {e}")
+    gc.collect()
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def lora_request_for(model_path):
+    """adapter 目录 -> LoRARequest；完整模型返回 None"""
+    if adapter_base(model_path) is None:
+        return None
+    LoRARequest = vllm_backend().LoRARequest
+    if LoRARequest is None:
+        raise RuntimeError(f"{model_path} is a LoRA adapter but this vLLM has no LoRA support")
+    lora_id = _LORA_IDS.setdefault(model_path, len(_LORA_IDS) + 1)
+    return LoRARequest(os.path.basename(model_path), lora_id, model_path)
 
+
+def build_messages(prompt, image_paths, scale=1.0):
+    """scale < 1：按视觉 token 预算缩小后的图片"""
     content = []
+    # 回放 trace 时不 import vLLM；trace 的 key 按像素哈希，与消息格式无关
+    pil_input = True if _TRACE_REPLAY is not None else vllm_backend().pil_input
 
     for img_path in image_paths:
-        with Image.open(img_path) as img:
-            if img.mode not in ("RGB", "RGBA"):
-                img = img.convert("RGB")
-            buf = BytesIO()
-            img.save(buf, format="PNG")
-            b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-        content.append({
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:image/png;base64,{b64}"
-            }
-        })
+        if pil_input:
+            # 解码后的 PIL 图直接交给 vLLM，不再 PNG 编码 + base64
+            content.append({
+                "type": "image_pil",
+                "image_pil": resize_image(load_pil_image(img_path), scale),
+            })
+        elif scale < 1.0:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/png;base64,{pil_png_b64(resize_image(load_pil_image(img_path), scale))}"
+                }
+            })
+        else:
+            # 老版本 vLLM 不认 image_pil：原始文件字节直接 base64，同样不重编码
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/png;base64,{raw_b64(img_path)}"
+                }
+            })
 
     content.append({
         "type": "text",
         "text": prompt.strip()
     })
 
-    messages = [{
+    return [{
         "role": "user",
         "content": content
     }]
 
-    sampling_params = SamplingParams(
+
+def chat_batch(llm, conversations, model_path, early_stop=None):
+    """
+    一次 llm.chat 提交多条 conversation，返回与输入顺序一致的文本列表（GeneratedText：带 completion_tokens / early_stopped）。
+    early_stop: BoxedStopLogitsProcessor，答案 boxed 闭合后提前结束生成
+    """
+    sp_kwargs = {}
+    if early_stop is not None:
+        if early_stop.tokenizer is None:
+            early_stop.bind(llm.get_tokenizer())
+        early_stop.stats["requests"] += len(conversations)
+        sp_kwargs["logits_processors"] = [early_stop]
+
+    sampling_params = vllm_backend().SamplingParams(
         temperature=0.0,
         max_tokens=max_new_tokens,
+        **sp_kwargs,
+    )
+
+    chat_kwargs = {}
+    if is_qwen35_model(model_path):
+        chat_kwargs["chat_template_kwargs"] = {"enable_thinking": False}
+    lora_request = lora_request_for(model_path)
+    if lora_request is not None:
+        chat_kwargs["lora_request"] = lora_request
+
+    outputs = llm.chat(
+        messages=conversations,
+        sampling_params=sampling_params,
+        **chat_kwargs,
     )
+    return [generated_text(out.outputs[0], early_stop) for out in outputs]
+
+
+def sampling_signature(model_path, early_stop=None):
+    """参与缓存 key 的生成参数（与 chat_batch 保持一致）"""
+    sig = {"temperature": 0.0, "max_tokens": max_new_tokens}
+    if is_qwen35_model(model_path):
+        sig["chat_template_kwargs"] = {"enable_thinking": False}
+    if early_stop is not None:
+        sig["early_stop_grace"] = early_stop.grace_tokens
+    return sig
+
+
+# ===============================
+# trace 录制 / 回放（oddgrid_common/trace_replay.py）
+# ===============================
+_TRACE_WRITER = None
+_TRACE_REPLAY = None
+_TRACE_SCALE = 1.0
+
+
+def configure_trace(record=None, replay=None, latency_scale=1.0):
+    """--trace_record / --trace_replay；常驻进程里同一路径重复调用时复用"""
+    global _TRACE_WRITER, _TRACE_REPLAY, _TRACE_SCALE
+    if not record:
+        _TRACE_WRITER = None
+    elif _TRACE_WRITER is None or str(_TRACE_WRITER.path) != record:
+        _TRACE_WRITER = TraceWriter(record)
+    if not replay:
+        _TRACE_REPLAY = None
+    elif _TRACE_REPLAY is None or str(_TRACE_REPLAY.path) != replay:
+        _TRACE_REPLAY = Trace(replay)
+    _TRACE_SCALE = latency_scale
+
+
+def generate_batch(conversations, model_path, early_stop=None):
+    """
+    chat_batch 的入口：--trace_replay 时从 trace 回放（不加载模型，miss 返回 None：
+    on_result 不写结果，这些样本留给之后的真实推理续跑），--trace_record 时把这一 batch 的结果与耗时追加进 trace。
+    """
+    if _TRACE_REPLAY is None and _TRACE_WRITER is None:
+        return chat_batch(get_vllm_model(model_path), conversations, model_path, early_stop)
+
+    sig = sampling_signature(model_path, early_stop)
+    keys = [direct_key(model_path, conv, sig) for conv in conversations]
+    if _TRACE_REPLAY is not None:
+        return _TRACE_REPLAY.replay_batch(keys, _TRACE_SCALE)
+
+    start = time.perf_counter()
+    texts = chat_batch(get_vllm_model(model_path), conversations, model_path, early_stop)
+    _TRACE_WRITER.write_batch(keys, texts, time.perf_counter() - start,
+                              model=os.path.basename(model_path), source="vllm")
+    return texts
+
+
+def chat_batch_cached(conversations, model_path, cache, early_stop=None):
+    """
+    先查推理结果缓存，只把 miss 的 conversation 交给 llm.chat；
+    全部命中时不加载模型。
+    """
+    if cache is None or not cache.enabled:
+        return generate_batch(conversations, model_path, early_stop)
+
+    sig = sampling_signature(model_path, early_stop)
+    keys = [request_key(model_path, conv, sig) for conv in conversations]
+    texts = [None] * len(conversations)
+    misses = []
+    for i, key in enumerate(keys):
+        cached = cache.get(key)
+        if cached is not None:
+            texts[i] = cached["text"]
+        else:
+            misses.append(i)
 
+    if misses:
+        outputs = generate_batch([conversations[i] for i in misses], model_path, early_stop)
+        for i, text in zip(misses, outputs):
+            texts[i] = text
+            if text is not None:
+                cache.put(keys[i], {"text": text})
+    return texts
+
+
+def call_vllm_server(prompt, image_paths, model_path, cache=None, early_stop=None):
     try:
-        chat_kwargs = {}
-        if is_qwen35_model(model_path):
-            chat_kwargs["chat_template_kwargs"] = {"enable_thinking": False}
-
-        outputs = llm.chat(
-            messages=messages,
-            sampling_params=sampling_params,
-            **chat_kwargs,
-        )
-        return outputs[0].outputs[0].text
+        return chat_batch_cached([build_messages(prompt, image_paths)], model_path, cache, early_stop)[0]
     except Exception as e:
         print(f"[ERROR] vLLM inference failed: {e}")
         return None
 
+
+def score_record(record):
+    """单条结果 -> (EM, F1)"""
+    return score_sample(record, "soi")
+
+
+def dry_run_summary(args, configs_para, json_data, processed_ids):
+    """--dry_run：只解析配置、按续跑索引统计待跑样本，不 import vLLM / torch"""
+    sample_ids = getattr(args, "sample_ids", None)
+    pending = sum(
+        1 for data in json_data
+        if data.get("id") not in processed_ids and (sample_ids is None or data.get("id") in sample_ids)
+    )
+    for label, path in (("Model", configs_para["model_path"]), ("Image", configs_para["image_dir"])):
+        if not os.path.isdir(path):
+            print(f"[WARN] {label} directory not found: {path}")
+    print(f"[DRY-RUN] {args.data_type} / {args.model_name}: pending {pending}, save to {configs_para['save_path']}")
+    return {
+        "save_path": configs_para["save_path"],
+        "total": len(json_data),
+        "processed": len(processed_ids),
+        "pending": pending,
+    }
+
+
 def run_vllm_http(args):
     """读取 JSON -> 调 HTTP -> 写结果（串行，服务端负责并发与多卡）"""
     configs_para = get_configs(args)
@@ -168,23 +349,50 @@ def run_vllm_http(args):
         raise ValueError(f"Unknown model_name: {args.model_name}")
     # print(configs_para)
     # 已有结果 -> 去重
-    processed_ids = set()
-    if os.path.exists(save_json_path):
-        with open(save_json_path, "r", encoding="utf-8") as f:
-            for item in json.load(f):
-                if "id" in item:
-                    processed_ids.add(item["id"])
+    processed_ids = load_processed_keys(save_json_path)
 
     # 读测试集
     with open(json_path, 'r', encoding='utf-8') as f:
         json_data = json.load(f)
 
     # print(f"[INFO] Total samples: {len(json_data)}; processed: {len(processed_ids)}")
-
-    for data in tqdm(json_data):
+    if getattr(args, "dry_run", False):
+        return dry_run_summary(args, configs_para, json_data, processed_ids)
+    configure_trace(getattr(args, "trace_record", None), getattr(args, "trace_replay", None),
+                    getattr(args, "latency_scale", 1.0))
+
+    # 视觉 token 预算：按比例预缩放；不设预算时也记录原始分辨率与估算的视觉 token
+    token_budget = configs_para.get("token_budget")
+    budget_log = TokenBudgetLog(token_budget)
+
+    # 常驻评测服务（eval_daemon.py）传入的进度回调：progress(已完成, 总数)
+    progress = getattr(args, "progress", None)
+    # 只跑这些样本（checkpoint_screening.py 的分层子集）；None 表示全量
+    sample_ids = getattr(args, "sample_ids", None)
+
+    # 序贯评测：按分层随机顺序跑，EM / F1 置信区间半宽 <= target_precision（百分点）时停
+    stopper = None
+    target_precision = getattr(args, "target_precision", None)
+    if target_precision:
+        stopper = SequentialStopper(
+            target_precision,
+            confidence=getattr(args, "confidence", 0.95),
+            metric=getattr(args, "sequential_metric", "EM"),
+            population=len(sample_ids) if sample_ids is not None else len(json_data),
+        )
+        for record in iter_results(save_json_path):
+            stopper.add(*score_record(record))
+        if stopper.stopped:
+            print(f"[INFO] Existing {len(stopper.em)} results already meet ±{target_precision}pt")
+
+    writer = ResultsWriter(save_json_path)
+    pending = []
+    for data in json_data:
         id = data.get("id")
         if id in processed_ids:
             continue
+        if sample_ids is not None and id not in sample_ids:
+            continue
 
         image_names = [os.path.join(data.get("image"), str(i)+".png") for i in range(1, data.get("total_icons") + 1)]  # list of image paths
         image_paths = [os.path.join(configs_para["image_dir"], img_name) for img_name in image_names]
@@ -196,24 +404,208 @@ def run_vllm_http(args):
         else:
             prompt = build_prompt_same_angle_real(image_paths)
 
-        predict_answer = call_vllm_server(prompt, image_paths, model_path)
+        scale, tokens_before, visual_tokens, sizes = plan_scale(
+            [image_size(p) for p in image_paths], model_path, token_budget)
+        budget_log.add(tokens_before, visual_tokens, sizes, scale)
+
+        pending.append({
+            "key": len(pending),
+            "data": data,
+            "prompt": prompt,
+            "image_paths": image_paths,
+            "num_images": len(image_paths),
+            "prompt_chars": len(prompt),
+            "scale": scale,
+            "visual_tokens": visual_tokens,
+            "resolution": "%dx%d" % max(sizes, key=lambda wh: wh[0] * wh[1]),
+        })
+
+    failed = []
+
+    def on_result(item, predict_answer):
+        data = item["data"]
+        if predict_answer is None:
+            # 逐条重试后仍失败 / trace 回放 miss：不写结果（否则续跑会当成已完成、打分记为答错），留给下次续跑
+            failed.append(data.get("id"))
+            pbar.update(1)
+            return
         extract_answer = extract_answer_from_response(predict_answer)
 
         save_item = {
-            "id": id,
+            "id": data.get("id"),
             "image":data.get("image"),
             "image_num":data.get("total_icons"),
-            "prompt": prompt,
+            "prompt": item["prompt"],
             "predict_answer": predict_answer,
             "extract_answer": extract_answer,
             "answer": data.get("odd_indices", []),
             "odd_count": data.get("num_odds"),
             "total_images": data.get("total_icons"),
+            "token_budget": token_budget,
+            "budget_scale": round(item["scale"], 4),
+            "resolution": item["resolution"],
+            "visual_tokens": item["visual_tokens"],
+            # 直连推理实测（缓存命中 / trace 回放时为 None）
+            "completion_tokens": getattr(predict_answer, "completion_tokens", None),
+            "early_stopped": getattr(predict_answer, "early_stopped", None),
         }
-        write_json(save_json_path, save_item)
-    
+        writer.write(save_item)
+        pbar.update(1)
+        if stopper is not None:
+            stopper.add(*score_record(save_item))
+        if progress is not None:
+            progress(len(processed_ids) + pbar.n, len(processed_ids) + len(pending))
+
+    # 按样本数 / 图片数 / prompt 长度分组，一次 llm.chat 提交整组
+    batch_kwargs = {
+        "max_batch_size": getattr(args, "batch_size", batch_size),
+        "max_images": getattr(args, "max_batch_images", max_batch_images),
+        "max_prompt_chars": getattr(args, "max_batch_prompt_chars", max_batch_prompt_chars),
+    }
+    if stopper is not None:
+        pending = stratified_order(pending, lambda item: strata_key(item["data"]), getattr(args, "seed", 0))
+    print(f"[INFO] Pending: {len(pending)}; batching: {batch_kwargs}")
+    budget_log.report()
+
+    throughput = None
+    if pending:
+        response_cache = ResponseCache(
+            ttl=getattr(args, "cache_ttl", None),
+            enabled=not getattr(args, "no_cache", False),
+        )
+        early_stop = None
+        if getattr(args, "early_stop", False):
+            early_stop = BoxedStopLogitsProcessor(getattr(args, "early_stop_grace", early_stop_grace))
+
+        def submit(batch):
+            conversations = [build_messages(item["prompt"], item["image_paths"], item["scale"]) for item in batch]
+            return chat_batch_cached(conversations, model_path, response_cache, early_stop)
+
+        pbar = tqdm(total=len(pending))
+        items = pending if stopper is None else (item for item in pending if not stopper.stopped)
+        meter = run_batched(items, submit, on_result, batch_kwargs=batch_kwargs)
+        pbar.close()
+        throughput = meter.report()
+        if hasattr(_VLLM_MODEL, "report"):
+            _VLLM_MODEL.report()    # Transformers 兜底：generate 分组统计
+        response_cache.report()
+        for trace in (_TRACE_REPLAY, _TRACE_WRITER):
+            if trace is not None:
+                trace.report()
+        if early_stop is not None:
+            early_stop.report(max_new_tokens)
+
+    writer.close()
+    compact_results(save_json_path)
+    if failed:
+        reason = "missed the trace" if _TRACE_REPLAY is not None else "got no answer"
+        print(f"[WARN] {len(failed)} samples {reason} and were not saved; rerun to retry them")
+    if stopper is not None:
+        stopper.report()
+        update_header(save_json_path, sequential=stopper.header())
+    elif sample_ids is None:
+        # 全量跑完：之前序贯评测留下的停止点不再适用
+        update_header(save_json_path, sequential=None)
     print(f"[INFO] ✅ Done! Saved results to {save_json_path}")
+    return {"save_path": save_json_path, "throughput": throughput, "visual_tokens": budget_log.stats}
     
+# ===============================
+# 自测：假 LLM 跑完整个 run_vllm_http（CPU，不需要 vLLM / torch）
+# ===============================
+#   python vllm_infer_dire.py --selftest
+#   python vllm_infer_dire.py --selftest --selftest_n 200 --batch_size 32
+# 假 LLM 按第一张图的宽度认出样本、回答它的标准答案，所以输出回填错位时 EM 不是满分；
+# 其中一条样本抛异常：整组失败后逐条重试，这条不写结果，第二次运行（续跑）补上。
+_SELFTEST_WIDTH = 32
+
+
+class _FakeLLM:
+    def __init__(self, answers, poison=()):
+        self.answers = answers
+        self.poison = set(poison)
+        self.calls = []
+
+    def chat(self, messages, sampling_params=None, **kwargs):
+        self.calls.append(len(messages))
+        outputs = []
+        for conv in messages:
+            idx = conv[0]["content"][0]["image_pil"].width - _SELFTEST_WIDTH
+            if idx in self.poison:
+                raise RuntimeError(f"poisoned sample {idx}")
+            text = f"The odd one is at \\boxed{{{self.answers[idx]}}}"
+            completion = SimpleNamespace(text=text, token_ids=list(range(len(text) // 4)))
+            outputs.append(SimpleNamespace(outputs=[completion]))
+        return outputs
+
+
+def selftest(args):
+    global _VLLM, _VLLM_MODEL, _VLLM_BASE, get_configs
+    import tempfile
+    from PIL import Image
+
+    n = args.selftest_n
+    poison = n // 2
+    with tempfile.TemporaryDirectory() as tmp:
+        image_dir = os.path.join(tmp, "images")
+        os.makedirs(image_dir)
+        json_data, answers = [], {}
+        for i in range(n):
+            total, odd = i % 3 + 3, i % 3 + 1
+            os.makedirs(os.path.join(image_dir, str(i)))
+            for k in range(1, total + 1):
+                img = Image.new("RGB", (_SELFTEST_WIDTH + i, 32), (i % 256, k * 40, 0))
+                img.save(os.path.join(image_dir, str(i), f"{k}.png"))
+            json_data.append({"id": i, "image": str(i), "total_icons": total, "odd_indices": [odd], "num_odds": 1})
+            answers[i] = f"image{odd}"
+        json_path = os.path.join(tmp, "selftest.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(json_data, f)
+
+        model_path = os.path.join(tmp, "models", "fake")
+        configs_para = {
+            "image_type": "normal", "data_type": "icon", "image_dir": image_dir, "json_path": json_path,
+            "Result_root": tmp, "models_dir": os.path.dirname(model_path), "model_path": model_path,
+            "save_path": os.path.join(tmp, "fake.json"), "token_budget": None,
+        }
+        run_args = SimpleNamespace(
+            model_name="fake", image_type="normal", data_type="icon", no_cache=True,
+            batch_size=args.batch_size, max_batch_images=args.max_batch_images,
+            max_batch_prompt_chars=args.max_batch_prompt_chars,
+        )
+
+        saved = (_VLLM, _VLLM_MODEL, _VLLM_BASE, get_configs)
+        _VLLM = SimpleNamespace(LLM=None, SamplingParams=lambda **kw: SimpleNamespace(**kw),
+                                LoRARequest=None, pil_input=True)
+        _VLLM_BASE = model_path
+        get_configs = lambda _args: configs_para
+        try:
+            first = _VLLM_MODEL = _FakeLLM(answers, poison=[poison])
+            out = run_vllm_http(run_args)
+            after_first = load_processed_keys(configs_para["save_path"])
+            second = _VLLM_MODEL = _FakeLLM(answers)
+            run_vllm_http(run_args)
+        finally:
+            _VLLM, _VLLM_MODEL, _VLLM_BASE, get_configs = saved
+
+        records = list(iter_results(configs_para["save_path"]))
+
+    em = sum(score_record(r)[0] for r in records)
+    checks = {
+        "batched": max(first.calls) > 1,
+        "poison left pending": after_first == set(range(n)) - {poison},
+        "resume filled it": second.calls == [1],
+        "all saved once": sorted(r["id"] for r in records) == list(range(n)),
+        "outputs mapped back": em == n,
+        "token counts": all(r["completion_tokens"] for r in records),
+    }
+    print(f"[SELFTEST] calls={first.calls} + {second.calls}; EM={em}/{n}; "
+          f"{out['throughput']['samples_per_s']:.1f} samples/s")
+    for name, ok in checks.items():
+        print(f"[SELFTEST] {'OK  ' if ok else 'FAIL'} {name}")
+    if not all(checks.values()):
+        sys.exit(1)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Run multimodal inference via vLLM Python API")
     parser.add_argument("--model_name", type=str, default="Qwen3-VL-8B-Instruct")
@@ -230,7 +622,32 @@ def main():
         help="icon, mnist, hanzi,VisA, BTech, MVTEC, ELPV, GOODADS, RAD, MPDD, MVTEC_loco"
     )
 
+    parser.add_argument("--batch_size", type=int, default=batch_size, help="每次 llm.chat 的最大样本数")
+    parser.add_argument("--max_batch_images", type=int, default=max_batch_images, help="每个 batch 的图片数上限")
+    parser.add_argument("--max_batch_prompt_chars", type=int, default=max_batch_prompt_chars, help="每个 batch 的 prompt 字符数上限")
+    parser.add_argument("--no_cache", action="store_true", help="不读写推理结果缓存")
+    parser.add_argument("--cache_ttl", type=float, default=None, help="缓存有效期（秒），默认不过期")
+    parser.add_argument("--token_budget", type=int, default=None, help="每条请求的视觉 token 上限，超出时按比例预缩放图片")
+    parser.add_argument("--early_stop", action="store_true", help="答案 \\boxed{} 闭合后提前结束生成")
+    parser.add_argument("--early_stop_grace", type=int, default=early_stop_grace,
+                        help="boxed 闭合后再生成多少个 token 没有新 boxed 就停")
+    parser.add_argument("--target_precision", type=float, default=None,
+                        help="序贯评测：置信区间半宽（百分点）达到后停止，例如 1.5")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--sequential_metric", choices=["EM", "F1", "both"], default="EM")
+    parser.add_argument("--seed", type=int, default=0, help="分层随机顺序的种子")
+    parser.add_argument("--dry_run", "--dry-run", action="store_true",
+                        help="只解析配置、按续跑索引统计待跑样本数，不加载 vLLM")
+    parser.add_argument("--trace_record", type=str, default=None, help="把每条请求的回答与耗时追加进这个 trace 文件")
+    parser.add_argument("--trace_replay", type=str, default=None, help="从 trace 回放回答，不加载模型")
+    parser.add_argument("--latency_scale", type=float, default=1.0, help="回放时延倍数，0 表示不等待")
+    parser.add_argument("--selftest", action="store_true", help="用假 LLM 在 CPU 上检查分组 / 回填 / 重试 / 续跑")
+    parser.add_argument("--selftest_n", type=int, default=40)
+
     args = parser.parse_args()
+    if args.selftest:
+        selftest(args)
+        return
     run_vllm_http(args)
 
 
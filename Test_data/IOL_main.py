@@ -7,6 +7,7 @@ import numpy as np
 import shutil
 import argparse
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from glyph_pool import load_array_pool, load_mnist_idx_pool, render_cells
 # ======================
 # 参数范围
 # ======================
@@ -43,22 +44,15 @@ def add_gaussian_noise_pil(pil_img, sigma=0.02):
     return Image.fromarray((out * 255.0).astype(np.uint8))
 
 
-def load_digit_pool(png_root: Path):
-    pool = {}
-    for ddir in sorted(p for p in png_root.iterdir() if p.is_dir()):
-        imgs = sorted(ddir.glob("*.png"))
-        if not imgs:
-            raise RuntimeError(f"No png in {ddir}")
-        pool[ddir.name] = imgs
-    return pool
-
-
 # ======================
 # 单样本生成
 # ======================
 def generate_single_iol(digit_pool: dict):
+    """digit_pool: glyph_pool 格式 {class: {"arr", "names"}}"""
     digit = random.choice(list(digit_pool.keys()))
-    paths = digit_pool[digit]
+    class_pool = digit_pool[digit]
+    names = class_pool["names"]
+    indices = list(range(len(names)))
 
     noise_sigma = random.uniform(0.03, 0.05)
 
@@ -67,13 +61,13 @@ def generate_single_iol(digit_pool: dict):
     num_cells = rows * cols
     odd_k = random.choices(odd_nums, weights=odd_pro)[0]
 
-    base_path = random.choice(paths)
+    base_idx = random.choice(indices)
 
     all_indices = list(range(num_cells))
     odd_indices = set(random.sample(all_indices, odd_k))
 
-    candidates = [p for p in paths if p != base_path]
-    odd_paths = (
+    candidates = [i for i in indices if i != base_idx]
+    odd_src = (
         random.sample(candidates, odd_k)
         if len(candidates) >= odd_k
         else [random.choice(candidates) for _ in range(odd_k)]
@@ -88,29 +82,28 @@ def generate_single_iol(digit_pool: dict):
     W = grid_w + 2 * margin
     H = grid_h + 2 * margin
 
-    canvas = Image.new("RGB", (W, H), BG_COLOR)
-    draw = ImageDraw.Draw(canvas)
-
-    odd_ptr = 0
+    # 每个 cell 的源图下标，一次性 resize + 加噪
+    odd_iter = iter(odd_src)
+    cell_src = [next(odd_iter) if idx in odd_indices else base_idx for idx in range(num_cells)]
+    cells = render_cells(class_pool, cell_src, cell_size, noise_sigma)
 
+    canvas_arr = np.empty((H, W, 3), dtype=np.uint8)
+    canvas_arr[:] = BG_COLOR
     for idx in range(num_cells):
         r = idx // cols
         c = idx % cols
         x = margin + c * (cell_size + gap)
         y = margin + r * (cell_size + gap)
+        canvas_arr[y:y + cell_size, x:x + cell_size] = cells[idx]
 
-        if idx in odd_indices:
-            img_path = odd_paths[odd_ptr]
-            odd_ptr += 1
-        else:
-            img_path = base_path
-
-        img = Image.open(img_path).convert("RGB").resize(
-            (cell_size, cell_size), Image.BILINEAR
-        )
-        img = add_gaussian_noise_pil(img, sigma=noise_sigma)
-        canvas.paste(img, (x, y))
+    canvas = Image.fromarray(canvas_arr)
+    draw = ImageDraw.Draw(canvas)
 
+    for idx in range(num_cells):
+        r = idx // cols
+        c = idx % cols
+        x = margin + c * (cell_size + gap)
+        y = margin + r * (cell_size + gap)
         draw.rectangle(
             [x, y, x + cell_size - 1, y + cell_size - 1],
             outline=(0, 0, 0),
@@ -127,8 +120,8 @@ def generate_single_iol(digit_pool: dict):
         "grid_size": [rows, cols],
         "gap": gap,
         "margin": margin,
-        "base_image": base_path.name,
-        "odd_images": [p.name for p in odd_paths]
+        "base_image": names[base_idx],
+        "odd_images": [names[i] for i in odd_src]
     }
     # print(digit)
 
@@ -144,6 +137,9 @@ def generate_dataset(
     samples: int,
     seed: int,
     num_threads: int,
+    pool_cache: str = None,
+    mnist_images: str = None,
+    mnist_labels: str = None,
 ):
     random.seed(seed)
 
@@ -156,7 +152,10 @@ def generate_dataset(
     img_dir = out_dir / "images"
     img_dir.mkdir(parents=True, exist_ok=True)
 
-    digit_pool = load_digit_pool(png_root)
+    if mnist_images and mnist_labels:
+        digit_pool = load_mnist_idx_pool(mnist_images, mnist_labels)
+    else:
+        digit_pool = load_array_pool(png_root, cache_dir=pool_cache)
     annotations = []
 
     def worker(idx):
@@ -195,6 +194,9 @@ if __name__ == "__main__":
     parser.add_argument("--samples", type=int, default=100)
     parser.add_argument("--seed", type=int, default=None)
     parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--pool_cache", type=str, default=None, help="每类 .npy 缓存目录（memmap 读取）")
+    parser.add_argument("--mnist_images", type=str, default=None, help="MNIST idx 图像文件，替代 png_root")
+    parser.add_argument("--mnist_labels", type=str, default=None, help="MNIST idx 标签文件")
 
     args = parser.parse_args()
 
@@ -207,4 +209,7 @@ if __name__ == "__main__":
         samples=args.samples,
         seed=seed,
         num_threads=args.threads,
+        pool_cache=args.pool_cache,
+        mnist_images=args.mnist_images,
+        mnist_labels=args.mnist_labels,
     )
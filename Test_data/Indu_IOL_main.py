@@ -6,8 +6,11 @@ import uuid
 import shutil
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
+import sys
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from merge_all_data import merge_iol_datasets
+from oddgrid_common.stream_merge import merge_details_streaming
 
 from configs import (
     MIN_GRID, MAX_GRID,
@@ -269,32 +272,8 @@ def generate_dataset(data_root, out_dir, samples, seed, num_threads):
 # ======================
 
 def merge_all_details(src_root, image_dir):
-    src_root = Path(src_root)
-    combined_data = []
-
-    json_files = list(src_root.glob("*/iol_test_data.json"))
-    print(f"[INFO] Merging {len(json_files)} metadata files...")
-
-    for json_file in json_files:
-        with json_file.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-
-            category = json_file.parent.name.replace("iol_data_", "")
-
-            for entry in data:
-                entry["category"] = category
-                entry["dataset_name"] = str(src_root.parent)
-                entry["image_dir"] = image_dir
-
-            combined_data.extend(data)
-
-    save_path = src_root / "all_iol_combined_metadata.json"
-
-    with save_path.open("w", encoding="utf-8") as f:
-        json.dump(combined_data, f, ensure_ascii=False, indent=2)
-
-    print(f"[SUCCESS] Total merged entries: {len(combined_data)}")
-    print(f"[SUCCESS] Final metadata saved to: {save_path}")
+    # 流式合并：逐条写 all_iol_combined_metadata.jsonl + .idx，并同步写旧格式 .json
+    return merge_details_streaming(src_root, image_dir, "iol")
 
 
 # ======================
@@ -8,6 +8,7 @@ import numpy as np
 from PIL import Image
 import argparse
 from tqdm import tqdm  # 建议安装：pip install tqdm
+from glyph_pool import load_array_pool, load_mnist_idx_pool, render_cells
 
 # 尝试从 configs 导入，如果不存在则使用默认值
 try:
@@ -41,35 +42,18 @@ def add_gaussian_noise_pil(pil_img, sigma=0.02):
     out = (out * 255.0).astype(np.uint8)
     return Image.fromarray(out)
 
-# ======================
-# Load digit pool
-# ======================
-def load_digit_pool(png_root: Path):
-    pool = {}
-    if not png_root.exists():
-        raise RuntimeError(f"Path not found: {png_root}")
-        
-    subdirs = sorted(p for p in png_root.iterdir() if p.is_dir())
-    if not subdirs:
-        raise RuntimeError(f"No subdirectories (0-9) found in {png_root}")
-
-    for ddir in subdirs:
-        imgs = sorted(list(ddir.glob("*.png")))
-        if not imgs:
-            print(f"[Warning] No png files in {ddir}")
-            continue
-        pool[ddir.name] = imgs
-    return pool
-
 # ======================
 # Generate single SOI sample
 # ======================
 def generate_single_soi(digit_pool: dict):
+    """digit_pool: glyph_pool 格式 {class: {"arr", "names"}}"""
     # 随机选择一个数字类别
     digit = random.choice(list(digit_pool.keys()))
-    paths = digit_pool[digit]
+    class_pool = digit_pool[digit]
+    names = class_pool["names"]
+    indices = list(range(len(names)))
 
-    if len(paths) < 2:
+    if len(indices) < 2:
         raise RuntimeError(f"Digit {digit} must have >= 2 images for odd-one-out")
 
     num_images = random.randint(MIN_SET_SIZE, MAX_SET_SIZE)
@@ -77,16 +61,16 @@ def generate_single_soi(digit_pool: dict):
     odd_k = min(odd_k, num_images - 1) # 确保至少留一个 base
 
     # 选取基准图（Normal）
-    base_path = random.choice(paths)
+    base_idx = random.choice(indices)
 
     # 选取异类图（Anomaly）
-    candidates = [p for p in paths if p != base_path]
+    candidates = [i for i in indices if i != base_idx]
     if not candidates:
-        odd_paths = [base_path] * odd_k
+        odd_src = [base_idx] * odd_k
     elif len(candidates) >= odd_k:
-        odd_paths = random.sample(candidates, odd_k)
+        odd_src = random.sample(candidates, odd_k)
     else:
-        odd_paths = [random.choice(candidates) for _ in range(odd_k)]
+        odd_src = [random.choice(candidates) for _ in range(odd_k)]
 
     # 确定异类的位置 (1-based index)
     odd_indices_0 = set(random.sample(range(num_images), odd_k))
@@ -95,15 +79,11 @@ def generate_single_soi(digit_pool: dict):
     cell_size = random.randint(MIN_CELL_SIZE, MAX_CELL_SIZE)
     noise_sigma = random.uniform(0.03, 0.05)
 
-    images = []
-    odd_ptr = 0
-    for idx in range(num_images):
-        p = odd_paths[odd_ptr] if idx in odd_indices_0 else base_path
-        if idx in odd_indices_0: odd_ptr += 1
-
-        img = Image.open(p).convert("RGB").resize((cell_size, cell_size), Image.BILINEAR)
-        img = add_gaussian_noise_pil(img, sigma=noise_sigma)
-        images.append(img)
+    # 每张图的源下标，一次性 resize + 加噪
+    odd_iter = iter(odd_src)
+    cell_src = [next(odd_iter) if idx in odd_indices_0 else base_idx for idx in range(num_images)]
+    cells = render_cells(class_pool, cell_src, cell_size, noise_sigma)
+    images = [Image.fromarray(cell) for cell in cells]
 
     meta = {
         "id": str(uuid.uuid4()),
@@ -111,8 +91,8 @@ def generate_single_soi(digit_pool: dict):
         "total_icons": num_images,
         "num_odds": odd_k,
         "odd_indices": odd_indices,
-        "base_image": base_path.name,
-        "odd_images": [p.name for p in odd_paths],
+        "base_image": names[base_idx],
+        "odd_images": [names[i] for i in odd_src],
         "block_size": cell_size,
     }
     return images, meta
@@ -120,7 +100,15 @@ def generate_single_soi(digit_pool: dict):
 # ======================
 # Generate SOI dataset
 # ======================
-def generate_soi_dataset(png_root: str, out_dir: str, samples: int = 1000, seed: int = 0):
+def generate_soi_dataset(
+    png_root: str,
+    out_dir: str,
+    samples: int = 1000,
+    seed: int = 0,
+    pool_cache: str = None,
+    mnist_images: str = None,
+    mnist_labels: str = None,
+):
     random.seed(seed)
     np.random.seed(seed)
 
@@ -133,7 +121,10 @@ def generate_soi_dataset(png_root: str, out_dir: str, samples: int = 1000, seed:
     images_base_dir = out_dir / "images"
     images_base_dir.mkdir(parents=True, exist_ok=True)
 
-    digit_pool = load_digit_pool(png_root)
+    if mnist_images and mnist_labels:
+        digit_pool = load_mnist_idx_pool(mnist_images, mnist_labels)
+    else:
+        digit_pool = load_array_pool(png_root, cache_dir=pool_cache)
     all_annotations = []
 
     # 使用 tqdm 进度条，清晰看到运行状态
@@ -170,6 +161,9 @@ if __name__ == "__main__":
     parser.add_argument("--png_root", type=str, default="./mnist/mnist_png", help="MNIST 0-9 根目录")
     parser.add_argument("--samples", type=int, default=100, help="样本数量")
     parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    parser.add_argument("--pool_cache", type=str, default=None, help="每类 .npy 缓存目录（memmap 读取）")
+    parser.add_argument("--mnist_images", type=str, default=None, help="MNIST idx 图像文件，替代 png_root")
+    parser.add_argument("--mnist_labels", type=str, default=None, help="MNIST idx 标签文件")
 
     args = parser.parse_args()
 
@@ -185,4 +179,7 @@ if __name__ == "__main__":
         out_dir=str(out_dir),
         samples=args.samples,
         seed=seed,
+        pool_cache=args.pool_cache,
+        mnist_images=args.mnist_images,
+        mnist_labels=args.mnist_labels,
     )
\ No newline at end of file
@@ -0,0 +1,213 @@
+import json
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+
+# ======================
+# 内存图像池
+# ======================
+# 每个类别目录只解码一次，得到连续的 uint8 数组：
+#   pool[cls] = {"arr": (N, H, W, 3) uint8, "names": [N 个文件名]}
+# 生成样本时只做数组索引，不再逐 cell 打开 / resize PNG。
+# arr 也可以是 np.load(mmap_mode="r") 得到的只读 memmap。
+
+
+def _decode_class_dir(ddir: Path):
+    imgs = sorted(ddir.glob("*.png"))
+    if not imgs:
+        return None, []
+
+    first = Image.open(imgs[0]).convert("RGB")
+    W, H = first.size
+    arr = np.empty((len(imgs), H, W, 3), dtype=np.uint8)
+    arr[0] = np.asarray(first)
+
+    for i, p in enumerate(imgs[1:], start=1):
+        img = Image.open(p).convert("RGB")
+        # 同一类别里尺寸不一致时统一到第一张的尺寸
+        if img.size != (W, H):
+            img = img.resize((W, H), Image.BILINEAR)
+        arr[i] = np.asarray(img)
+
+    return arr, [p.name for p in imgs]
+
+
+def _source_key(ddir: Path):
+    """类别目录的 PNG 列表：[[文件名, 大小, mtime_ns], ...]（只 stat，不读图）"""
+    key = []
+    for p in sorted(ddir.glob("*.png")):
+        st = p.stat()
+        key.append([p.name, st.st_size, st.st_mtime_ns])
+    return key
+
+
+def _cache_matches(npy_path: Path, names_path: Path, src_path: Path, src):
+    if not (npy_path.exists() and names_path.exists() and src_path.exists()):
+        return False
+    try:
+        return json.loads(src_path.read_text(encoding="utf-8")) == src
+    except ValueError:
+        return False
+
+
+def load_array_pool(png_root: Path, cache_dir=None, min_images=1):
+    """
+    png_root/<class>/*.png -> {class: {"arr", "names"}}
+
+    cache_dir 不为空时，每个类别存成 <class>.npy + <class>.names.json，
+    之后直接 memmap 读取，不再解码 PNG。
+    缓存以 <class>.src.json（PNG 文件名 + 大小 + mtime 列表）为键：类别目录里增删 / 改动过图片就重新解码。
+    """
+    png_root = Path(png_root)
+    if not png_root.exists():
+        # 只有 npy 池（例如 hanzi/glyph_atlas.py 导出的）也可以直接使用
+        if cache_dir is not None and Path(cache_dir).exists():
+            return load_npy_pool(cache_dir, min_images=min_images)
+        raise RuntimeError(f"Path not found: {png_root}")
+
+    if cache_dir is not None:
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+    pool = {}
+    for ddir in sorted(p for p in png_root.iterdir() if p.is_dir()):
+        npy_path = cache_dir / f"{ddir.name}.npy" if cache_dir else None
+        names_path = cache_dir / f"{ddir.name}.names.json" if cache_dir else None
+        src_path = cache_dir / f"{ddir.name}.src.json" if cache_dir else None
+
+        src = _source_key(ddir) if cache_dir else None
+        if npy_path is not None and _cache_matches(npy_path, names_path, src_path, src):
+            arr = np.load(npy_path, mmap_mode="r")
+            names = json.loads(names_path.read_text(encoding="utf-8"))
+        else:
+            arr, names = _decode_class_dir(ddir)
+            if arr is None:
+                print(f"[Warning] No png files in {ddir}")
+                continue
+            if npy_path is not None:
+                if src_path.exists():
+                    print(f"[Info] {ddir} changed, rebuilding {npy_path}")
+                    src_path.unlink()
+                np.save(npy_path, arr)
+                names_path.write_text(json.dumps(names), encoding="utf-8")
+                # 最后写键：中途被打断时下次会重新解码
+                src_path.write_text(json.dumps(src), encoding="utf-8")
+                arr = np.load(npy_path, mmap_mode="r")
+
+        if len(names) < min_images:
+            raise RuntimeError(f"{ddir} must have >= {min_images} images")
+        pool[ddir.name] = {"arr": arr, "names": names}
+
+    if not pool:
+        raise RuntimeError(f"No class directories with png found in {png_root}")
+    return pool
+
+
+def load_npy_pool(cache_dir, min_images=1):
+    """读取 cache_dir 下所有 <class>.npy + <class>.names.json。"""
+    cache_dir = Path(cache_dir)
+    pool = {}
+    for npy_path in sorted(cache_dir.glob("*.npy")):
+        cls = npy_path.stem
+        names_path = cache_dir / f"{cls}.names.json"
+        if not names_path.exists():
+            continue
+        names = json.loads(names_path.read_text(encoding="utf-8"))
+        if len(names) < min_images:
+            raise RuntimeError(f"{npy_path} must have >= {min_images} images")
+        pool[cls] = {"arr": np.load(npy_path, mmap_mode="r"), "names": names}
+
+    if not pool:
+        raise RuntimeError(f"No .npy pool found in {cache_dir}")
+    return pool
+
+
+# ======================
+# MNIST idx 原始文件
+# ======================
+def read_idx(path):
+    """
+    通用 idx 解析（与 mnist/get_data.py 的格式一致，但从 header 读取维度，
+    不写死 offset）。
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    ndim = data[3]
+    dims = np.frombuffer(data, dtype=">u4", count=ndim, offset=4)
+    offset = 4 + 4 * ndim
+    return np.frombuffer(data, dtype=np.uint8, offset=offset).reshape(tuple(int(d) for d in dims))
+
+
+def load_mnist_idx_pool(images_path, labels_path):
+    """train-images-idx3-ubyte + train-labels-idx1-ubyte -> 与 load_array_pool 相同的格式。"""
+    images = read_idx(images_path)
+    labels = read_idx(labels_path)
+
+    pool = {}
+    for label in sorted(np.unique(labels).tolist()):
+        idx = np.nonzero(labels == label)[0]
+        gray = images[idx]
+        pool[str(label)] = {
+            # 灰度 -> RGB，与 PNG 池保持一致
+            "arr": np.ascontiguousarray(np.repeat(gray[..., None], 3, axis=-1)),
+            # 与 get_data.py 导出的 PNG 文件名一致
+            "names": [f"{i}.png" for i in idx.tolist()],
+        }
+    return pool
+
+
+# ======================
+# 向量化 resize / noise
+# ======================
+def resize_batch(arr, size):
+    """
+    (N, H, W, C) uint8 -> (N, size, size, C) uint8，双线性插值（像素中心对齐）。
+    缩小超过 2 倍时先做整数倍 box 平均，近似 PIL 的抗锯齿。
+    """
+    arr = np.asarray(arr)
+    N, H, W, C = arr.shape
+
+    fy, fx = H // size, W // size
+    if fy >= 2 or fx >= 2:
+        fy, fx = max(fy, 1), max(fx, 1)
+        H2, W2 = H // fy * fy, W // fx * fx
+        arr = arr[:, :H2, :W2].reshape(N, H2 // fy, fy, W2 // fx, fx, C).mean(axis=(2, 4))
+        N, H, W, C = arr.shape
+
+    src = arr.astype(np.float32)
+
+    ys = np.clip((np.arange(size, dtype=np.float32) + 0.5) * H / size - 0.5, 0, H - 1)
+    xs = np.clip((np.arange(size, dtype=np.float32) + 0.5) * W / size - 0.5, 0, W - 1)
+    y0 = np.floor(ys).astype(np.int64)
+    x0 = np.floor(xs).astype(np.int64)
+    y1 = np.minimum(y0 + 1, H - 1)
+    x1 = np.minimum(x0 + 1, W - 1)
+    wy = (ys - y0)[None, :, None, None]
+    wx = (xs - x0)[None, None, :, None]
+
+    r0, r1 = src[:, y0], src[:, y1]
+    top = r0[:, :, x0] * (1 - wx) + r0[:, :, x1] * wx
+    bot = r1[:, :, x0] * (1 - wx) + r1[:, :, x1] * wx
+    out = top * (1 - wy) + bot * wy
+    return np.clip(out + 0.5, 0, 255).astype(np.uint8)
+
+
+def add_gaussian_noise_batch(arr, sigma=0.02):
+    """与 add_gaussian_noise_pil 相同的噪声模型，一次处理整批 cell。"""
+    img = arr.astype(np.float32) / 255.0
+    noise = np.random.normal(0, sigma, img.shape).astype(np.float32)
+    out = np.clip(img + noise, 0.0, 1.0)
+    return (out * 255.0).astype(np.uint8)
+
+
+def render_cells(class_pool, src_indices, cell_size, noise_sigma):
+    """
+    src_indices: 每个 cell 对应的池内下标（长度 = cell 数）。
+    相同的源图只 resize 一次，再按下标展开并整体加噪。
+    """
+    uniq, inverse = np.unique(np.asarray(src_indices), return_inverse=True)
+    resized = resize_batch(class_pool["arr"][uniq], cell_size)
+    return add_gaussian_noise_batch(resized[inverse], sigma=noise_sigma)
+
@@ -1,13 +1,21 @@
 import json
+import os
 import shutil
+import sys
 from pathlib import Path
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from oddgrid_common.blob_store import materialize_file, materialize_tree
+from oddgrid_common.stream_merge import JsonlIndexWriter, iter_json_records
+
 
 def merge_iol_datasets(
     src_root: Path,
     dst_root: Path,
     images_subdir: str = "images",
     json_name: str = "iol_test_data.json",
+    link_mode: str = "auto",
+    store=None,
 ):
     """
     Merge multiple iol_data_xxx datasets into one directory.
@@ -24,6 +32,8 @@ def merge_iol_datasets(
         dst_root (Path): output merged directory
         images_subdir (str): images directory name (default: images)
         json_name (str): json filename in each sub-dataset
+        link_mode (str): auto (reflink, else copy) / reflink / copy / hardlink (opt-in, shares the source inode)
+        store: optional oddgrid_common.blob_store.BlobStore for dedup
     """
     data_name_str = str(src_root.parent)
     dst_images = dst_root / images_subdir
@@ -36,7 +46,8 @@ def merge_iol_datasets(
         shutil.rmtree(dst_root)
     dst_images.mkdir(parents=True, exist_ok=True)
 
-    merged_records = []
+    # 逐条写 iol_test_data.jsonl + .idx，同步写旧格式 iol_test_data.json
+    writer = JsonlIndexWriter(dst_json.with_suffix(".jsonl"), legacy_json_path=dst_json)
 
     # =========================
     # 遍历所有子数据集
@@ -57,32 +68,28 @@ def merge_iol_datasets(
             print(f"[WARN] Skip {subdir}, missing images or json")
             continue
 
-        # ---------- 1. 读取 json ----------
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        if isinstance(data, dict):
-            records = list(data.values())
-        elif isinstance(data, list):
-            records = data
-        else:
-            raise TypeError(f"Unsupported json format in {json_path}")
-
-        # ---------- 2. 拷贝图片 & 修改 image 路径 ----------
-        for item in records:
+        # ---------- 1. 流式读取 json（list 或 dict） ----------
+        # ---------- 2. 链接图片 & 修改 image 路径 ----------
+        for item in iter_json_records(json_path):
             img_rel = item.get("image")
             if img_rel is None:
+                # 与原来一致：跳过的记录原样保留在合并结果中
+                writer.write(item)
                 continue
 
             src_img = images_dir / img_rel
             if not src_img.exists():
                 print(f"[WARN] Missing image: {src_img}")
+                writer.write(item)
                 continue
 
             new_img_name = f"{src_img.name}"
             dst_img = dst_images / new_img_name
 
-            shutil.copy2(src_img, dst_img)
+            # 同名图片保持原来 copy2 的覆盖语义
+            if dst_img.exists():
+                dst_img.unlink()
+            materialize_file(src_img, dst_img, store=store, mode=link_mode)
 
             # 更新 json 中的 image 字段（保持你现在的行为）
             item["image"] = new_img_name
@@ -91,17 +98,13 @@ def merge_iol_datasets(
             item["source_dataset"] = f"{data_name_str}_{dataset_name}"
             item["source"] = f"{data_name_str}"
             item["dataset_name"] = f"{dataset_name}"   
-               
-        merged_records.extend(records)
 
-    # =========================
-    # 保存合并后的 json
-    # =========================
-    with open(dst_json, "w", encoding="utf-8") as f:
-        json.dump(merged_records, f, ensure_ascii=False, indent=2)
+            writer.write(item)
+
+    writer.close()
 
     print(f"\n[OK] Merge finished")
-    print(f"     Total samples : {len(merged_records)}")
+    print(f"     Total samples : {writer.count}")
     print(f"     Images dir    : {dst_images}")
     print(f"     Json file     : {dst_json}")
     
@@ -112,6 +115,8 @@ def merge_soi_datasets(
     dst_root: Path,
     images_dir_name: str = "images",
     json_name: str = "soi_test_data.json",
+    link_mode: str = "auto",
+    store=None,
 ):
     """
     Merge SOI datasets while KEEPING image directory structure.
@@ -140,7 +145,8 @@ def merge_soi_datasets(
         shutil.rmtree(dst_root)
     dst_images_root.mkdir(parents=True, exist_ok=True)
 
-    merged_records = []
+    # 逐条写 soi_test_data.jsonl + .idx，同步写旧格式 soi_test_data.json
+    writer = JsonlIndexWriter(dst_json.with_suffix(".jsonl"), legacy_json_path=dst_json)
 
     # ===== iterate all soi_data_xxx =====
     for dataset_dir in sorted(src_root.iterdir()):
@@ -170,28 +176,20 @@ def merge_soi_datasets(
                     f"Duplicate sample directory name detected: {sample_dir.name}"
                 )
 
-            shutil.copytree(sample_dir, dst_sample_dir)
-
-        # ---- load & merge json ----
-        with open(src_json, "r", encoding="utf-8") as f:
-            records = json.load(f)
-
-        if not isinstance(records, list):
-            raise TypeError(f"{src_json} must be a list")
+            materialize_tree(sample_dir, dst_sample_dir, store=store, mode=link_mode)
 
-        for item in records:
+        # ---- stream & merge json ----
+        for item in iter_json_records(src_json):
             # image 字段保持不变（仍然是 images_xxx_k）
             item["source_dataset"] = f"{data_name_str}_{dataset_name}"
             item["source"] = f"{data_name_str}"
             item["dataset_name"] = f"{dataset_name}" 
-            merged_records.append(item)
+            writer.write(item)
 
-    # ===== save merged json =====
-    with open(dst_json, "w", encoding="utf-8") as f:
-        json.dump(merged_records, f, ensure_ascii=False, indent=2)
+    writer.close()
 
     print("\n[OK] SOI merge finished")
-    print(f"     Total samples : {len(merged_records)}")
+    print(f"     Total samples : {writer.count}")
     print(f"     Images dir    : {dst_images_root}")
     print(f"     Json file     : {dst_json}")
 
@@ -4,11 +4,14 @@ import shutil
 import uuid
 from pathlib import Path
 import os
+import sys
 
 from PIL import Image
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from merge_all_data import merge_soi_datasets
+from oddgrid_common.stream_merge import merge_details_streaming
 from configs import (
     MIN_SET_SIZE, MAX_SET_SIZE,
     odd_nums, odd_pro,
@@ -195,31 +198,8 @@ def generate_soi_dataset(data_root, out_dir, samples=1000, seed=0, num_threads=8
 # Merge metadata
 # ======================
 def merge_all_soi_details(src_root, image_dir):
-    src_root = Path(src_root)
-    combined_data = []
-
-    json_files = list(src_root.glob("*/soi_test_data.json"))
-    print(f"[INFO] Merging {len(json_files)} SOI metadata files...")
-
-    for json_file in json_files:
-        with json_file.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-
-            category = json_file.parent.name.replace("soi_data_", "")
-
-            for entry in data:
-                entry["category"] = category
-                entry["dataset_name"] = str(src_root.parent)
-                entry["image_dir"] = image_dir
-
-            combined_data.extend(data)
-
-    save_path = src_root / "all_soi_combined_metadata.json"
-
-    with save_path.open("w", encoding="utf-8") as f:
-        json.dump(combined_data, f, ensure_ascii=False, indent=2)
-
-    print(f"[SUCCESS] Merged {len(combined_data)} entries into {save_path}")
+    # 流式合并：逐条写 all_soi_combined_metadata.jsonl + .idx，并同步写旧格式 .json
+    return merge_details_streaming(src_root, image_dir, "soi")
 
 
 # ======================
@@ -1,8 +1,8 @@
 import os
 import argparse
+import asyncio
 import json
 import base64
-import requests
 from tqdm import tqdm
 
 # =========================
@@ -14,48 +14,6 @@ MAX_NEW_TOKENS = 2048
 IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".JPG"}
 
 
-# =========================
-# vLLM 调用（保持不变）
-# =========================
-def call_vllm_server(prompt, image_paths, model_path):
-    messages = [{"role": "user", "content": []}]
-
-    # image -> base64
-    for img_path in image_paths:
-        with open(img_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode("utf-8")
-        messages[0]["content"].append({
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:image/png;base64,{b64}"
-            }
-        })
-
-    # text
-    messages[0]["content"].append({
-        "type": "input_text",
-        "text": prompt.strip()
-    })
-
-    payload = {
-        "model": model_path,
-        "messages": messages,
-        "max_tokens": MAX_NEW_TOKENS,
-        "temperature": 0.0,
-    }
-
-    resp = None
-    try:
-        resp = requests.post(API_URL, json=payload, timeout=600)
-        resp.raise_for_status()
-        data = resp.json()
-        return data["choices"][0]["message"]["content"]
-    except Exception as e:
-        msg = resp.text[:300] if resp is not None else str(e)
-        print(f"[ERROR] vLLM request failed: {msg}")
-        return None
-
-
 # =========================
 # 递归扫描图片
 # =========================
@@ -112,13 +70,115 @@ def parse_boxes(response):
             return []
 
 
+# =========================
+# 异步并发调用（连接池 + 重试退避）
+# =========================
+def build_payload(prompt, image_paths, model_path):
+    content = []
+    for img_path in image_paths:
+        with open(img_path, "rb") as f:
+            b64 = base64.b64encode(f.read()).decode("utf-8")
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/png;base64,{b64}"
+            }
+        })
+
+    content.append({
+        "type": "input_text",
+        "text": prompt.strip()
+    })
+
+    return {
+        "model": model_path,
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": MAX_NEW_TOKENS,
+        "temperature": 0.0,
+    }
+
+
+async def call_vllm_server_async(session, payload, max_retries=3, backoff=1.0):
+    """
+    成功返回文本，失败返回 None（不向外抛，单张图失败不影响整个目录）。
+    429 / 5xx / 网络异常按指数退避重试，其余 4xx 与 200 但响应体不对（非 JSON、没有 choices）直接放弃。
+    """
+    import aiohttp
+
+    last_msg = ""
+    for attempt in range(max_retries + 1):
+        try:
+            async with session.post(API_URL, json=payload) as resp:
+                if resp.status == 200:
+                    try:
+                        data = await resp.json(content_type=None)
+                        return data["choices"][0]["message"]["content"]
+                    except (ValueError, KeyError, IndexError, TypeError) as e:
+                        last_msg = f"malformed response ({type(e).__name__}: {e}): {(await resp.text())[:300]}"
+                        break
+                last_msg = (await resp.text())[:300]
+                if resp.status != 429 and resp.status < 500:
+                    break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            last_msg = str(e)
+
+        if attempt < max_retries:
+            await asyncio.sleep(backoff * (2 ** attempt))
+
+    print(f"[ERROR] vLLM request failed: {last_msg}")
+    return None
+
+
+# =========================
+# JSONL 结果文件（追加写 + 流式断点续跑）
+# =========================
+def load_processed_from_jsonl(jsonl_path):
+    """逐行读取，只保留 image 字段；最后一行写坏（中断）时直接跳过。"""
+    processed = set()
+    if not os.path.exists(jsonl_path):
+        return processed
+
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                processed.add(json.loads(line)["image"])
+            except (ValueError, KeyError):
+                continue
+    return processed
+
+
+def export_jsonl_to_json(jsonl_path, save_json_path):
+    """导出为 crop_images_from_boxes.py 读取的 list-JSON，整个流程只写一次。"""
+    results = []
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                continue
+
+    results.sort(key=lambda item: item["image"])
+    with open(save_json_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    return len(results)
+
+
 # =========================
 # 主流程
 # =========================
-def run(args):
+async def run_async(args):
+    import aiohttp
+
     image_root = args.image_dir
     model_path = args.model_path
     save_json_path = args.save_json
+    save_jsonl_path = os.path.splitext(save_json_path)[0] + ".jsonl"
     name = save_json_path.split("/")[-1][:-5]
 
     os.makedirs(os.path.dirname(save_json_path), exist_ok=True)
@@ -126,43 +186,58 @@ def run(args):
     image_paths = collect_images(image_root)
     print(f"[INFO] Found {len(image_paths)} images under {image_root}")
 
-    # 支持断点续跑
-    results = []
-    processed = set()
-
-    if os.path.exists(save_json_path):
-        with open(save_json_path, "r", encoding="utf-8") as f:
-            results = json.load(f)
-        for item in results:
-            processed.add(item["image"])
+    # 支持断点续跑：只流式扫描 JSONL
+    processed = load_processed_from_jsonl(save_jsonl_path)
+    pending = [
+        p for p in image_paths
+        if os.path.relpath(p, image_root) not in processed
+    ]
+    print(f"[INFO] processed: {len(processed)}; pending: {len(pending)}")
 
     prompt = build_detection_prompt(name)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=600)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+
+    async def worker(session, img_path):
+        async with semaphore:
+            try:
+                payload = await asyncio.to_thread(
+                    build_payload, prompt, [img_path], model_path
+                )
+            except OSError as e:
+                print(f"[ERROR] cannot read {img_path}: {e}")
+                return img_path, None
+            predict = await call_vllm_server_async(
+                session,
+                payload,
+                max_retries=args.max_retries,
+                backoff=args.retry_backoff,
+            )
+        return img_path, predict
+
+    with open(save_jsonl_path, "a", encoding="utf-8") as out_f:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = [asyncio.create_task(worker(session, p)) for p in pending]
+
+            for fut in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+                img_path, predict = await fut
+                item = {
+                    "image": os.path.relpath(img_path, image_root),
+                    "abs_path": img_path,
+                    "predict_raw": predict,
+                    "boxes": parse_boxes(predict),
+                }
+                # 实时写盘：每张图只追加一行
+                out_f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                out_f.flush()
+
+    num = export_jsonl_to_json(save_jsonl_path, save_json_path)
+    print(f"[INFO] ✅ Done! {num} results saved to {save_json_path}")
 
-    for img_path in tqdm(image_paths):
-        rel_path = os.path.relpath(img_path, image_root)
-        if rel_path in processed:
-            continue
-
-        predict = call_vllm_server(
-            prompt=prompt,
-            image_paths=[img_path],
-            model_path=model_path
-        )
-
-        boxes = parse_boxes(predict)
 
-        results.append({
-            "image": rel_path,
-            "abs_path": img_path,
-            "predict_raw": predict,
-            "boxes": boxes
-        })
-
-        # 实时写盘
-        with open(save_json_path, "w", encoding="utf-8") as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
-
-    print(f"[INFO] ✅ Done! Results saved to {save_json_path}")
+def run(args):
+    asyncio.run(run_async(args))
 
 from pathlib import Path
 
@@ -179,9 +254,32 @@ def main():
         default="/nfsdata4/wengtengjin/oddgrid_task/models/Qwen3-VL-32B-Instruct",
         help="Model name/path used when starting vLLM serve"
     )
-    
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="Max in-flight requests to the vLLM server"
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=3,
+        help="Retries for 429/5xx/network errors"
+    )
+    parser.add_argument(
+        "--retry_backoff",
+        type=float,
+        default=1.0,
+        help="Base seconds for exponential backoff"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Keep existing JSONL results and only run pending images"
+    )
+
     args = parser.parse_args()
-    
+
 
     image_roots = [
         Path("RAD/manual_images"),
@@ -198,11 +296,14 @@ def main():
                 continue
 
             save_json = sub_dir / f"{sub_dir.name}.json"
-
-            # 如果已有结果，先删除，再重新跑
-            if save_json.exists():
-                print(f"[DELETE] Existing JSON removed: {save_json}")
-                save_json.unlink()
+            save_jsonl = sub_dir / f"{sub_dir.name}.jsonl"
+
+            # 如果已有结果，先删除，再重新跑（--resume 时保留 JSONL 续跑）
+            if not args.resume:
+                for old in (save_json, save_jsonl):
+                    if old.exists():
+                        print(f"[DELETE] Existing results removed: {old}")
+                        old.unlink()
 
             args.image_dir = str(sub_dir)
             args.save_json = str(save_json)
@@ -0,0 +1,234 @@
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+from oddgrid_common.early_stop import BoxedStopScanner
+from oddgrid_common.response_cache import payload_key
+
+# ======================
+# 并发 OpenAI-compatible chat 客户端
+# ======================
+# 一个 httpx.AsyncClient（连接池复用）+ 并发上限 + 单请求超时 / 重试，
+# 结果按输入顺序回调（on_result 里可以直接顺序写盘）。
+# 每条结果都带 latency（成功那次请求的耗时）与 usage，供效率统计使用。
+#
+# stream=True 时走 SSE 流式接口，额外记录：
+#   ttft        请求发出 -> 第一个内容 token（包含服务端排队 + prefill）
+#   itl         相邻内容 chunk 的平均间隔（inter-token latency）
+#   decode_tps  completion_tokens / (最后一个 token - 第一个 token)
+# run_ordered 还会补上客户端侧的：
+#   encode_time 构建 payload（读图 + base64）耗时
+# （没有客户端排队时间：job 只在有空位时才拉取，请求构建完立刻发出，排队都在服务端，算在 ttft 里）
+#
+# cache（ResponseCache）不为空时先按 payload 内容查缓存，命中则不发请求，
+# 结果沿用缓存里的 text / usage / 时延字段，并带 cache_hit=True。
+#
+# early_stop=N（只在 stream=True 时生效）：第一个 boxed{...} 闭合后再收 N 个 chunk 没有新 boxed 就断开，
+# 结果带 early_stopped=True；此时拿不到服务端 usage，completion_tokens 用收到的 chunk 数代替。
+
+# 写入缓存的字段
+CACHED_FIELDS = ("text", "usage", "latency", "ttft", "itl", "decode_tps")
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class AsyncChatClient:
+    def __init__(self, api_url, concurrency=8, timeout=600, max_retries=3, backoff=1.0):
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._client = None
+
+    async def __aenter__(self):
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout),
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+            ),
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._client.aclose()
+
+    async def _chat_stream(self, payload, start, early_stop=None):
+        payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+        parts, gaps = [], []
+        usage = {}
+        first = last = None
+        scanner = BoxedStopScanner(early_stop) if early_stop is not None else None
+        stopped = False
+
+        async with self._client.stream("POST", self.api_url, json=payload) as resp:
+            if resp.status_code >= 400:
+                await resp.aread()
+                return resp, None
+
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                for choice in chunk.get("choices") or []:
+                    delta = (choice.get("delta") or {}).get("content")
+                    if not delta:
+                        continue
+                    now = time.perf_counter()
+                    if first is None:
+                        first = now
+                    else:
+                        gaps.append(now - last)
+                    last = now
+                    parts.append(delta)
+                    if scanner is not None and scanner.feed(delta):
+                        stopped = True
+                        break
+                if stopped:
+                    # 退出 async with 时关闭连接，服务端随之 abort
+                    break
+
+        end = time.perf_counter()
+        if stopped:
+            usage = {"completion_tokens": len(parts)}
+        n_tokens = usage.get("completion_tokens") or len(parts)
+        decode_time = (last - first) if first is not None else 0.0
+        return resp, {
+            "text": "".join(parts),
+            "usage": usage,
+            "latency": end - start,
+            "ttft": (first - start) if first is not None else None,
+            "itl": sum(gaps) / len(gaps) if gaps else None,
+            "decode_tps": (n_tokens - 1) / decode_time if decode_time > 0 and n_tokens > 1 else None,
+            "early_stopped": stopped,
+        }
+
+    async def chat(self, payload, stream=False, early_stop=None):
+        """
+        返回 dict:
+            text / usage / latency / attempts / error（stream=True 时另有 ttft / itl / decode_tps / early_stopped）
+        失败（重试耗尽或不可重试的 4xx）时 text 为 None，error 为错误信息。
+        """
+        error = None
+        for attempt in range(1, self.max_retries + 2):
+            start = time.perf_counter()
+            try:
+                if stream:
+                    resp, result = await self._chat_stream(payload, start, early_stop)
+                    if result is not None:
+                        return {**result, "attempts": attempt, "error": None}
+                else:
+                    resp = await self._client.post(self.api_url, json=payload)
+                latency = time.perf_counter() - start
+                if resp.status_code in RETRY_STATUS:
+                    error = f"HTTP {resp.status_code}: {resp.text[:300]}"
+                elif resp.status_code >= 400:
+                    return {"text": None, "usage": {}, "latency": latency, "attempts": attempt,
+                            "error": f"HTTP {resp.status_code}: {resp.text[:300]}"}
+                else:
+                    data = resp.json()
+                    return {
+                        "text": data["choices"][0]["message"]["content"],
+                        "usage": data.get("usage") or {},
+                        "latency": latency,
+                        "attempts": attempt,
+                        "error": None,
+                    }
+            except (httpx.TransportError, ValueError, KeyError, IndexError, TypeError) as e:
+                error = f"{type(e).__name__}: {e}"
+
+            if attempt <= self.max_retries:
+                await asyncio.sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random.random() * 0.1))
+
+        return {"text": None, "usage": {}, "latency": None, "attempts": self.max_retries + 1, "error": error}
+
+
+def _timed_build(build_payload, job, with_key):
+    start = time.perf_counter()
+    payload = build_payload(job)
+    encode_time = time.perf_counter() - start
+    key = payload_key(payload) if with_key and payload is not None else None
+    return payload, encode_time, key
+
+
+async def run_ordered_async(jobs, build_payload, on_result, api_url, concurrency=8, stream=False,
+                            cache=None, early_stop=None, **client_kwargs):
+    """
+    jobs: 可迭代对象，按需拉取（最多 concurrency 条在飞），
+          所以传入 iter_with_prefetch(...) 时预取节奏与请求节奏一致。
+    build_payload: job -> payload dict（None 表示跳过），在线程里执行（图片编码不阻塞事件循环）
+    on_result: (job, result) -> None，严格按 jobs 的顺序调用
+    """
+    jobs = iter(jobs)
+    in_flight = {}
+    done = {}
+    next_emit = 0
+    next_idx = 0
+
+    async with AsyncChatClient(api_url, concurrency=concurrency, **client_kwargs) as client:
+
+        async def one(job):
+            payload, encode_time, key = await asyncio.to_thread(
+                _timed_build, build_payload, job, cache is not None)
+            if payload is None:
+                # 例如图片读不到：不发请求，按失败回调
+                return {"text": None, "usage": {}, "latency": None, "attempts": 0, "error": "no payload"}
+
+            if key is not None:
+                cached = cache.get(key)
+                if cached is not None:
+                    return {**cached, "attempts": 0, "error": None, "cache_hit": True,
+                            "encode_time": encode_time}
+
+            result = await client.chat(payload, stream=stream, early_stop=early_stop)
+            result["encode_time"] = encode_time
+            result["cache_hit"] = False
+            # 截断的回答不入缓存（key 与完整生成相同）
+            if key is not None and result["text"] is not None and not result.get("early_stopped"):
+                cache.put(key, {k: result.get(k) for k in CACHED_FIELDS})
+            return result
+
+        def launch():
+            nonlocal next_idx
+            # 乱序缓冲也有上限：前面有一条慢请求时不会无限拉取后面的 job
+            while len(in_flight) < concurrency and next_idx - next_emit < concurrency * 4:
+                try:
+                    job = next(jobs)
+                except StopIteration:
+                    return
+                task = asyncio.create_task(one(job))
+                in_flight[task] = (next_idx, job)
+                next_idx += 1
+
+        launch()
+        while in_flight:
+            finished, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                idx, job = in_flight.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    result = {"text": None, "usage": {}, "latency": None, "attempts": 0,
+                              "error": f"{type(e).__name__}: {e}"}
+                done[idx] = (job, result)
+
+            while next_emit in done:
+                on_result(*done.pop(next_emit))
+                next_emit += 1
+
+            launch()
+
+
+def run_ordered(jobs, build_payload, on_result, api_url, concurrency=8, stream=False, cache=None, early_stop=None,
+                **client_kwargs):
+    asyncio.run(run_ordered_async(jobs, build_payload, on_result, api_url, concurrency, stream, cache, early_stop,
+                                  **client_kwargs))
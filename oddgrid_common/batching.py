@@ -0,0 +1,116 @@
+import time
+
+# ======================
+# 离线批量推理：分组 + 结果回填 + 吞吐统计
+# ======================
+# 与后端无关：submit_batch(list_of_items) -> list_of_texts，
+# 真实运行时是 vLLM 的 llm.chat，CPU 上可以换成任意假的 LLM 对象。
+
+
+def plan_batches(items, max_batch_size=16, max_images=64, max_prompt_chars=64000):
+    """
+    按顺序贪心分组。items 需要有 "num_images" 与 "prompt_chars"。
+    任一预算（样本数 / 图片数 / prompt 字符数）将被超出时切一个新 batch；
+    单条本身超预算时独占一个 batch。
+    """
+    batch = []
+    n_images = 0
+    n_chars = 0
+
+    for item in items:
+        img = item.get("num_images", 1)
+        chars = item.get("prompt_chars", 0)
+
+        if batch and (
+            len(batch) >= max_batch_size
+            or n_images + img > max_images
+            or n_chars + chars > max_prompt_chars
+        ):
+            yield batch
+            batch, n_images, n_chars = [], 0, 0
+
+        batch.append(item)
+        n_images += img
+        n_chars += chars
+
+    if batch:
+        yield batch
+
+
+def group_by_prefix(items, key_fn):
+    """
+    稳定分组：相同前缀（key_fn(item)）的请求排在一起，组按首次出现的顺序排列，组内保持原顺序。
+    让 vLLM 自动前缀缓存（APC）连续命中。返回 (重排后的列表, {key: 条数})。
+    """
+    groups = {}
+    for item in items:
+        groups.setdefault(key_fn(item), []).append(item)
+    ordered = [item for group in groups.values() for item in group]
+    return ordered, {key: len(group) for key, group in groups.items()}
+
+
+class ThroughputMeter:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.samples = 0
+        self.images = 0
+        self.batches = 0
+
+    def update(self, batch):
+        self.batches += 1
+        self.samples += len(batch)
+        self.images += sum(item.get("num_images", 1) for item in batch)
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return {
+            "samples": self.samples,
+            "images": self.images,
+            "batches": self.batches,
+            "elapsed": elapsed,
+            "samples_per_s": self.samples / elapsed,
+            "images_per_s": self.images / elapsed,
+        }
+
+    def report(self, prefix="[THROUGHPUT]"):
+        s = self.summary()
+        print(
+            f"{prefix} samples={s['samples']} images={s['images']} batches={s['batches']} "
+            f"time={s['elapsed']:.2f}s | {s['samples_per_s']:.3f} samples/s | "
+            f"{s['images_per_s']:.3f} images/s"
+        )
+        return s
+
+
+def run_batched(items, submit_batch, on_result, batch_kwargs=None, meter=None):
+    """
+    items: dict 列表，至少包含唯一的 "key"（以及 plan_batches 用到的字段）
+    submit_batch: list[item] -> list[text | None]，顺序与输入一致；
+                  消息体在这里按 batch 构建，避免一次性把所有图片编码进内存
+    on_result: (item, text) -> None，每条结果回调一次（用于写盘）
+
+    整个 batch 失败时逐条重试，避免一条坏样本拖垮整批。
+    """
+    meter = meter or ThroughputMeter()
+
+    for batch in plan_batches(items, **(batch_kwargs or {})):
+        try:
+            texts = submit_batch(batch)
+            if len(texts) != len(batch):
+                raise RuntimeError(f"expected {len(batch)} outputs, got {len(texts)}")
+        except Exception as e:
+            print(f"[WARN] batch of {len(batch)} failed ({e}); retrying one by one")
+            texts = []
+            for item in batch:
+                try:
+                    texts.append(submit_batch([item])[0])
+                except Exception as e2:
+                    print(f"[ERROR] sample {item['key']} failed: {e2}")
+                    texts.append(None)
+
+        results = {item["key"]: text for item, text in zip(batch, texts)}
+        for item in batch:
+            on_result(item, results[item["key"]])
+        meter.update(batch)
+
+    return meter
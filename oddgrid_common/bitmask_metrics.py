@@ -0,0 +1,461 @@
+import argparse
+import itertools
+import json
+import sys
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+
+# ======================
+# 位掩码评分引擎（整文件向量化）
+# ======================
+# 每条样本的 gt / pred / 有效单元 编码成定长位掩码（uint64 字，宽度 = 本批最大的 grid / 图片数）：
+#   IOL：cell (r, c) -> 第 (r-1) * stride + (c-1) 位，stride = 本批最大列数；有效 cell 由 grid_size + total_count 给出
+#        （按行优先取前 total_count 个，与 cal_sigle_acc.py 一致），也可以直接给有效 cell 列表
+#   SOI：imageK -> 第 K-1 位；有效范围 1..total_images
+# add 只把解析好的键追加进扁平列表，batch() 用 numpy 一次性置位（没有逐条的大整数运算）；
+# 之后全部是 numpy 位运算 + popcount，一次算完整个文件：
+#   集合级（cal_total_em_f1.py 口径）：EM、F1、precision / recall、tp / fp / fn、错误类型
+#     extract_failed / exact / no_overlap / partial_under / partial_over / partial_mixed
+#   单元级混淆矩阵（cal_sigle_acc.py / cal_single_acc.py 口径）：只统计有效单元；
+#     IOL 预测到无效 / 越界 cell 记 FP，SOI 预测超出 total_images 的编号不计
+#   逐单元 TP / FP / FN / TN（per_cell，热力图用；IOL 请按 grid_size 分组调用）
+# 解析（extract_answer -> 列表）不在这里做，各脚本沿用自己的 normalize_*；解析失败传 None。
+# 超出 MAX_SIDE / MAX_INDEX 的坐标（基本是模型胡写的）不占位，集合级指标在 Python 里单独精确计入。
+#
+# 速度自测（随机数据，逐条与集合实现对比；total 是 add + 编码 + 评分的端到端耗时）：
+#   python oddgrid_common/bitmask_metrics.py bench --n 2000000
+
+ERROR_TYPES = ("exact", "no_overlap", "partial_under", "partial_over", "partial_mixed", "extract_failed")
+
+MAX_SIDE = 64       # IOL 行 / 列上限
+MAX_INDEX = 4096    # SOI 图片编号上限
+
+_WORD = 64
+_CLIP = 1 << 62
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+# ======================
+# 有效单元
+# ======================
+def parse_grid_size(grid_size):
+    """[3, 3] / "[3, 3]" / 缺失 -> [rows, cols]，默认 [3, 3]"""
+    if grid_size is None:
+        return [3, 3]
+    if isinstance(grid_size, str):
+        try:
+            grid_size = json.loads(grid_size)
+        except Exception:
+            return [3, 3]
+    if isinstance(grid_size, (list, tuple)) and len(grid_size) == 2:
+        return [int(grid_size[0]), int(grid_size[1])]
+    return [3, 3]
+
+
+def iol_total_count(sample, grid_size):
+    """total_count -> source_cells 里 original_name 非空的个数 -> rows * cols"""
+    if sample.get("total_count") is not None:
+        return int(sample["total_count"])
+    source_cells = sample.get("source_cells")
+    if isinstance(source_cells, list):
+        return sum(1 for cell in source_cells if cell.get("original_name") is not None)
+    return int(grid_size[0]) * int(grid_size[1])
+
+
+def soi_total_count(sample, default=9):
+    return int(sample.get("total_images") or sample.get("image_num") or sample.get("total_icons") or default)
+
+
+def row_major_cells(grid_size, total_count):
+    rows, cols = grid_size
+    return [(i // cols + 1, i % cols + 1) for i in range(total_count) if i // cols + 1 <= rows]
+
+
+# ======================
+# 编码
+# ======================
+class MaskEncoder:
+    """
+    逐条 add 已解析的样本（只把键追加进扁平列表），batch() 时按本批最大宽度用 numpy 一次性编码：
+      enc = MaskEncoder("iol")
+      enc.add(gt, pred, grid_size=[3, 3], total_count=7)     # 或 valid=[(1, 1), ...]
+      scores = score(enc.batch())
+    """
+
+    def __init__(self, task):
+        if task not in ("iol", "soi"):
+            raise ValueError(f"unknown task {task!r}")
+        self.task = task
+        # 扁平存储：所有样本的键首尾相接，*_len 记每条样本占几个
+        self._gt, self._gt_len = [], []
+        self._pred, self._pred_len = [], []
+        self._valid, self._valid_len = [], []
+        self._spec = []         # IOL：(rows, cols, total)；SOI：(1, total, total)；显式 valid 列表记 (0, 1, 0)
+        self._parsed = []
+
+    def __len__(self):
+        return len(self._parsed)
+
+    def _in_range(self, key):
+        if self.task == "iol":
+            return 1 <= key[0] <= MAX_SIDE and 1 <= key[1] <= MAX_SIDE
+        return 1 <= key <= MAX_INDEX
+
+    def add(self, gt, pred, grid_size=None, total_count=None, valid=None):
+        gt = gt or ()
+        self._gt.extend(gt)
+        self._gt_len.append(len(gt))
+        self._parsed.append(pred is not None)
+        pred = pred or ()
+        self._pred.extend(pred)
+        self._pred_len.append(len(pred))
+        if valid is not None:
+            valid = list(valid)
+            self._valid.extend(valid)
+            self._valid_len.append(len(valid))
+            self._spec.append((0, 1, 0))
+            return
+        self._valid_len.append(0)
+        if self.task == "iol":
+            rows, cols = parse_grid_size(grid_size)
+            total = rows * cols if total_count is None else min(int(total_count), rows * cols)
+            self._spec.append((rows, cols, total))
+        else:
+            total = int(total_count if total_count is not None else 9)
+            self._spec.append((1, total, total))
+
+    def _keys(self, keys):
+        """键列表 -> int64 数组（IOL 为 (K, 2)）；超出 int64 的编号截断，反正都不在范围内"""
+        iol = self.task == "iol"
+        flat = lambda ks: itertools.chain.from_iterable(ks) if iol else ks
+        count = len(keys) * (2 if iol else 1)
+        try:
+            arr = np.fromiter(flat(keys), dtype=np.int64, count=count)
+        except OverflowError:
+            clip = lambda x: max(-_CLIP, min(_CLIP, int(x)))
+            keys = [(clip(k[0]), clip(k[1])) for k in keys] if iol else [clip(k) for k in keys]
+            arr = np.fromiter(flat(keys), dtype=np.int64, count=count)
+        return arr.reshape((-1, 2) if iol else (-1,))
+
+    def _range_mask(self, arr):
+        if self.task == "iol":
+            return (arr >= 1).all(axis=1) & (arr <= MAX_SIDE).all(axis=1)
+        return (arr >= 1) & (arr <= MAX_INDEX)
+
+    def batch(self):
+        n = len(self)
+        iol = self.task == "iol"
+        owner = {}      # name -> (键数组, 每个键所属样本, 是否在范围内)
+        for name, keys, lens in (("gt", self._gt, self._gt_len), ("pred", self._pred, self._pred_len),
+                                 ("valid", self._valid, self._valid_len)):
+            arr = self._keys(keys)
+            owner[name] = (arr, np.repeat(np.arange(n), lens), self._range_mask(arr))
+        spec = np.fromiter(itertools.chain.from_iterable(self._spec), dtype=np.int64, count=3 * n).reshape(-1, 3)
+        rows, cols, total = spec[:, 0], spec[:, 1], spec[:, 2]
+
+        # 本批最大行 / 列（SOI 只有编号）：只看范围内的键；grid_size + total_count 按其占到的最后一行 / 列计
+        in_range = [arr[ok] for arr, _, ok in owner.values()]
+        if iol:
+            implicit = (rows > 0) & (cols > 0)
+            track = np.stack([
+                np.where(total > 0, np.minimum(rows, -(-total // np.maximum(cols, 1))), 1),
+                np.where(np.minimum(cols, total) > 0, np.minimum(cols, total), 1),
+            ], axis=1)[implicit]
+            in_range.append(track[self._range_mask(track)])
+            keys = np.concatenate(in_range + [np.ones((1, 2), dtype=np.int64)])
+            max_row, stride = int(keys[:, 0].max()), int(keys[:, 1].max())
+            n_bits = stride * max_row
+        else:
+            implicit = rows > 0
+            in_range.append(total[implicit & self._range_mask(total)])
+            stride = n_bits = int(np.concatenate(in_range + [np.ones(1, dtype=np.int64)]).max())
+        n_words = max(1, -(-n_bits // _WORD))
+
+        def bit(arr):
+            return (arr[:, 0] - 1) * stride + (arr[:, 1] - 1) if iol else arr - 1
+
+        def encode(name):
+            arr, sample, ok = owner[name]
+            return _set_bits(sample[ok], bit(arr[ok]), n, n_words)
+
+        # grid_size + total_count 形式的有效单元：不同规格只有几种，逐种算好再按下标取
+        if n and spec.min() >= 0 and spec.max() < 1 << 21:
+            _, first, inverse = np.unique((rows << 42) | (cols << 21) | total, return_index=True, return_inverse=True)
+            specs = spec[first]
+        else:
+            specs, inverse = np.unique(spec, axis=0, return_inverse=True)
+        spec_words = _to_words([_count_mask(tuple(int(x) for x in s), stride) for s in specs], n_words)
+        valid = spec_words[inverse.reshape(-1)] | encode("valid")
+
+        # 超出 MAX_SIDE / MAX_INDEX 的键不占位，按集合口径在 Python 里补算（只过有越界键的样本）
+        extra = np.zeros((4, n), dtype=np.int64)   # 集合级 tp / fp / fn，单元级 fp（越界的预测）
+        offsets = {name: np.concatenate([[0], np.cumsum(lens)]) for name, lens in (("gt", self._gt_len), ("pred", self._pred_len))}
+        odd = np.zeros(n, dtype=bool)
+        for name in ("gt", "pred"):
+            _, sample, ok = owner[name]
+            odd[sample[~ok]] = True
+        for i in np.flatnonzero(odd).tolist():
+            g_out = {k for k in self._gt[offsets["gt"][i]:offsets["gt"][i + 1]] if not self._in_range(k)}
+            p_out = {k for k in self._pred[offsets["pred"][i]:offsets["pred"][i + 1]] if not self._in_range(k)}
+            extra[0, i] = len(p_out & g_out)
+            extra[1, i] = len(p_out - g_out)
+            extra[2, i] = len(g_out - p_out)
+            extra[3, i] = len(p_out)
+
+        return SimpleNamespace(
+            task=self.task,
+            n=n,
+            stride=stride,
+            n_bits=n_bits,
+            gt=encode("gt"),
+            pred=encode("pred"),
+            valid=valid,
+            parsed=np.fromiter(self._parsed, dtype=bool, count=n),
+            extra_tp=extra[0],
+            extra_fp=extra[1],
+            extra_fn=extra[2],
+            extra_pred=extra[3] if iol else np.zeros(n, dtype=np.int64),
+        )
+
+
+def _count_mask(spec, stride):
+    """(rows, cols, total) -> 行优先前 total 个单元的位掩码（Python int）"""
+    rows, cols, total = spec
+    if cols <= 0 or total <= 0:
+        return 0
+    full, rest = divmod(total, cols)
+    row_bits = (1 << min(cols, stride)) - 1
+    v = 0
+    for r in range(min(full, rows)):
+        v |= row_bits << (r * stride)
+    if rest and full < rows:
+        v |= ((1 << rest) - 1) << (full * stride)
+    return v
+
+
+def _set_bits(sample, bits, n, n_words):
+    """第 sample[j] 行置第 bits[j] 位 -> (n, n_words) uint64"""
+    out = np.zeros(n * n_words, dtype=np.uint64)
+    vals = np.left_shift(np.uint64(1), (bits % _WORD).astype(np.uint64))
+    np.bitwise_or.at(out, sample * n_words + bits // _WORD, vals)
+    return out.reshape(n, n_words)
+
+
+def _to_words(ints, n_words):
+    mask = (1 << _WORD) - 1
+    out = np.empty((len(ints), n_words), dtype=np.uint64)
+    for w in range(n_words):
+        out[:, w] = [(x >> (w * _WORD)) & mask for x in ints]
+    return out
+
+
+def popcount(words):
+    """(N, W) uint64 -> (N,) 每行置位个数"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    as_bytes = np.ascontiguousarray(words).view(np.uint8).reshape(words.shape[0], -1)
+    return _BYTE_POPCOUNT[as_bytes].sum(axis=1, dtype=np.int64)
+
+
+# ======================
+# 评分
+# ======================
+def score(batch):
+    """
+    返回 dict（每项是长度 N 的数组）：
+      em, f1, precision, recall, tp, fp, fn（集合级），error（ERROR_TYPES 的下标）
+      cell_tp, cell_fp, cell_fn, cell_tn（单元级混淆矩阵），cell_valid（有效单元数）
+    """
+    g, p, v = batch.gt, batch.pred, batch.valid
+    tp = popcount(p & g) + batch.extra_tp
+    fp = popcount(p & ~g) + batch.extra_fp
+    fn = popcount(g & ~p) + batch.extra_fn
+    exact = batch.parsed & (fp == 0) & (fn == 0)
+
+    hit = tp > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        f1 = np.where(exact, 1.0, np.where(hit, 2 * tp / (2 * tp + fp + fn), 0.0))
+        precision = np.where(exact, 1.0, np.where(hit, tp / (tp + fp), 0.0))
+        recall = np.where(exact, 1.0, np.where(hit, tp / (tp + fn), 0.0))
+    error = np.select(
+        [~batch.parsed, exact, ~hit, fp == 0, fn == 0],
+        [ERROR_TYPES.index(t) for t in ("extract_failed", "exact", "no_overlap", "partial_under", "partial_over")],
+        default=ERROR_TYPES.index("partial_mixed"),
+    ).astype(np.int8)
+
+    out_of_valid = popcount(p & ~v) if batch.task == "iol" else 0
+    return {
+        "em": exact.astype(np.int8),
+        "f1": f1,
+        "precision": precision,
+        "recall": recall,
+        "tp": tp,
+        "fp": fp,
+        "fn": fn,
+        "error": error,
+        "cell_tp": popcount(p & g & v),
+        "cell_fp": popcount(p & ~g & v) + out_of_valid + batch.extra_pred,
+        "cell_fn": popcount(g & ~p & v),
+        "cell_tn": popcount(v & ~p & ~g),
+        "cell_valid": popcount(v),
+    }
+
+
+def _unpack(words):
+    as_bytes = np.ascontiguousarray(words.astype("<u8", copy=False)).view(np.uint8).reshape(words.shape[0], -1)
+    return np.unpackbits(as_bytes, axis=1, bitorder="little").astype(bool)
+
+
+def per_cell(batch):
+    """
+    逐位（单元）的 TP / FP / FN / TN 计数，长度 n_bits；IOL 的位 b 对应 cell (b // stride + 1, b % stride + 1)。
+    只统计有效单元（IOL 无效 cell 上的预测计入该位的 FP）。
+    """
+    g, p, v = _unpack(batch.gt), _unpack(batch.pred), _unpack(batch.valid)
+    n_bits = batch.n_bits
+    fp = (p & ~g & v) | (p & ~v) if batch.task == "iol" else (p & ~g & v)
+    return {
+        "tp": (p & g & v).sum(axis=0)[:n_bits],
+        "fp": fp.sum(axis=0)[:n_bits],
+        "fn": (g & ~p & v).sum(axis=0)[:n_bits],
+        "tn": (v & ~p & ~g).sum(axis=0)[:n_bits],
+    }
+
+
+def summarize(scores):
+    """整批汇总：N、EM / F1 / precision / recall（样本平均）、错误类型计数、单元级 acc / precision / recall / f1"""
+    n = len(scores["em"])
+    tp, fp, fn, tn = (int(scores[f"cell_{k}"].sum()) for k in ("tp", "fp", "fn", "tn"))
+    units = tp + fp + fn + tn
+    cell_p = tp / (tp + fp) if tp + fp else 0.0
+    cell_r = tp / (tp + fn) if tp + fn else 0.0
+    counts = np.bincount(scores["error"], minlength=len(ERROR_TYPES))
+    return {
+        "N": n,
+        "EM": float(scores["em"].mean()) if n else 0.0,
+        "F1": float(scores["f1"].mean()) if n else 0.0,
+        "precision": float(scores["precision"].mean()) if n else 0.0,
+        "recall": float(scores["recall"].mean()) if n else 0.0,
+        "errors": Counter({t: int(c) for t, c in zip(ERROR_TYPES, counts) if c}),
+        "tp": tp, "fp": fp, "fn": fn, "tn": tn,
+        "units": units,
+        "acc": (tp + tn) / units if units else 0.0,
+        "cell_precision": cell_p,
+        "cell_recall": cell_r,
+        "cell_f1": 2 * cell_p * cell_r / (cell_p + cell_r) if cell_p + cell_r else 0.0,
+    }
+
+
+# ======================
+# CLI: 速度与一致性自测
+# ======================
+def _reference(gt, pred, valid, task):
+    """逐条的集合实现（与 cal_total_em_f1 / cal_sigle_acc 相同的口径）"""
+    gt_set = set(gt)
+    if pred is None:
+        em, f1, error, current = 0, 0.0, "extract_failed", set()
+    else:
+        current = set(pred)
+        tp = len(current & gt_set)
+        fp, fn = len(current - gt_set), len(gt_set - current)
+        em = int(current == gt_set)
+        f1 = 1.0 if em else (2 * tp / (2 * tp + fp + fn) if tp else 0.0)
+        if em:
+            error = "exact"
+        elif not tp:
+            error = "no_overlap"
+        elif current < gt_set:
+            error = "partial_under"
+        elif current > gt_set:
+            error = "partial_over"
+        else:
+            error = "partial_mixed"
+    valid = set(valid)
+    c_fp = len(current - valid) if task == "iol" else 0
+    c_tp = c_fn = c_tn = 0
+    for cell in valid:
+        if cell in gt_set and cell in current:
+            c_tp += 1
+        elif cell in gt_set:
+            c_fn += 1
+        elif cell in current:
+            c_fp += 1
+        else:
+            c_tn += 1
+    return em, f1, error, (c_tp, c_fp, c_fn, c_tn)
+
+
+def _random_rows(task, n, rng):
+    rows = []
+    for _ in range(n):
+        if task == "iol":
+            grid = [int(rng.integers(2, 8)), int(rng.integers(2, 8))]
+            total = int(rng.integers(1, grid[0] * grid[1] + 1))
+            cells = lambda k: [(int(rng.integers(1, grid[0] + 2)), int(rng.integers(1, grid[1] + 2))) for _ in range(k)]
+            gt = cells(int(rng.integers(0, 3)))
+            pred = None if rng.random() < 0.05 else cells(int(rng.integers(0, 4)))
+            rows.append((gt, pred, {"grid_size": grid, "total_count": total}))
+        else:
+            total = int(rng.integers(4, 12))
+            gt = [int(x) for x in rng.integers(1, total + 1, size=int(rng.integers(0, 3)))]
+            pred = None if rng.random() < 0.05 else [int(x) for x in rng.integers(1, total + 3, size=int(rng.integers(0, 3)))]
+            rows.append((gt, pred, {"total_count": total}))
+    return rows
+
+
+def bench(args):
+    rng = np.random.default_rng(args.seed)
+    failed = False
+    for task in ("iol", "soi"):
+        rows = _random_rows(task, args.n, rng)
+        enc = MaskEncoder(task)
+        start = time.perf_counter()
+        for gt, pred, kw in rows:
+            enc.add(gt, pred, **kw)
+        add_time = time.perf_counter() - start
+        batch = enc.batch()
+        encode_time = time.perf_counter() - start - add_time
+        scores = score(batch)
+        summary = summarize(scores)
+        total_time = time.perf_counter() - start
+        score_time = total_time - add_time - encode_time
+
+        mismatches = 0
+        for i in rng.choice(len(rows), size=min(args.check, len(rows)), replace=False):
+            gt, pred, kw = rows[i]
+            if task == "iol":
+                valid = row_major_cells(parse_grid_size(kw["grid_size"]), kw["total_count"])
+            else:
+                valid = range(1, kw["total_count"] + 1)
+            em, f1, error, cells = _reference(gt, pred, valid, task)
+            got = (int(scores["em"][i]), ERROR_TYPES[scores["error"][i]],
+                   tuple(int(scores[f"cell_{k}"][i]) for k in ("tp", "fp", "fn", "tn")))
+            if got != (em, error, cells) or abs(scores["f1"][i] - f1) > 1e-12:
+                mismatches += 1
+        failed |= bool(mismatches)
+        print(
+            f"[BENCH] {task}: n={batch.n} bits={batch.n_bits} add={add_time:.2f}s encode={encode_time:.2f}s "
+            f"score={score_time:.3f}s total={total_time:.2f}s "
+            f"EM={summary['EM'] * 100:.2f} F1={summary['F1'] * 100:.2f} acc={summary['acc'] * 100:.2f} "
+            f"check {args.check - mismatches}/{args.check} identical"
+        )
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bitmask EM/F1/confusion engine")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("bench", help="随机数据上测速，并与逐条集合实现对比")
+    p.add_argument("--n", type=int, default=1_000_000)
+    p.add_argument("--check", type=int, default=20000, help="抽查多少条与集合实现对比")
+    p.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    bench(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import errno
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+
+# ======================
+# 内容寻址 blob store + 链接物化
+# ======================
+# 原始图片按内容哈希存一份：<root>/objects/<h[:2]>/<h><ext>
+# 各个目录布局（single_data / merged images / ...）里的文件都是同一个 object 的 reflink（写时复制，
+# 文件系统不支持时才真正复制）。
+#
+# 物化方式（mode）：
+#   auto    : reflink -> copy（默认）。输出与源文件 / object 互不影响
+#   reflink : 只 reflink，不支持时报错
+#   copy    : 总是复制
+#   hardlink: 显式开启才用。输出与源文件（或 store 里的 object）共用 inode，改一个另一个也变；
+#             经由 store 时输出就是只读的 object 本身
+#
+# 入库时不 hardlink 源文件（源文件之后被原地改写会连带改掉 object）：
+# reflink 或复制成 store 自己的一份，校验哈希后设为只读再原子地放到 object 路径。
+#
+# 哈希缓存：<root>/hash_cache.sqlite，键为 (abs_path, size, mtime_ns)，
+# 重跑时文件没变就不用重新读文件计算哈希。
+
+LINK_MODES = ("auto", "hardlink", "reflink", "copy")
+
+_FICLONE = 0x40049409  # linux/fs.h
+_CHUNK = 1 << 20
+
+
+def _reflink(src, dst):
+    import fcntl
+
+    with open(src, "rb") as fs, open(dst, "xb") as fd:
+        try:
+            fcntl.ioctl(fd.fileno(), _FICLONE, fs.fileno())
+        except OSError:
+            fd.close()
+            os.unlink(dst)
+            raise
+
+
+def link_or_copy(src, dst, mode="auto"):
+    """
+    把 src 物化到 dst，返回实际使用的方式（hardlink / reflink / copy）。
+    auto: reflink -> copy；hardlink 只在显式指定时使用（与 src 共用 inode）。
+    dst 已存在时不覆盖（FileExistsError）。
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode: {mode}")
+
+    src, dst = Path(src), Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+
+    if mode == "hardlink":
+        os.link(src, dst)
+        return "hardlink"
+
+    if mode in ("auto", "reflink"):
+        try:
+            _reflink(src, dst)
+            return "reflink"
+        except FileExistsError:
+            raise
+        except (OSError, ImportError):
+            if mode == "reflink":
+                raise
+    elif dst.exists():
+        raise FileExistsError(errno.EEXIST, "File exists", str(dst))
+
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+class HashCache:
+    """(abs_path, size, mtime_ns) -> sha256，sqlite 持久化，线程安全。"""
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)"
+        )
+        self._conn.commit()
+
+    def get(self, path, st):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, digest FROM hashes WHERE path = ?", (path,)
+            ).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        return None
+
+    def put(self, path, st, digest):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, digest),
+            )
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class BlobStore:
+    def __init__(self, root, mode="auto"):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.mode = mode
+        self.hash_cache = HashCache(self.root / "hash_cache.sqlite")
+        self.stats = {"hashed": 0, "hash_cached": 0, "stored": 0, "hardlink": 0, "reflink": 0, "copy": 0}
+
+    def digest(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        digest = self.hash_cache.get(path, st)
+        if digest is not None:
+            self.stats["hash_cached"] += 1
+            return digest
+        digest = sha256_file(path)
+        self.hash_cache.put(path, st, digest)
+        self.stats["hashed"] += 1
+        return digest
+
+    def object_path(self, digest, ext=""):
+        return self.objects / digest[:2] / f"{digest}{ext.lower()}"
+
+    def put(self, src):
+        """入库（已存在则跳过），返回 object 路径。"""
+        src = Path(src)
+        digest = self.digest(src)
+        obj = self.object_path(digest, src.suffix)
+        if obj.exists():
+            return obj
+
+        obj.parent.mkdir(parents=True, exist_ok=True)
+        tmp = obj.with_name(f".{obj.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            try:
+                _reflink(src, tmp)
+            except (OSError, ImportError):
+                shutil.copy2(src, tmp)
+            actual = sha256_file(tmp)
+            if actual != digest:
+                # 源文件在算哈希之后被改过：按实际内容入库
+                print(f"[WARN] {src} changed while storing, re-keyed {digest[:12]} -> {actual[:12]}")
+                self.hash_cache.put(os.path.abspath(src), os.stat(src), actual)
+                obj = self.object_path(actual, src.suffix)
+                if obj.exists():
+                    return obj
+                obj.parent.mkdir(parents=True, exist_ok=True)
+            os.chmod(tmp, 0o444)
+            os.link(tmp, obj)
+            self.stats["stored"] += 1
+        except FileExistsError:
+            pass  # 并发写入同一内容
+        finally:
+            tmp.unlink(missing_ok=True)
+        return obj
+
+    def materialize(self, src, dst):
+        """src 入库后把 object 链接到 dst；dst 已存在时返回 None。"""
+        dst = Path(dst)
+        if dst.exists():
+            return None
+        obj = self.put(src)
+        try:
+            how = link_or_copy(obj, dst, self.mode)
+        except FileExistsError:
+            return None
+        if how == "copy":
+            os.chmod(dst, os.stat(src).st_mode & 0o7777)  # object 是只读的，复制出来的文件沿用源文件权限
+        self.stats[how] += 1
+        return how
+
+    def close(self):
+        self.hash_cache.close()
+        print(
+            f"[BLOB] hashed={self.stats['hashed']} hash_cached={self.stats['hash_cached']} "
+            f"stored={self.stats['stored']} hardlink={self.stats['hardlink']} "
+            f"reflink={self.stats['reflink']} copy={self.stats['copy']}"
+        )
+
+
+def materialize_file(src, dst, store=None, mode="auto"):
+    """
+    shutil.copy2 的替代：有 store 时经由 blob store 去重，
+    否则直接把 src 链接到 dst。dst 已存在时不做任何事，返回 None。
+    """
+    if store is not None:
+        return store.materialize(src, dst)
+    if Path(dst).exists():
+        return None
+    try:
+        return link_or_copy(src, dst, mode)
+    except FileExistsError:
+        return None
+
+
+def materialize_tree(src_dir, dst_dir, store=None, mode="auto"):
+    """shutil.copytree 的替代：目录结构照搬，文件逐个链接。"""
+    src_dir, dst_dir = Path(src_dir), Path(dst_dir)
+    for root, _, files in os.walk(src_dir):
+        rel = Path(root).relative_to(src_dir)
+        (dst_dir / rel).mkdir(parents=True, exist_ok=True)
+        for fn in files:
+            materialize_file(Path(root) / fn, dst_dir / rel / fn, store=store, mode=mode)
@@ -0,0 +1,181 @@
+import argparse
+import hashlib
+import time
+import zlib
+
+import numpy as np
+
+# ======================
+# 向量化 bootstrap：置信区间 + 配对显著性
+# ======================
+# 报表里每个 (模型, 数据集) 单元是一条逐样本分数数组（EM 0/1、F1、混淆矩阵计数……），要的是均值的 bootstrap 分布：
+#   重采样下标矩阵 idx (B, n) -> 计数矩阵 counts (B, n)（bincount）-> 所有单元一次矩阵乘 X (C, n) @ counts.T / n
+#   B 按块生成（每块约 _CHUNK_ELEMS 个下标），内存与单元数无关
+# 下标矩阵的随机流只由 (seed, stream, n) 决定：同一 stream、样本数相同、样本顺序对齐的单元用的是同一组重采样，
+# 所以两模型 draws 相减就是配对差值的 bootstrap 分布（checkpoint vs base、GRPO vs DAPO），不用再单独重采样。
+# 多数据集宏平均的 draws = 各数据集 draws 的平均；每个数据集用自己的 stream（stream_id(数据集名)），
+# 样本数碰巧相同的数据集之间也是独立重采样。
+#
+# 缓存：每条数组的 draws（float32）存在结果仓库（oddgrid_common/warehouse.py 的 sqlite）里，
+# key = sha256(数组内容, B, seed)，结果文件没变就直接复用。
+#
+# 速度自测：
+#   python oddgrid_common/bootstrap.py bench --cells 300 --n 1000 --resamples 10000
+
+DEFAULT_RESAMPLES = 10000
+DEFAULT_CONFIDENCE = 0.95
+
+_CHUNK_ELEMS = 1 << 22
+_KEY_VERSION = b"bootstrap-v1"
+
+
+def stream_id(name):
+    """数据集名等 -> 稳定的随机流编号（跨进程不变，不能用 hash()）"""
+    return zlib.crc32(str(name).encode("utf-8"))
+
+
+def resample_means(rows, n_boot=DEFAULT_RESAMPLES, seed=0, stream=0):
+    """rows: (C, n) 同长度的逐样本数组 -> (C, n_boot) 每次重采样的均值"""
+    x = np.asarray(rows, dtype=np.float64)
+    c, n = x.shape
+    out = np.empty((c, n_boot), dtype=np.float64)
+    if n == 0:
+        out.fill(np.nan)
+        return out
+    rng = np.random.default_rng([seed, stream, n])
+    block = max(1, _CHUNK_ELEMS // n)
+    for start in range(0, n_boot, block):
+        b = min(block, n_boot - start)
+        idx = rng.integers(0, n, size=(b, n), dtype=np.int64)
+        flat = (idx + (np.arange(b, dtype=np.int64) * n)[:, None]).ravel()
+        counts = np.bincount(flat, minlength=b * n).reshape(b, n).astype(np.float64)
+        out[:, start:start + b] = x @ counts.T / n
+    return out
+
+
+def percentile_interval(draws, confidence=DEFAULT_CONFIDENCE):
+    """draws: (..., B) -> (lo, hi)"""
+    alpha = (1 - confidence) / 2
+    lo, hi = np.nanquantile(draws, [alpha, 1 - alpha], axis=-1)
+    return lo, hi
+
+
+def paired_p_value(diff_draws):
+    """配对差值的 bootstrap 分布 -> 双侧 p（差值不为 0），分辨率 1/B"""
+    diff_draws = np.asarray(diff_draws)
+    b = diff_draws.shape[-1]
+    below = (diff_draws <= 0).sum(axis=-1) / b
+    above = (diff_draws >= 0).sum(axis=-1) / b
+    return np.minimum(1.0, 2 * np.minimum(below, above))
+
+
+def data_key(values, n_boot, seed, stream=0):
+    arr = np.ascontiguousarray(values, dtype=np.float64)
+    h = hashlib.sha256(_KEY_VERSION)
+    h.update(f"{n_boot}:{seed}:{stream}:{arr.size}".encode("utf-8"))
+    h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+class Bootstrapper:
+    """
+    bs = Bootstrapper(n_boot=10000, warehouse=open_warehouse())
+    em_a, em_b = bs.draws([scores_a, scores_b], stream=stream_id(dataset))   # 同一数据集、样本对齐 -> 共用重采样
+    lo, hi = bs.interval(em_a)
+    lo, hi, p = bs.compare(em_a, em_b)                  # a - b 的区间与双侧 p
+    """
+
+    def __init__(self, n_boot=DEFAULT_RESAMPLES, seed=0, confidence=DEFAULT_CONFIDENCE, warehouse=None):
+        self.n_boot = n_boot
+        self.seed = seed
+        self.confidence = confidence
+        self.warehouse = warehouse
+        self.stats = {"arrays": 0, "cached": 0, "computed": 0, "time": 0.0}
+
+    def draws(self, arrays, stream=0):
+        """arrays: 若干条 1-D 数组（长度可以不同）-> 对应的 (B,) 均值 draws 列表"""
+        start = time.perf_counter()
+        arrays = [np.asarray(a, dtype=np.float64) for a in arrays]
+        keys = [data_key(a, self.n_boot, self.seed, stream) for a in arrays]
+        cached = self.warehouse.load_draws(set(keys)) if self.warehouse is not None else {}
+
+        out = [None] * len(arrays)
+        pending = {}   # n -> [(i, key)]
+        for i, (a, key) in enumerate(zip(arrays, keys)):
+            if key in cached:
+                out[i] = np.frombuffer(cached[key], dtype=np.float32).astype(np.float64)
+                self.stats["cached"] += 1
+            else:
+                pending.setdefault(a.size, []).append((i, key))
+
+        fresh = {}
+        for n, items in pending.items():
+            unique = {key: i for i, key in items}
+            means = resample_means([arrays[i] for i in unique.values()], self.n_boot, self.seed, stream)
+            for key, row in zip(unique, means):
+                # 缓存按 float32 存：新算的也过一遍 float32，命中与否结果完全一致（否则配对差的并列会被舍入打破，p 随缓存状态变）
+                fresh[key] = row.astype(np.float32)
+            for i, key in items:
+                out[i] = fresh[key].astype(np.float64)
+            self.stats["computed"] += len(unique)
+        if fresh and self.warehouse is not None:
+            self.warehouse.save_draws({key: row.tobytes() for key, row in fresh.items()})
+
+        self.stats["arrays"] += len(arrays)
+        self.stats["time"] += time.perf_counter() - start
+        return out
+
+    def interval(self, draws):
+        lo, hi = percentile_interval(draws, self.confidence)
+        return float(lo), float(hi)
+
+    def compare(self, draws_a, draws_b):
+        """a - b：(区间下界, 上界, 双侧 p)；两者必须来自对齐的同一组样本"""
+        diff = np.asarray(draws_a) - np.asarray(draws_b)
+        lo, hi = percentile_interval(diff, self.confidence)
+        return float(lo), float(hi), float(paired_p_value(diff))
+
+    def report(self, prefix="[BOOTSTRAP]"):
+        s = self.stats
+        print(
+            f"{prefix} B={self.n_boot} arrays={s['arrays']} cached={s['cached']} computed={s['computed']} "
+            f"time={s['time']:.2f}s"
+        )
+
+
+# ======================
+# CLI: 速度自测
+# ======================
+def bench(args):
+    rng = np.random.default_rng(args.seed)
+    arrays = [(rng.random(args.n) < rng.random()).astype(np.float64) for _ in range(args.cells)]
+    bs = Bootstrapper(n_boot=args.resamples, seed=args.seed)
+    draws = bs.draws(arrays)
+    bs.report()
+
+    # 与逐条 bootstrap（同一随机流）对比第一条
+    ref_rng = np.random.default_rng([args.seed, 0, args.n])
+    block = max(1, _CHUNK_ELEMS // args.n)
+    first = ref_rng.integers(0, args.n, size=(min(block, args.resamples), args.n), dtype=np.int64)
+    ref = arrays[0][first].mean(axis=1)
+    err = float(np.abs(ref - draws[0][:len(ref)]).max())
+    lo, hi = bs.interval(draws[0])
+    d_lo, d_hi, p = bs.compare(draws[0], draws[1])
+    print(f"[BOOTSTRAP] cell0 mean={arrays[0].mean():.4f} CI=[{lo:.4f}, {hi:.4f}], max |gather - matmul| = {err:.2e}")
+    print(f"[BOOTSTRAP] cell0 - cell1 CI=[{d_lo:.4f}, {d_hi:.4f}] p={p:.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized bootstrap")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("bench", help="随机 0/1 数组上测速")
+    p.add_argument("--cells", type=int, default=300)
+    p.add_argument("--n", type=int, default=1000)
+    p.add_argument("--resamples", type=int, default=DEFAULT_RESAMPLES)
+    p.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    bench(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import httpx
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from oddgrid_common.async_client import AsyncChatClient, CACHED_FIELDS, _timed_build
+
+# ======================
+# 多 endpoint 分发（共享队列 / work stealing）
+# ======================
+# 多个 OpenAI-compatible endpoint 跑同一个模型时，所有 endpoint 的 worker 从同一个队列取任务：
+# 快的节点自然多拿，不做静态切分。
+#
+#   - 每个 endpoint concurrency 个 worker，各自一个 httpx 连接池
+#   - 启动时和之后每 health_interval 秒探测 GET <base>/health，不健康的 endpoint 的 worker 暂停取任务
+#   - 请求在某个 endpoint 上连接失败 / 5xx / 429：任务放回队列由其他 endpoint 处理（每条任务最多 max_attempts 次；
+#     其余 4xx 视为样本本身的问题，不换节点），该 endpoint 的 worker 指数退避（requeue_backoff 起步）后再取任务；
+#     非 429 的失败顺带立即探测一次 /health
+#   - endpoint 只在连续 down_after 次失败、或 /health 探测失败时才标记为不健康：
+#     单次限流 / 偶发 5xx 不把健康的副本踢出轮转；成功一次清零
+#   - 所有 endpoint 持续不健康超过 give_up_after 秒：剩余任务按失败回调
+#
+# on_result(job, result) 按完成顺序调用（结果带 endpoint 字段），
+# 调用方用 ResultsWriter 追加到同一个 JSONL，按样本 id 去重 / 续跑。
+#
+# 自测（起几个本地假服务，其中一个中途故障）：
+#   python oddgrid_common/dispatcher.py --stub 3 --kill_after 1.0 --n 300
+#   python oddgrid_common/dispatcher.py --stub 3 --kill_after -1 --fail_rate 0.05 --n 300   # 偶发 503：只退避，down=0
+
+
+def health_url(api_url):
+    base = api_url.split("/v1/")[0] if "/v1/" in api_url else api_url.rstrip("/")
+    return base + "/health"
+
+
+def _is_endpoint_error(error):
+    """连接失败 / 超时 / 5xx / 429 算 endpoint 的问题；其余 4xx 是请求本身的问题。"""
+    if not error or not error.startswith("HTTP "):
+        return True
+    code = error[5:8]
+    return code.startswith("5") or code == "429"
+
+
+class Endpoint:
+    def __init__(self, api_url, concurrency, down_after=3, backoff=0.5, max_backoff=10.0):
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.down_after = down_after
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failures = 0          # 连续失败次数
+        self.backoff_until = 0.0
+        self.probing = False
+        self.healthy = asyncio.Event()
+        self.stats = {"done": 0, "failed": 0, "requeued": 0, "latency": 0.0, "down": 0, "backoff": 0}
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self):
+        """连续失败够 down_after 次才下线；否则本 endpoint 的 worker 退避一段时间再取任务"""
+        self.failures += 1
+        if self.failures >= self.down_after:
+            self.mark_down()
+            return
+        delay = min(self.max_backoff, self.backoff * (2 ** (self.failures - 1)))
+        self.backoff_until = max(self.backoff_until, time.perf_counter() + delay)
+        self.stats["backoff"] += 1
+
+    async def wait_ready(self):
+        await self.healthy.wait()
+        delay = self.backoff_until - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay * (1 + random.random() * 0.1))
+
+    def mark_down(self):
+        if self.healthy.is_set():
+            self.stats["down"] += 1
+            print(f"[DISPATCH] {self.api_url} marked unhealthy")
+        self.healthy.clear()
+
+    def mark_up(self):
+        if not self.healthy.is_set():
+            print(f"[DISPATCH] {self.api_url} healthy")
+            self.failures = 0
+            self.backoff_until = 0.0
+        self.healthy.set()
+
+
+async def _probe(client, endpoint):
+    try:
+        resp = await client.get(health_url(endpoint.api_url))
+        ok = resp.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    if ok:
+        endpoint.mark_up()
+    else:
+        endpoint.mark_down()
+    return ok
+
+
+async def run_dispatch_async(jobs, build_payload, on_result, api_urls, concurrency=8, stream=False,
+                             cache=None, early_stop=None, max_attempts=3, health_interval=10.0,
+                             give_up_after=300.0, down_after=3, requeue_backoff=0.5, **client_kwargs):
+    """
+    jobs / build_payload 与 run_ordered 相同；api_urls: endpoint 列表；concurrency: 每个 endpoint 的并发。
+    down_after: 连续失败多少次才把 endpoint 标记为不健康；requeue_backoff: 失败后退避的起始秒数（指数增长）。
+    返回各 endpoint 的统计。
+    """
+    endpoints = [Endpoint(url, concurrency, down_after=down_after, backoff=requeue_backoff) for url in api_urls]
+    n_workers = sum(e.concurrency for e in endpoints)
+    client_kwargs.setdefault("max_retries", 0)  # 重试交给队列（可以换节点）
+
+    queue = asyncio.Queue()
+    feed_slots = asyncio.Semaphore(n_workers * 2)  # 按需拉取 jobs，预取节奏与请求节奏一致
+    state = {"outstanding": 0, "fed_all": False}
+    all_done = asyncio.Event()
+    probes = set()
+
+    def finish(job, result):
+        try:
+            on_result(job, result)
+        except Exception as e:
+            print(f"[ERROR] on_result failed: {type(e).__name__}: {e}")
+        state["outstanding"] -= 1
+        feed_slots.release()
+        if state["fed_all"] and state["outstanding"] == 0:
+            all_done.set()
+
+    async def feeder():
+        for job in jobs:
+            await feed_slots.acquire()
+            state["outstanding"] += 1
+            await queue.put((job, 0))
+        state["fed_all"] = True
+        if state["outstanding"] == 0:
+            all_done.set()
+
+    async def probe_now(endpoint):
+        # 同一 endpoint 同时只探测一次；探测失败才下线
+        endpoint.probing = True
+        try:
+            await _probe(http, endpoint)
+        finally:
+            endpoint.probing = False
+
+    async def worker(endpoint, client):
+        while True:
+            await endpoint.wait_ready()
+            job, attempts = await queue.get()
+            if not endpoint.healthy.is_set():
+                # 等任务时节点挂了：放回去给别的节点
+                queue.put_nowait((job, attempts))
+                continue
+            try:
+                await handle(endpoint, client, job, attempts)
+            except Exception as e:
+                # 任何意外都按失败回调：worker 不能死，否则 outstanding 永远归不了零
+                finish(job, {"text": None, "usage": {}, "latency": None, "attempts": attempts,
+                             "error": f"{type(e).__name__}: {e}", "endpoint": endpoint.api_url})
+
+    async def handle(endpoint, client, job, attempts):
+        payload, encode_time, key = await asyncio.to_thread(
+            _timed_build, build_payload, job, cache is not None)
+        if payload is None:
+            finish(job, {"text": None, "usage": {}, "latency": None, "attempts": attempts,
+                         "error": "no payload", "endpoint": None})
+            return
+        if key is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                finish(job, {**cached, "attempts": 0, "error": None, "cache_hit": True,
+                             "encode_time": encode_time, "endpoint": None})
+                return
+
+        result = await client.chat(payload, stream=stream, early_stop=early_stop)
+        result["encode_time"] = encode_time
+        result["endpoint"] = endpoint.api_url
+        attempts += 1
+        result["attempts"] = attempts
+
+        if result["text"] is not None:
+            endpoint.record_success()
+            endpoint.stats["done"] += 1
+            endpoint.stats["latency"] += result["latency"] or 0.0
+            if key is not None and not result.get("early_stopped"):
+                cache.put(key, {k: result.get(k) for k in CACHED_FIELDS})
+            finish(job, result)
+        elif _is_endpoint_error(result["error"]):
+            endpoint.record_failure()
+            if endpoint.healthy.is_set() and not endpoint.probing and not (result["error"] or "").startswith("HTTP 429"):
+                task = asyncio.create_task(probe_now(endpoint))
+                probes.add(task)
+                task.add_done_callback(probes.discard)
+            if attempts < max_attempts:
+                endpoint.stats["requeued"] += 1
+                queue.put_nowait((job, attempts))
+            else:
+                endpoint.stats["failed"] += 1
+                finish(job, result)
+        else:
+            # 样本本身的问题（4xx）：节点是通的
+            endpoint.record_success()
+            endpoint.stats["failed"] += 1
+            finish(job, result)
+
+    async def health_loop(http):
+        down_since = None
+        while not all_done.is_set():
+            results = await asyncio.gather(*(_probe(http, e) for e in endpoints))
+            if any(results):
+                down_since = None
+            else:
+                down_since = down_since or time.perf_counter()
+                if time.perf_counter() - down_since > give_up_after:
+                    print(f"[ERROR] no healthy endpoint for {give_up_after:g}s, giving up")
+                    # feeder 可能还在补任务，一直清到全部回调完
+                    while not all_done.is_set():
+                        drain()
+                        await asyncio.sleep(0.05)
+                    return
+            try:
+                await asyncio.wait_for(all_done.wait(), timeout=health_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def drain():
+        while not queue.empty():
+            job, attempts = queue.get_nowait()
+            finish(job, {"text": None, "usage": {}, "latency": None, "attempts": attempts,
+                         "error": "no healthy endpoint", "endpoint": None})
+
+    async with httpx.AsyncClient(timeout=httpx.Timeout(5.0)) as http:
+        await asyncio.gather(*(_probe(http, e) for e in endpoints))
+        clients = [AsyncChatClient(e.api_url, concurrency=e.concurrency, **client_kwargs) for e in endpoints]
+        for c in clients:
+            await c.__aenter__()
+        tasks = []
+        try:
+            tasks += [asyncio.create_task(worker(e, c)) for e, c in zip(endpoints, clients)
+                      for _ in range(e.concurrency)]
+            tasks.append(asyncio.create_task(feeder()))
+            tasks.append(asyncio.create_task(health_loop(http)))
+            await all_done.wait()
+        finally:
+            pending = tasks + list(probes)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for c in clients:
+                await c.__aexit__(None, None, None)
+
+    return {e.api_url: dict(e.stats) for e in endpoints}
+
+
+def run_dispatch(jobs, build_payload, on_result, api_urls, concurrency=8, **kwargs):
+    return asyncio.run(run_dispatch_async(jobs, build_payload, on_result, api_urls, concurrency, **kwargs))
+
+
+def report_endpoints(stats, prefix="[DISPATCH]"):
+    for url, s in stats.items():
+        avg = s["latency"] / s["done"] if s["done"] else 0.0
+        print(
+            f"{prefix} {url} done={s['done']} failed={s['failed']} requeued={s['requeued']} "
+            f"backoff={s['backoff']} down={s['down']} avg_latency={avg:.3f}s"
+        )
+
+
+# ======================
+# CLI: 本地假服务自测
+# ======================
+def main():
+    from oddgrid_common.stub_openai_server import start_stub_server
+
+    parser = argparse.ArgumentParser(description="Multi-endpoint dispatcher self-test against local stub servers")
+    parser.add_argument("--stub", type=int, default=3, help="启动几个假服务")
+    parser.add_argument("--n", type=int, default=300, help="任务数")
+    parser.add_argument("--concurrency", type=int, default=4, help="每个 endpoint 的并发")
+    parser.add_argument("--delays", type=str, default="0.01,0.02,0.05", help="各假服务的延迟（秒），体现快慢节点")
+    parser.add_argument("--kill_after", type=float, default=1.0, help="多少秒后让第一个假服务故障（<0 不故障）")
+    parser.add_argument("--health_interval", type=float, default=0.5)
+    parser.add_argument("--fail_rate", type=float, default=0.0, help="各假服务偶发 503 的比例（不应让健康节点下线）")
+    args = parser.parse_args()
+
+    delays = [float(d) for d in args.delays.split(",")]
+    servers, urls = [], []
+    for i in range(args.stub):
+        server, url = start_stub_server(delay=delays[i % len(delays)], fail_rate=args.fail_rate)
+        servers.append(server)
+        urls.append(url)
+
+    if args.kill_after >= 0:
+        def kill():
+            time.sleep(args.kill_after)
+            print(f"[SELFTEST] {urls[0]} goes down")
+            servers[0].down = True
+        import threading
+        threading.Thread(target=kill, daemon=True).start()
+
+    results = {}
+
+    def on_result(job, result):
+        results[job] = result
+
+    start = time.perf_counter()
+    stats = run_dispatch(
+        range(args.n),
+        lambda i: {"model": "stub", "messages": [{"role": "user", "content": f"sample {i}"}]},
+        on_result,
+        urls,
+        concurrency=args.concurrency,
+        health_interval=args.health_interval,
+        timeout=5,
+    )
+    elapsed = time.perf_counter() - start
+
+    report_endpoints(stats)
+    ok = sum(1 for r in results.values() if r["text"] is not None)
+    print(f"[SELFTEST] {ok}/{args.n} ok, {len(results)} results, {elapsed:.2f}s")
+    for server in servers:
+        server.shutdown()
+    if len(results) != args.n or ok != args.n:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
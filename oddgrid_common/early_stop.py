@@ -0,0 +1,273 @@
+import argparse
+import os
+import re
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from oddgrid_common.results_store import iter_results
+
+# ======================
+# 答案感知的提前停止
+# ======================
+# 各脚本只取回答里第一个 \boxed{...}（IOL / SOI 的坐标、Ablation / single 的 Yes/No），
+# 后面模型常常还会继续解释几百个 token。
+# 规则：第一个括号配平的 boxed{...} 闭合后，再生成 grace_tokens 个 token 都没有出现新的 boxed，就停。
+# 抽取都是 re.search 取第一个匹配，所以截断不改变抽取结果（可以用下面的 check 命令在旧结果上验证）。
+#
+#   直连 vLLM：BoxedStopLogitsProcessor 放进 SamplingParams(logits_processors=...)，满足条件时强制 EOS；
+#             generated_text 把每条回答包成 GeneratedText，结果文件逐条记录 completion_tokens / early_stopped（与 HTTP 一致）
+#   HTTP   ：run_ordered(..., early_stop=grace) 走流式接口，满足条件时断开连接（vLLM 服务端会 abort 该请求）
+#             纯 stop 字符串表达不了“配平 + 之后 N 个 token”，所以不用 stop 参数
+#
+# 离线回归检查（旧结果是完整生成）：
+#   python oddgrid_common/early_stop.py check IOL_type/eval/mnist_output --grace_tokens 8
+
+DEFAULT_GRACE_TOKENS = 8
+
+# 与各脚本的抽取正则一致
+ANSWER_PATTERNS = [
+    re.compile(r'\\boxed\s*\{+([^}]*)\}+'),
+    re.compile(r'boxed\{{1,2}(Yes|No)\}{1,2}', re.IGNORECASE),
+]
+
+_MARKER = "boxed"
+
+
+class BoxedStopScanner:
+    """
+    增量扫描生成文本。每次 feed 一个 token（或一个流式 chunk）的文本，
+    返回是否应该停止。
+    """
+
+    def __init__(self, grace_tokens=DEFAULT_GRACE_TOKENS):
+        self.grace_tokens = grace_tokens
+        self.window = ""         # 最近几个字符，用来跨 token 识别 "boxed"
+        self.after_marker = False
+        self.depth = 0
+        self.closed = False      # 至少闭合过一个 boxed
+        self.since_close = 0
+        self.done = False
+
+    def feed(self, piece):
+        if self.done:
+            return True
+        for ch in piece:
+            if self.depth:
+                if ch == "{":
+                    self.depth += 1
+                elif ch == "}":
+                    self.depth -= 1
+                    if self.depth == 0:
+                        self.closed = True
+                        self.since_close = -1   # 闭合所在的 token 不算
+                continue
+
+            if self.after_marker:
+                if ch == "{":
+                    self.depth = 1
+                    self.after_marker = False
+                    continue
+                if not ch.isspace():
+                    self.after_marker = False
+
+            self.window = (self.window + ch)[-len(_MARKER):]
+            if self.window == _MARKER:
+                self.after_marker = True
+                self.window = ""
+
+        if self.closed and not self.depth and not self.after_marker:
+            self.since_close += 1
+            if self.since_close >= self.grace_tokens:
+                self.done = True
+        return self.done
+
+
+def truncate_after_box(pieces, grace_tokens=DEFAULT_GRACE_TOKENS):
+    """pieces: token 文本序列 -> (保留的文本, 被截掉的 token 数)"""
+    scanner = BoxedStopScanner(grace_tokens)
+    for i, piece in enumerate(pieces):
+        if scanner.feed(piece):
+            return "".join(pieces[:i + 1]), len(pieces) - i - 1
+    return "".join(pieces), 0
+
+
+class BoxedStopLogitsProcessor:
+    """
+    vLLM（V0）logits processor：(output_token_ids, logits) -> logits。
+    同一个实例被 batch 里所有序列共用，所以按“已生成前缀”的哈希保存每条序列的扫描状态，
+    每步只解码最新的一个 token。
+    模型是懒加载的，tokenizer 可以之后用 bind 绑定。
+    """
+
+    def __init__(self, grace_tokens=DEFAULT_GRACE_TOKENS, tokenizer=None, max_states=8192):
+        self.grace_tokens = grace_tokens
+        self.max_states = max_states
+        self.tokenizer = None
+        self.eos_id = None
+        self._pieces = {}
+        self._states = OrderedDict()
+        self._forced = set()     # 被强制 EOS 的序列（已生成 token 的哈希），generated_text 取走
+        # requests 由调用方（chat_batch）按提交的条数累加，这里不再按序列计数
+        self.stats = {"requests": 0, "stopped": 0, "stopped_tokens": 0, "generated_tokens": 0}
+        if tokenizer is not None:
+            self.bind(tokenizer)
+
+    def bind(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.eos_id = tokenizer.eos_token_id
+        self._pieces = {}
+        return self
+
+    def _piece(self, token_id):
+        piece = self._pieces.get(token_id)
+        if piece is None:
+            piece = self.tokenizer.decode([token_id])
+            self._pieces[token_id] = piece
+        return piece
+
+    def __call__(self, token_ids, logits):
+        ids = tuple(token_ids)
+        scanner = None
+        if ids:
+            scanner = self._states.pop((len(ids) - 1, hash(ids[:-1])), None)
+        if scanner is None:
+            # 首步，或状态被淘汰 / 两条序列前缀相同：从头重放
+            scanner = BoxedStopScanner(self.grace_tokens)
+            for t in ids[:-1]:
+                scanner.feed(self._piece(t))
+        if ids:
+            scanner.feed(self._piece(ids[-1]))
+
+        if scanner.done:
+            self.stats["stopped"] += 1
+            self.stats["stopped_tokens"] += len(ids)
+            if len(self._forced) >= self.max_states:
+                self._forced.clear()
+            self._forced.add(hash(ids))
+            eos_logit = logits[self.eos_id].item()
+            logits.fill_(float("-inf"))
+            logits[self.eos_id] = max(eos_logit, 0.0)
+            return logits
+
+        self._states[(len(ids), hash(ids))] = scanner
+        while len(self._states) > self.max_states:
+            self._states.popitem(last=False)
+        return logits
+
+    def pop_stopped(self, token_ids):
+        """这条输出是否是被强制 EOS 结束的（输出里带不带 EOS token 都能认出）"""
+        ids = tuple(token_ids)
+        for key in (hash(ids), hash(ids[:-1])):
+            if key in self._forced:
+                self._forced.discard(key)
+                return True
+        return False
+
+    def report(self, max_tokens, prefix="[EARLYSTOP]"):
+        s = self.stats
+        # 被截断的请求最多能省到 max_tokens；逐条的 completion_tokens / early_stopped 在结果文件里，
+        # 真实节省量用 check 命令在完整生成上统计
+        max_saved = s["stopped"] * max_tokens - s["stopped_tokens"]
+        print(
+            f"{prefix} stopped={s['stopped']}/{s['requests']} grace={self.grace_tokens} "
+            f"generated_tokens={s['generated_tokens']} tokens_at_stop={s['stopped_tokens']} max_saved<={max_saved}"
+        )
+
+
+class GeneratedText(str):
+    """
+    直连推理的回答文本，附带 completion_tokens / early_stopped；下游仍按 str 使用。
+    推理结果缓存与 trace 只存文本，命中 / 回放时是普通 str，两个字段记为 None（与 HTTP 的 cache_hit 一样，不算实测）。
+    """
+
+    completion_tokens = None
+    early_stopped = None
+
+
+def generated_text(completion, early_stop=None):
+    """vLLM 的 CompletionOutput（或 Transformers 兜底的同形对象）-> GeneratedText"""
+    text = GeneratedText(completion.text)
+    token_ids = getattr(completion, "token_ids", None)
+    if token_ids is not None:
+        text.completion_tokens = len(token_ids)
+        text.early_stopped = False
+        if early_stop is not None:
+            early_stop.stats["generated_tokens"] += len(token_ids)
+            text.early_stopped = early_stop.pop_stopped(token_ids)
+    return text
+
+
+def extracted(text):
+    return tuple(
+        (m.group(1) if m else None)
+        for m in (p.search(text or "") for p in ANSWER_PATTERNS)
+    )
+
+
+_PSEUDO_TOKEN = re.compile(r"\s*\w+|\s*[^\w\s]|\s+")
+
+
+def check_records(records, grace_tokens=DEFAULT_GRACE_TOKENS, field=None):
+    """
+    在完整生成的旧结果上模拟提前停止：
+    返回 (样本数, 会被截断的样本数, 抽取结果改变的样本数, 省下的约 token 数, 省下的字符数)
+    """
+    n = stopped = changed = saved_tokens = saved_chars = 0
+    for record in records:
+        text = record.get(field) if field else record.get("predict_answer", record.get("predict"))
+        if not isinstance(text, str):
+            continue
+        n += 1
+        kept, cut = truncate_after_box(_PSEUDO_TOKEN.findall(text), grace_tokens)
+        if cut:
+            stopped += 1
+            saved_tokens += cut
+            saved_chars += len(text) - len(kept)
+        if extracted(kept) != extracted(text):
+            changed += 1
+    return n, stopped, changed, saved_tokens, saved_chars
+
+
+# ======================
+# CLI: 回归检查
+# ======================
+def main():
+    parser = argparse.ArgumentParser(description="Check that boxed-answer early stopping keeps extracted answers")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("check")
+    p.add_argument("paths", nargs="+", help="结果 .json / .jsonl 文件，或包含它们的目录")
+    p.add_argument("--grace_tokens", type=int, default=DEFAULT_GRACE_TOKENS)
+    p.add_argument("--field", type=str, default=None, help="回答字段，默认 predict_answer / predict")
+    args = parser.parse_args()
+
+    targets = []
+    for path in map(Path, args.paths):
+        if path.is_dir():
+            found = {f.with_suffix(".json") for f in path.rglob("*.json*") if f.suffix in (".json", ".jsonl")}
+            targets.extend(sorted(found))
+        else:
+            targets.append(path.with_suffix(".json"))
+
+    total_changed = 0
+    for save_json_path in targets:
+        n, stopped, changed, saved_tokens, saved_chars = check_records(
+            iter_results(save_json_path), args.grace_tokens, args.field)
+        if not n:
+            continue
+        total_changed += changed
+        flag = "OK" if changed == 0 else "CHANGED"
+        print(
+            f"[{flag}] {save_json_path}: n={n} stopped={stopped} answer_changed={changed} "
+            f"saved≈{saved_tokens} tokens ({saved_chars} chars, {saved_tokens / n:.1f}/sample)"
+        )
+
+    if total_changed:
+        print(f"[ERROR] {total_changed} extracted answers changed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
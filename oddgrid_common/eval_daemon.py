@@ -0,0 +1,465 @@
+import argparse
+import fnmatch
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+# ======================
+# 常驻评测服务：多模型 / 多 checkpoint 的任务队列
+# ======================
+# eval_rl_models_persistent.py 只能让一个模型在多个 data_type 之间常驻；
+# 扫 checkpoint（Qwen3_vl_4B_TOTAL_EM_grpo_step_200 这一类）仍然是一个模型一个进程、每次重新加载。
+#
+# 这里是一个长时间运行的进程 + sqlite 任务队列，任务是 (model, data_type, image_type)：
+#   - 每跑完一个任务重新排一次队（plan_order）：当前已加载的 base / checkpoint 优先，
+#     同一个 base 的任务排在一起，尽量少换模型；其余 base 按 (优先级, 最早提交) 排
+#   - 后端支持 LoRA 时，adapter 目录（含 adapter_config.json）挂在它的 base 上跑，
+#     同一个 base 的多个 checkpoint 只加载一次 base
+#   - 样本级续跑沿用各脚本的结果文件（已处理的 id 跳过）；任务级状态在 sqlite 里，
+#     进程被杀后重启，running 的任务回到 pending
+#   - 进度（每个任务 done / total）写进 sqlite，另一个 shell 里 status 子命令可以看
+#
+# 后端接口（真实后端见 IOL_type/eval/eval_daemon.py、SOI_type/eval/eval_daemon.py）：
+#   supports_lora / loaded_base / loaded_model
+#   base_of(model)            -> 需要加载的 base（不支持 LoRA 时就是 model 本身）
+#   load(model, enable_lora)  -> 确保 model 可以推理（需要时换 base）
+#   run(job, progress)        -> 跑一个任务，progress(done, total)
+#   release()
+#
+# 调度与换模型策略可以用 FakeBackend（虚拟时钟模拟加载耗时，不占 GPU）单独验证：
+#   python oddgrid_common/eval_daemon.py simulate --bases 3 --adapters 4 --data_types 5
+
+DEFAULT_QUEUE_DIR = Path(__file__).resolve().parent.parent / ".cache" / "eval_daemon"
+
+# 进度最多每隔多少秒写一次 sqlite
+PROGRESS_INTERVAL = 2.0
+
+
+@lru_cache(maxsize=None)
+def adapter_base(model_path):
+    """LoRA adapter 目录 -> base 模型路径；普通模型目录返回 None"""
+    cfg = Path(model_path) / "adapter_config.json"
+    if not cfg.is_file():
+        return None
+    with open(cfg, "r", encoding="utf-8") as f:
+        base = json.load(f).get("base_model_name_or_path")
+    if not base:
+        return None
+    if os.path.isdir(base):
+        return base
+    # 训练机上的路径：按目录名到同一个 models 目录下找
+    local = Path(model_path).parent / Path(base).name
+    return str(local) if local.is_dir() else base
+
+
+# ======================
+# 任务队列（sqlite）
+# ======================
+class JobQueue:
+    """线程安全；submit / status 可以在另一个进程里对同一个文件操作。"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " model TEXT NOT NULL, data_type TEXT NOT NULL, image_type TEXT NOT NULL,"
+                " priority INTEGER NOT NULL DEFAULT 0,"
+                " status TEXT NOT NULL DEFAULT 'pending',"
+                " submitted REAL, started REAL, finished REAL,"
+                " done INTEGER NOT NULL DEFAULT 0, total INTEGER,"
+                " error TEXT)"
+            )
+            self._conn.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cur = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cur
+
+    def submit(self, model, data_type, image_type="normal", priority=0):
+        """同一个 (model, data_type, image_type) 已在排队 / 运行时不重复提交（优先级取较大值），返回已有任务的 id"""
+        row = self._execute(
+            "SELECT id FROM jobs WHERE model=? AND data_type=? AND image_type=? AND status IN ('pending', 'running')",
+            (model, data_type, image_type),
+        ).fetchone()
+        if row is not None:
+            self._execute("UPDATE jobs SET priority=MAX(priority, ?) WHERE id=?", (priority, row["id"]))
+            return row["id"]
+        return self._execute(
+            "INSERT INTO jobs (model, data_type, image_type, priority, submitted) VALUES (?, ?, ?, ?, ?)",
+            (model, data_type, image_type, priority, time.time()),
+        ).lastrowid
+
+    def pending(self):
+        rows = self._execute("SELECT * FROM jobs WHERE status='pending' ORDER BY id").fetchall()
+        return [dict(r) for r in rows]
+
+    def rows(self, status=None):
+        if status:
+            rows = self._execute("SELECT * FROM jobs WHERE status=? ORDER BY id", (status,)).fetchall()
+        else:
+            rows = self._execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        return [dict(r) for r in rows]
+
+    def claim(self, job_id):
+        self._execute("UPDATE jobs SET status='running', started=?, error=NULL WHERE id=?", (time.time(), job_id))
+
+    def progress(self, job_id, done, total):
+        self._execute("UPDATE jobs SET done=?, total=? WHERE id=?", (done, total, job_id))
+
+    def finish(self, job_id, error=None):
+        self._execute(
+            "UPDATE jobs SET status=?, finished=?, error=? WHERE id=?",
+            ("failed" if error else "done", time.time(), error, job_id),
+        )
+
+    def requeue_running(self):
+        """上次进程没跑完的任务放回队列（样本级续跑由结果文件负责）"""
+        return self._execute("UPDATE jobs SET status='pending' WHERE status='running'").rowcount
+
+    def retry_failed(self):
+        return self._execute("UPDATE jobs SET status='pending', error=NULL WHERE status='failed'").rowcount
+
+    def counts(self):
+        rows = self._execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+
+# ======================
+# 调度：少换模型
+# ======================
+def plan_order(jobs, base_of, loaded_base=None, loaded_model=None):
+    """
+    jobs: pending 任务（dict，含 id / model / priority）
+    返回执行顺序：同一个 base 的任务连续，base 内同一个 checkpoint 连续。
+    排序键：优先级高的先跑；同优先级时已加载的 base / checkpoint 先跑，其余按最早提交。
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault(base_of(job["model"]), {}).setdefault(job["model"], []).append(job)
+
+    def rank(key, loaded, group_jobs):
+        return (-max(j["priority"] for j in group_jobs), key != loaded, min(j["id"] for j in group_jobs))
+
+    order = []
+    for base, models in sorted(
+        groups.items(), key=lambda kv: rank(kv[0], loaded_base, [j for js in kv[1].values() for j in js])
+    ):
+        for model, model_jobs in sorted(models.items(), key=lambda kv: rank(kv[0], loaded_model, kv[1])):
+            order.extend(sorted(model_jobs, key=lambda j: (-j["priority"], j["id"])))
+    return order
+
+
+def count_swaps(order, base_of, loaded_base=None, loaded_model=None):
+    """按给定顺序执行需要的 (base 加载次数, checkpoint 切换次数)"""
+    base_loads = model_switches = 0
+    for job in order:
+        base = base_of(job["model"])
+        if base != loaded_base:
+            base_loads += 1
+            loaded_base = base
+        if job["model"] != loaded_model:
+            model_switches += 1
+            loaded_model = job["model"]
+    return base_loads, model_switches
+
+
+# ======================
+# 常驻循环
+# ======================
+class EvalDaemon:
+    def __init__(self, queue, backend, poll_interval=10.0, exit_when_idle=False, policy="affinity"):
+        self.queue = queue
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.exit_when_idle = exit_when_idle
+        self.policy = policy
+        self.stats = {"jobs": 0, "failed": 0, "base_loads": 0}
+
+    def next_job(self, pending):
+        if self.policy == "fifo":
+            return pending[0]
+        return plan_order(pending, self.backend.base_of, self.backend.loaded_base, self.backend.loaded_model)[0]
+
+    def _progress_fn(self, job_id):
+        last = [0.0]
+
+        def progress(done, total):
+            now = time.perf_counter()
+            if done >= total or now - last[0] >= PROGRESS_INTERVAL:
+                last[0] = now
+                self.queue.progress(job_id, done, total)
+        return progress
+
+    def step(self):
+        """跑一个任务；队列空时返回 False"""
+        pending = self.queue.pending()
+        if not pending:
+            return False
+
+        job = self.next_job(pending)
+        base = self.backend.base_of(job["model"])
+        # 这个 base 上还有 adapter 要跑：加载时就打开 LoRA，避免之后为了 LoRA 再重载一次
+        enable_lora = self.backend.supports_lora and any(
+            self.backend.base_of(j["model"]) == base and j["model"] != base for j in pending
+        )
+        if base != self.backend.loaded_base:
+            self.stats["base_loads"] += 1
+
+        print(
+            f"[DAEMON] job {job['id']}: model={job['model']} data_type={job['data_type']} "
+            f"image_type={job['image_type']} (pending {len(pending) - 1})"
+        )
+        self.queue.claim(job["id"])
+        start = time.perf_counter()
+        try:
+            self.backend.load(job["model"], enable_lora=enable_lora)
+            self.backend.run(job, self._progress_fn(job["id"]))
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"[ERROR] job {job['id']} failed: {type(e).__name__}: {e}")
+            self.queue.finish(job["id"], error=f"{type(e).__name__}: {e}")
+        else:
+            self.queue.finish(job["id"])
+            print(f"[DAEMON] job {job['id']} done in {time.perf_counter() - start:.1f}s")
+        self.stats["jobs"] += 1
+        return True
+
+    def run(self):
+        requeued = self.queue.requeue_running()
+        if requeued:
+            print(f"[DAEMON] requeued {requeued} interrupted job(s)")
+        print(f"[DAEMON] serving queue {self.queue.path} (policy={self.policy})")
+        pending = self.queue.pending()
+        if pending:
+            base_of = self.backend.base_of
+            fifo_loads, _ = count_swaps(pending, base_of)
+            plan_loads, plan_switches = count_swaps(plan_order(pending, base_of), base_of)
+            print(
+                f"[DAEMON] {len(pending)} pending job(s): {plan_loads} base load(s), "
+                f"{plan_switches} checkpoint switch(es) (submission order: {fifo_loads} base loads)"
+            )
+        try:
+            while True:
+                if self.step():
+                    continue
+                if self.exit_when_idle:
+                    break
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print("[DAEMON] interrupted")
+        finally:
+            self.backend.release()
+        s = self.stats
+        print(f"[DAEMON] jobs={s['jobs']} failed={s['failed']} base_loads={s['base_loads']}")
+        return s
+
+
+# ======================
+# 假后端：模拟加载耗时
+# ======================
+class FakeBackend:
+    """
+    虚拟时钟（clock，秒）：加载 base 记 base_load，挂一个新 adapter 记 adapter_load，每条样本记 sample_time。
+    adapters: {checkpoint: base}；不在里面的 model 视为完整模型。
+    time_scale > 0 时按比例真的 sleep（方便在另一个 shell 里看 status）。
+    """
+
+    def __init__(self, adapters=None, base_load=90.0, adapter_load=3.0, sample_time=0.2, samples=200,
+                 supports_lora=True, time_scale=0.0, fail_models=()):
+        self.adapters = dict(adapters or {})
+        self.base_load = base_load
+        self.adapter_load = adapter_load
+        self.sample_time = sample_time
+        self.samples = samples
+        self.supports_lora = supports_lora
+        self.time_scale = time_scale
+        self.fail_models = set(fail_models)
+        self.loaded_base = None
+        self.loaded_model = None
+        self.lora_enabled = False
+        self.active_adapters = set()
+        self.clock = 0.0
+        self.events = []
+
+    def _spend(self, seconds):
+        self.clock += seconds
+        if self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def base_of(self, model):
+        if not self.supports_lora:
+            return model
+        return self.adapters.get(model, model)
+
+    def load(self, model, enable_lora=False):
+        base = self.base_of(model)
+        is_adapter = base != model
+        if base != self.loaded_base or (is_adapter and not self.lora_enabled):
+            self._spend(self.base_load)
+            self.events.append(("load_base", base))
+            self.loaded_base = base
+            self.lora_enabled = enable_lora or is_adapter
+            self.active_adapters = set()
+        if is_adapter and model not in self.active_adapters:
+            self._spend(self.adapter_load)
+            self.events.append(("load_adapter", model))
+            self.active_adapters.add(model)
+        self.loaded_model = model
+
+    def run(self, job, progress):
+        if job["model"] in self.fail_models:
+            raise RuntimeError(f"simulated failure for {job['model']}")
+        for i in range(self.samples):
+            self._spend(self.sample_time)
+            progress(i + 1, self.samples)
+        self.events.append(("run", job["model"], job["data_type"]))
+
+    def release(self):
+        self.loaded_base = self.loaded_model = None
+        self.active_adapters = set()
+
+
+# ======================
+# CLI
+# ======================
+def expand_models(patterns, models_dir):
+    """支持通配符（按 models_dir 下的目录名匹配）"""
+    models = []
+    for pattern in patterns:
+        if any(ch in pattern for ch in "*?[") and models_dir and os.path.isdir(models_dir):
+            matched = sorted(fnmatch.filter(os.listdir(models_dir), pattern))
+            if not matched:
+                print(f"[WARN] no model matches {pattern} in {models_dir}")
+            models.extend(matched)
+        else:
+            models.append(pattern)
+    return list(dict.fromkeys(models))
+
+
+def print_status(queue):
+    rows = queue.rows()
+    counts = queue.counts()
+    print(f"[STATUS] {queue.path}: " + " ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+    now = time.time()
+    for r in rows:
+        if r["status"] == "done" and r["error"] is None and r["finished"] and now - r["finished"] > 86400:
+            continue  # 一天前完成的不再列出
+        total = r["total"] or 0
+        pct = f"{100 * r['done'] / total:5.1f}%" if total else "    -"
+        elapsed = ""
+        if r["started"]:
+            elapsed = f" {((r['finished'] or now) - r['started']):.0f}s"
+        err = f"  {r['error']}" if r["error"] else ""
+        print(
+            f"  #{r['id']:<4} {r['status']:<8} {pct} {r['done']}/{total or '?'}{elapsed}  "
+            f"{r['model']} / {r['data_type']} / {r['image_type']}{err}"
+        )
+
+
+def simulate(args):
+    adapters, models = {}, []
+    for b in range(args.bases):
+        base = f"base{b}"
+        if args.adapters:
+            for a in range(args.adapters):
+                ckpt = f"{base}_ckpt{a}"
+                adapters[ckpt] = base
+                models.append(ckpt)
+        else:
+            models.append(base)
+    data_types = [f"data{i}" for i in range(args.data_types)]
+
+    results = {}
+    for policy in ("fifo", "affinity"):
+        queue = JobQueue(":memory:")
+        # 按 shell 循环常见的顺序提交：外层数据集、内层模型（对 FIFO 最不利）
+        for data_type in data_types:
+            for model in models:
+                queue.submit(model, data_type)
+        backend = FakeBackend(
+            adapters, base_load=args.base_load, adapter_load=args.adapter_load,
+            sample_time=args.sample_time, samples=args.samples, supports_lora=not args.no_lora,
+        )
+        stats = EvalDaemon(queue, backend, exit_when_idle=True, policy=policy).run()
+        loads = sum(1 for e in backend.events if e[0] == "load_base")
+        results[policy] = (backend.clock, loads, stats)
+        print(f"[SIM] policy={policy:<8} jobs={stats['jobs']} base_loads={loads} virtual_time={backend.clock / 3600:.2f}h")
+
+    fifo, aff = results["fifo"], results["affinity"]
+    print(f"[SIM] affinity saves {(fifo[0] - aff[0]) / 3600:.2f}h ({fifo[1]} -> {aff[1]} base loads)")
+    expected = args.bases if not args.no_lora or not args.adapters else len(models)
+    if aff[1] != expected or aff[2]["jobs"] != len(models) * len(data_types):
+        print(f"[ERROR] expected {expected} base loads and {len(models) * len(data_types)} jobs")
+        sys.exit(1)
+
+
+def daemon_main(make_backend=None, queue_name="eval", models_dir=None):
+    """
+    make_backend: () -> 后端；queue_name: 默认队列文件名（<repo>/.cache/eval_daemon/<name>.sqlite）
+    """
+    parser = argparse.ArgumentParser(description="Persistent multi-model evaluation daemon with a job queue")
+    parser.add_argument("--queue", type=str, default=str(DEFAULT_QUEUE_DIR / f"{queue_name}.sqlite"))
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("submit", help="提交任务（models × data_types）")
+    p.add_argument("--models", nargs="+", required=True, help="模型目录名，可用通配符，例如 'Qwen3_vl_4B_TOTAL_*_step_200'")
+    p.add_argument("--data_types", nargs="+", required=True)
+    p.add_argument("--image_type", default="normal")
+    p.add_argument("--priority", type=int, default=0, help="越大越先跑（高于少换模型）")
+
+    sub.add_parser("status", help="查看队列与进度")
+    sub.add_parser("retry", help="把失败的任务放回队列")
+
+    if make_backend is not None:
+        p = sub.add_parser("serve", help="常驻运行，消费队列")
+        p.add_argument("--poll_interval", type=float, default=10.0, help="队列空时多久查一次新任务（秒）")
+        p.add_argument("--exit_when_idle", action="store_true", help="队列跑空后退出")
+        p.add_argument("--policy", choices=["affinity", "fifo"], default="affinity")
+
+    p = sub.add_parser("simulate", help="用假后端验证调度策略")
+    p.add_argument("--bases", type=int, default=3)
+    p.add_argument("--adapters", type=int, default=4, help="每个 base 上的 LoRA checkpoint 数（0 表示完整模型）")
+    p.add_argument("--data_types", type=int, default=5)
+    p.add_argument("--base_load", type=float, default=90.0)
+    p.add_argument("--adapter_load", type=float, default=3.0)
+    p.add_argument("--sample_time", type=float, default=0.2)
+    p.add_argument("--samples", type=int, default=200)
+    p.add_argument("--no_lora", action="store_true", help="模拟不支持 LoRA 的后端")
+    args = parser.parse_args()
+
+    if args.cmd == "simulate":
+        simulate(args)
+        return
+
+    queue = JobQueue(args.queue)
+    if args.cmd == "submit":
+        models = expand_models(args.models, models_dir)
+        ids = [
+            queue.submit(model, data_type, args.image_type, args.priority)
+            for model in models for data_type in args.data_types
+        ]
+        print(f"[SUBMIT] {len(ids)} job(s) ({len(models)} model(s) × {len(args.data_types)} data type(s)) -> {args.queue}")
+    elif args.cmd == "status":
+        print_status(queue)
+    elif args.cmd == "retry":
+        print(f"[RETRY] {queue.retry_failed()} job(s) back to pending")
+    elif args.cmd == "serve":
+        EvalDaemon(queue, make_backend(), args.poll_interval, args.exit_when_idle, args.policy).run()
+
+
+if __name__ == "__main__":
+    daemon_main()
@@ -0,0 +1,338 @@
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from oddgrid_common.batching import plan_batches
+
+# ======================
+# Transformers 兜底推理（vLLM 0.8.x 不支持的模型：Qwen3.5、Gemma-4）
+# ======================
+# 接口与 vLLM 的 LLM.chat 一致：chat(messages, sampling_params, **kwargs)，messages 是一条或一组 conversation，
+# 返回 [SimpleNamespace(outputs=[SimpleNamespace(text=..., token_ids=...)])]，顺序与输入一致（token_ids 去掉了尾部 padding）。
+#
+# 一组 conversation 按条数（max_batch_size）和图片数（max_batch_images）预算分组，每组：
+#   左 padding -> 一次 apply_chat_template -> 一次 generate（贪心）-> 按样本切出新生成的 token 解码
+#   模型支持静态 KV cache 时用 cache_implementation="static"；generate 报错时退回动态 cache
+#   SamplingParams.logits_processors（vLLM 风格 (已生成 token, logits)，如 BoxedStopLogitsProcessor）按行套到 HF generate 上
+# HF 没有 paged attention，整组按最长的样本 padding，所以图片预算比 vLLM 的小。
+#
+# 左 padding + attention_mask 下贪心结果应与逐条生成一致，CPU 上用随机初始化的小模型自测
+# （默认在临时目录里现场构建一个 2 层的 Qwen2-VL：BPE 分词器 + Qwen2-VL chat template + mrope，不需要联网）：
+#   python oddgrid_common/hf_fallback.py selftest
+#   python oddgrid_common/hf_fallback.py selftest --static_cache --n 24
+#   python oddgrid_common/hf_fallback.py selftest --model hf-internal-testing/tiny-random-Qwen2VLForConditionalGeneration
+# 已验证：transformers 4.57.1 / 5.20.0（CPU），动态与静态 KV cache 下逐条与分组输出逐字一致。
+
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_MAX_BATCH_IMAGES = 16
+
+_IMAGE_TYPES = ("image_pil", "image_url", "image")
+
+
+def to_hf_messages(messages):
+    """vLLM 的 image_pil / image_url 片段 -> transformers chat template 的 image 片段"""
+    converted = []
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, list):
+            parts = []
+            for part in content:
+                if part.get("type") == "image_pil":
+                    part = {"type": "image", "image": part["image_pil"]}
+                elif part.get("type") == "image_url":
+                    # data:image/png;base64,... 由 transformers 的 load_image 解码
+                    part = {"type": "image", "url": part["image_url"]["url"]}
+                parts.append(part)
+            content = parts
+        converted.append({**msg, "content": content})
+    return converted
+
+
+def count_images(conversation):
+    return sum(
+        1
+        for msg in conversation
+        if isinstance(msg.get("content"), list)
+        for part in msg["content"]
+        if part.get("type") in _IMAGE_TYPES
+    )
+
+
+class RowLogitsProcessor:
+    """vLLM 风格的 logits processor（每条序列单独调用）-> HF generate 的 logits_processor（整批调用）"""
+
+    def __init__(self, processors, prompt_len):
+        self.processors = processors
+        self.prompt_len = prompt_len
+
+    def __call__(self, input_ids, scores):
+        for row in range(scores.shape[0]):
+            generated = input_ids[row, self.prompt_len:].tolist()
+            for processor in self.processors:
+                scores[row] = processor(generated, scores[row])
+        return scores
+
+
+class TransformersChatModel:
+    def __init__(self, model_path, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_batch_images=DEFAULT_MAX_BATCH_IMAGES,
+                 static_cache=None, torch_dtype=torch.bfloat16, device_map="auto", random_init=False):
+        from transformers import AutoConfig, AutoModelForImageTextToText, AutoProcessor
+
+        self.processor = AutoProcessor.from_pretrained(
+            model_path,
+            trust_remote_code=True,
+        )
+        if random_init:
+            # 自测用：只取结构，不加载权重
+            config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
+            self.model = AutoModelForImageTextToText.from_config(config, trust_remote_code=True, torch_dtype=torch_dtype)
+        else:
+            self.model = AutoModelForImageTextToText.from_pretrained(
+                model_path,
+                trust_remote_code=True,
+                torch_dtype=torch_dtype,
+                device_map=device_map,
+            )
+        self.model.eval()
+        self.get_tokenizer().padding_side = "left"
+
+        self.max_batch_size = max_batch_size
+        self.max_batch_images = max_batch_images
+        if static_cache is None:
+            static_cache = bool(
+                getattr(self.model, "_supports_static_cache", False)
+                or getattr(self.model, "_can_compile_fullgraph", False)
+            )
+        self.static_cache = static_cache
+        self.stats = {"requests": 0, "batches": 0, "generate_time": 0.0}
+        self._warned_lora = False
+
+    def get_tokenizer(self):
+        return getattr(self.processor, "tokenizer", self.processor)
+
+    def chat(self, messages, sampling_params, **kwargs):
+        conversations = messages if messages and isinstance(messages[0], list) else [messages]
+        if kwargs.pop("lora_request", None) is not None and not self._warned_lora:
+            print("[WARN] Transformers fallback ignores lora_request; merge the adapter before evaluating")
+            self._warned_lora = True
+        template_kwargs = kwargs.pop("chat_template_kwargs", {})
+        kwargs.update(template_kwargs)
+
+        items = [{"index": i, "num_images": count_images(conv)} for i, conv in enumerate(conversations)]
+        completions = [None] * len(conversations)
+        for batch in plan_batches(items, self.max_batch_size, self.max_batch_images, max_prompt_chars=float("inf")):
+            outputs = self._generate([conversations[item["index"]] for item in batch], sampling_params, kwargs)
+            for item, completion in zip(batch, outputs):
+                completions[item["index"]] = completion
+        return [SimpleNamespace(outputs=[completion]) for completion in completions]
+
+    def _generate(self, conversations, sampling_params, template_kwargs):
+        inputs = self.processor.apply_chat_template(
+            [to_hf_messages(conv) for conv in conversations],
+            add_generation_prompt=True,
+            tokenize=True,
+            return_dict=True,
+            return_tensors="pt",
+            padding=True,
+            **template_kwargs,
+        )
+        inputs = {
+            key: value.to(self.model.device) if hasattr(value, "to") else value
+            for key, value in inputs.items()
+        }
+        input_len = inputs["input_ids"].shape[-1]
+
+        tokenizer = self.get_tokenizer()
+        gen_kwargs = {"do_sample": False, "max_new_tokens": sampling_params.max_tokens}
+        if tokenizer.pad_token_id is None:
+            gen_kwargs["pad_token_id"] = tokenizer.eos_token_id
+        processors = getattr(sampling_params, "logits_processors", None)
+        if processors:
+            from transformers import LogitsProcessorList
+            gen_kwargs["logits_processor"] = LogitsProcessorList([RowLogitsProcessor(processors, input_len)])
+
+        start = time.perf_counter()
+        with torch.inference_mode():
+            if self.static_cache:
+                try:
+                    generated = self.model.generate(**inputs, **gen_kwargs, cache_implementation="static")
+                except (ValueError, TypeError, NotImplementedError) as e:
+                    print(f"[WARN] static KV cache unavailable ({type(e).__name__}: {e}); using dynamic cache")
+                    self.static_cache = False
+            if not self.static_cache:
+                generated = self.model.generate(**inputs, **gen_kwargs)
+        self.stats["generate_time"] += time.perf_counter() - start
+        self.stats["requests"] += len(conversations)
+        self.stats["batches"] += 1
+
+        new_tokens = generated[:, input_len:]
+        texts = self.processor.batch_decode(new_tokens, skip_special_tokens=True)
+        pad_id = gen_kwargs.get("pad_token_id", tokenizer.pad_token_id)
+        completions = []
+        for text, row in zip(texts, new_tokens.tolist()):
+            while row and row[-1] == pad_id:   # 先结束的样本后面补的 padding
+                row.pop()
+            completions.append(SimpleNamespace(text=text, token_ids=row))
+        return completions
+
+    def report(self, prefix="[HF]"):
+        s = self.stats
+        avg = s["requests"] / s["batches"] if s["batches"] else 0.0
+        print(
+            f"{prefix} requests={s['requests']} batches={s['batches']} avg_batch={avg:.1f} "
+            f"generate_time={s['generate_time']:.2f}s static_cache={self.static_cache}"
+        )
+
+
+# ======================
+# CLI: 逐条 vs 分组 一致性自测（CPU、随机初始化）
+# ======================
+def _selftest_conversations(n, seed):
+    import random
+    from PIL import Image
+
+    rng = random.Random(seed)
+    conversations = []
+    for i in range(n):
+        content = []
+        for _ in range(rng.randint(1, 3)):
+            size = rng.choice([28, 56, 84])
+            pixels = bytes(rng.getrandbits(8) for _ in range(size * size * 3))
+            content.append({"type": "image_pil", "image_pil": Image.frombytes("RGB", (size, size), pixels)})
+        words = " ".join(rng.choice(["grid", "odd", "icon", "row", "column", "find"]) for _ in range(rng.randint(3, 40)))
+        content.append({"type": "text", "text": f"Sample {i}: {words}"})
+        conversations.append([{"role": "user", "content": content}])
+    return conversations
+
+
+_TINY_SPECIAL_TOKENS = ["<|endoftext|>", "<|im_start|>", "<|im_end|>", "<|vision_start|>", "<|vision_end|>",
+                        "<|image_pad|>", "<|video_pad|>", "<|vision_pad|>"]
+_TINY_CHAT_TEMPLATE = (
+    "{% for message in messages %}"
+    "{% if loop.first and message['role'] != 'system' %}<|im_start|>system\nYou are a helpful assistant.<|im_end|>\n{% endif %}"
+    "<|im_start|>{{ message['role'] }}\n"
+    "{% if message['content'] is string %}{{ message['content'] }}<|im_end|>\n"
+    "{% else %}{% for content in message['content'] %}"
+    "{% if content['type'] == 'image' or 'image' in content or 'image_url' in content %}"
+    "<|vision_start|><|image_pad|><|vision_end|>"
+    "{% elif 'text' in content %}{{ content['text'] }}{% endif %}{% endfor %}<|im_end|>\n{% endif %}{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+
+
+def build_tiny_qwen2vl(out_dir):
+    """
+    离线构建自测用的小 Qwen2-VL（只有 config + processor，权重由 random_init 随机初始化）：
+    400 词的 byte-level BPE、2 层 64 维文本塔（mrope_section 2/3/3）、2 层视觉塔，图片 28~84 像素。
+    """
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import Qwen2TokenizerFast, Qwen2VLConfig, Qwen2VLImageProcessor, Qwen2VLProcessor
+
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    corpus = ["Sample grid odd icon row column find system user assistant You are a helpful assistant. 0123456789 (1,2)"]
+    bpe.train_from_iterator(corpus * 50, trainers.BpeTrainer(
+        vocab_size=400, special_tokens=_TINY_SPECIAL_TOKENS, initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    ))
+    tokenizer = Qwen2TokenizerFast(tokenizer_object=bpe, eos_token="<|im_end|>", pad_token="<|endoftext|>",
+                                   unk_token=None, bos_token=None)
+    tokenizer.add_special_tokens({"additional_special_tokens": _TINY_SPECIAL_TOKENS[1:]})
+
+    processor_kwargs = {
+        "image_processor": Qwen2VLImageProcessor(min_pixels=28 * 28, max_pixels=84 * 84),
+        "tokenizer": tokenizer,
+        "chat_template": _TINY_CHAT_TEMPLATE,
+    }
+    try:
+        from transformers import Qwen2VLVideoProcessor   # 新版 processor 必须带 video_processor
+        processor_kwargs["video_processor"] = Qwen2VLVideoProcessor()
+    except ImportError:
+        pass
+    Qwen2VLProcessor(**processor_kwargs).save_pretrained(out_dir)
+
+    ids = {token: tokenizer.convert_tokens_to_ids(token) for token in _TINY_SPECIAL_TOKENS}
+    text = {
+        "vocab_size": len(tokenizer), "hidden_size": 64, "intermediate_size": 128, "num_hidden_layers": 2,
+        "num_attention_heads": 4, "num_key_value_heads": 2, "max_position_embeddings": 4096,
+        "rope_scaling": {"type": "mrope", "mrope_section": [2, 3, 3]}, "rope_theta": 10000.0,
+        "eos_token_id": ids["<|im_end|>"], "pad_token_id": ids["<|endoftext|>"], "bos_token_id": ids["<|endoftext|>"],
+    }
+    vision = {
+        "depth": 2, "embed_dim": 32, "hidden_size": 64, "num_heads": 2, "mlp_ratio": 2, "patch_size": 14,
+        "spatial_merge_size": 2, "temporal_patch_size": 2, "in_channels": 3,
+    }
+    config = Qwen2VLConfig(
+        text_config=text, vision_config=vision, image_token_id=ids["<|image_pad|>"], video_token_id=ids["<|video_pad|>"],
+        vision_start_token_id=ids["<|vision_start|>"], vision_end_token_id=ids["<|vision_end|>"], **text,
+    )
+    config.architectures = ["Qwen2VLForConditionalGeneration"]
+    config.save_pretrained(out_dir)
+    return out_dir
+
+
+def selftest(args):
+    import tempfile
+
+    torch.manual_seed(args.seed)
+    tmp_dir = None
+    model_path = args.model
+    if model_path is None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="tiny_qwen2vl_")
+        model_path = build_tiny_qwen2vl(tmp_dir.name)
+    model = TransformersChatModel(
+        model_path,
+        max_batch_size=args.max_batch_size,
+        max_batch_images=args.max_batch_images,
+        static_cache=None if args.static_cache else False,
+        torch_dtype=torch.float32,
+        random_init=True,
+    )
+    sampling_params = SimpleNamespace(max_tokens=args.max_new_tokens, logits_processors=None)
+    conversations = _selftest_conversations(args.n, args.seed)
+
+    start = time.perf_counter()
+    single = [model.chat(conv, sampling_params)[0].outputs[0].text for conv in conversations]
+    single_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batched = [out.outputs[0].text for out in model.chat(conversations, sampling_params)]
+    batched_time = time.perf_counter() - start
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+    mismatches = [i for i, (a, b) in enumerate(zip(single, batched)) if a != b]
+    model.report()
+    print(f"[SELFTEST] single={single_time:.2f}s batched={batched_time:.2f}s, "
+          f"{len(conversations) - len(mismatches)}/{len(conversations)} identical "
+          f"({sum(bool(text) for text in single)} non-empty)")
+    for i in mismatches[:5]:
+        print(f"[SELFTEST]   #{i} single={single[i]!r}")
+        print(f"[SELFTEST]   #{i} batch ={batched[i]!r}")
+    if mismatches:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched Transformers fallback")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("selftest", help="逐条与分组生成的一致性（随机初始化的小模型，CPU）")
+    p.add_argument("--model", default=None,
+                   help="只用它的 config 与 processor，权重随机初始化；默认离线构建一个小 Qwen2-VL")
+    p.add_argument("--n", type=int, default=12)
+    p.add_argument("--max_new_tokens", type=int, default=16)
+    p.add_argument("--max_batch_size", type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    p.add_argument("--max_batch_images", type=int, default=DEFAULT_MAX_BATCH_IMAGES)
+    p.add_argument("--static_cache", action="store_true", help="同时测静态 KV cache")
+    p.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    selftest(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import base64
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+# ======================
+# 图片载入 / base64 缓存
+# ======================
+# 直连 vLLM：load_pil_image 只解码一次，直接把 PIL 图交给 llm.chat，不再 PNG 往返。
+# HTTP 路径：Base64LRUCache 按 (abs_path, mtime_ns) 缓存 base64，
+#            示例图、重复图只编码一次；prefetch 在后台线程提前编码后面几条样本的图片。
+
+
+def load_pil_image(path):
+    """解码图片；RGB / RGBA 以外的模式转成 RGB（与原来的 PNG 编码前处理一致）。"""
+    with Image.open(path) as img:
+        if img.mode not in ("RGB", "RGBA"):
+            return img.convert("RGB")
+        img.load()
+        return img
+
+
+def raw_b64(path):
+    """原始文件字节直接 base64，不解码不重编码。"""
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+
+def pil_png_b64(img):
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+def png_b64(path):
+    """解码后重编码为 PNG 再 base64（Ablation 原来的 encode_image）。"""
+    return pil_png_b64(load_pil_image(path))
+
+
+class Base64LRUCache:
+    """
+    线程安全的 LRU，按条数与总字节数双重上限淘汰。
+    文件被改写后 mtime 变化，旧条目自然失效。
+    """
+
+    def __init__(self, encode_fn=raw_b64, max_items=256, max_bytes=256 << 20, prefetch_workers=1):
+        self.encode_fn = encode_fn
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.prefetch_workers = prefetch_workers
+
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self.stats = {"hit": 0, "prefetched": 0, "miss": 0, "evicted": 0}
+
+    @staticmethod
+    def _key(path):
+        path = os.path.abspath(path)
+        return path, os.stat(path).st_mtime_ns
+
+    def _put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                return
+            self._data[key] = value
+            self._bytes += len(value)
+            while self._data and (len(self._data) > self.max_items or self._bytes > self.max_bytes):
+                _, old = self._data.popitem(last=False)
+                self._bytes -= len(old)
+                self.stats["evicted"] += 1
+
+    def get(self, path):
+        key = self._key(path)
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.stats["hit"] += 1
+                return self._data[key]
+            future = self._inflight.get(key)
+
+        if future is not None:
+            value = future.result()
+            if value is not None:
+                self.stats["prefetched"] += 1
+                return value
+
+        value = self.encode_fn(path)
+        self.stats["miss"] += 1
+        self._put(key, value)
+        return value
+
+    def _load(self, key, path):
+        try:
+            value = self.encode_fn(path)
+            self._put(key, value)
+            return value
+        except Exception:
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def prefetch(self, paths):
+        """后台编码 paths 中还没缓存的图片，不阻塞调用方。"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.prefetch_workers)
+
+        for path in paths:
+            if not path:
+                continue
+            try:
+                key = self._key(path)
+            except OSError:
+                continue
+            with self._lock:
+                if key in self._data or key in self._inflight:
+                    continue
+                self._inflight[key] = self._executor.submit(self._load, key, path)
+
+    def report(self, prefix="[B64CACHE]"):
+        s = self.stats
+        print(
+            f"{prefix} hit={s['hit']} prefetched={s['prefetched']} miss={s['miss']} "
+            f"evicted={s['evicted']} cached={len(self._data)} ({self._bytes / 2**20:.1f} MiB)"
+        )
+
+
+def iter_with_prefetch(items, paths_of, cache, lookahead=2):
+    """
+    顺序产出 items；处理第 i 条时后台已经在编码第 i+1 .. i+lookahead 条的图片。
+    paths_of: item -> 图片路径列表
+    """
+    items = list(items)
+    cache.prefetch(p for item in items[:lookahead + 1] for p in paths_of(item))
+    for i, item in enumerate(items):
+        if i + lookahead + 1 < len(items):
+            cache.prefetch(paths_of(items[i + lookahead + 1]))
+        yield item
@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# ======================
+# 入口模块 import 耗时检查
+# ======================
+# 评测入口只在第一次推理时 import vLLM / torch（vllm_infer_dire.vllm_backend），
+# --dry_run、续跑检查、import run_vllm_http 的脚本都应在 1 秒内启动。
+# 这里在干净的子进程里逐个 import 入口模块（cwd 是模块所在目录，与平时运行一致），检查：
+#   - import 耗时不超过 budget 秒
+#   - 没有把重依赖（torch / vllm / transformers / matplotlib）带进来
+# 改了 import 之后跑一遍，失败时退出码 1，并打印 -X importtime 里累计耗时最多的几个模块：
+#   python oddgrid_common/import_check.py
+#   python oddgrid_common/import_check.py --budget 0.5 IOL_type/eval/vllm_infer_dire.py
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+HEAVY_MODULES = ("torch", "vllm", "transformers", "matplotlib")
+DEFAULT_BUDGET = 1.0
+
+ENTRY_POINTS = [
+    f"{task}/eval/{module}.py"
+    for task in ("IOL_type", "SOI_type")
+    for module in (
+        "vllm_infer_dire",
+        "eval_rl_models_persistent",
+        "eval_daemon",
+        "checkpoint_screening",
+        "token_budget_sweep",
+        "cal_total_em_f1",
+    )
+]
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def parse_importtime(stderr, top=5):
+    """-X importtime 输出 -> 累计耗时（秒）最多的 top 个 (秒, 模块)"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def check_module(path, budget=DEFAULT_BUDGET, heavy=HEAVY_MODULES):
+    """返回 {"path", "ok", "elapsed", "heavy", "slowest", "error"}"""
+    path = os.path.join(ROOT_DIR, path) if not os.path.isabs(path) else path
+    module = os.path.splitext(os.path.basename(path))[0]
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD.format(module=module, heavy=tuple(heavy))],
+        cwd=os.path.dirname(path),
+        capture_output=True,
+        text=True,
+    )
+    result = {"path": os.path.relpath(path, ROOT_DIR), "elapsed": None, "heavy": [], "error": None,
+              "slowest": parse_importtime(proc.stderr)}
+    if proc.returncode != 0:
+        result["error"] = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"
+    else:
+        result.update(json.loads(proc.stdout.strip().splitlines()[-1]))
+    result["ok"] = result["error"] is None and not result["heavy"] and result["elapsed"] <= budget
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check import time of the eval entry points")
+    parser.add_argument("paths", nargs="*", default=ENTRY_POINTS, help="默认检查 IOL / SOI 的评测入口")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help="每个模块 import 耗时上限（秒）")
+    args = parser.parse_args()
+
+    failed = 0
+    for path in args.paths:
+        r = check_module(path, args.budget)
+        if r["error"]:
+            status = f"ERROR {r['error']}"
+        else:
+            status = f"{r['elapsed']:.3f}s" + (f" heavy={','.join(r['heavy'])}" if r["heavy"] else "")
+        print(f"[IMPORT] {'ok  ' if r['ok'] else 'FAIL'} {r['path']:<45} {status}")
+        if not r["ok"]:
+            failed += 1
+            for seconds, name in r["slowest"]:
+                print(f"[IMPORT]        {seconds:.3f}s {name}")
+
+    print(f"[IMPORT] {len(args.paths) - failed}/{len(args.paths)} within {args.budget:g}s")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# ======================
+# 推理结果缓存（内容寻址）
+# ======================
+# key = sha256(model, 采样参数, 规范化后的 messages)
+#   messages 里的图片替换成内容哈希：
+#     data URL（base64）-> sha256(url)
+#     image_pil         -> sha256(mode, size, 像素)
+# 所以换了结果文件名、换了脚本，只要模型 / 参数 / 输入一样就直接命中。
+#
+# 存储：sqlite（默认 <repo>/.cache/responses.sqlite），只缓存成功的回答。
+# 关闭：--no_cache 或环境变量 ODDGRID_NO_RESPONSE_CACHE=1
+# Effective/ 的效率脚本默认不用缓存（命中时时延字段是旧值），需要时加 --use_cache
+# 过期：ttl 秒（None 表示不过期）
+
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent.parent / ".cache" / "responses.sqlite"
+
+# 不影响输出的请求字段
+_NON_SAMPLING_KEYS = {"model", "messages", "stream", "stream_options"}
+
+
+def _image_digest(part):
+    if part.get("type") == "image_pil":
+        img = part["image_pil"]
+        h = hashlib.sha256(f"{img.mode}:{img.size}".encode("utf-8"))
+        h.update(img.tobytes())
+        return "pil:" + h.hexdigest()
+    url = (part.get("image_url") or {}).get("url", "")
+    return "url:" + hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def canonical_messages(messages):
+    out = []
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, list):
+            content = [
+                {"type": "image", "digest": _image_digest(part)}
+                if part.get("type") in ("image_url", "image_pil") else part
+                for part in content
+            ]
+        out.append({**msg, "content": content})
+    return out
+
+
+def request_key(model, messages, sampling):
+    blob = json.dumps(
+        {"model": model, "sampling": sampling, "messages": canonical_messages(messages)},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def payload_key(payload):
+    """OpenAI chat payload -> key（HTTP 路径用）"""
+    sampling = {k: v for k, v in payload.items() if k not in _NON_SAMPLING_KEYS}
+    return request_key(payload.get("model"), payload.get("messages", []), sampling)
+
+
+class ResponseCache:
+    """线程安全；enabled=False 时 get 永远 miss、put 不写。"""
+
+    def __init__(self, path=None, ttl=None, enabled=True):
+        self.enabled = enabled and os.environ.get("ODDGRID_NO_RESPONSE_CACHE") != "1"
+        self.ttl = ttl
+        self.stats = {"hit": 0, "miss": 0, "expired": 0, "stored": 0}
+        self._conn = None
+        if not self.enabled:
+            return
+
+        self.path = Path(path or os.environ.get("ODDGRID_RESPONSE_CACHE") or DEFAULT_CACHE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, created_at REAL, value TEXT)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["miss"] += 1
+                return None
+            if self.ttl is not None and time.time() - row[0] > self.ttl:
+                self.stats["expired"] += 1
+                self.stats["miss"] += 1
+                return None
+            self.stats["hit"] += 1
+        return json.loads(row[1])
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (key, time.time(), json.dumps(value, ensure_ascii=False)),
+            )
+            self._conn.commit()
+            self.stats["stored"] += 1
+
+    def report(self, prefix="[RCACHE]"):
+        if not self.enabled:
+            print(f"{prefix} disabled")
+            return
+        s = self.stats
+        total = s["hit"] + s["miss"]
+        rate = s["hit"] / total if total else 0.0
+        print(
+            f"{prefix} hit={s['hit']} miss={s['miss']} (expired={s['expired']}) "
+            f"stored={s['stored']} hit_rate={rate:.1%} | {self.path}"
+        )
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
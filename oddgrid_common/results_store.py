@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from oddgrid_common.stream_merge import iter_json_records
+
+# ======================
+# 追加写结果存储
+# ======================
+# 推理时每条结果只追加一行到 <save>.jsonl（flush 每条，fsync 按批），
+# 不再每条都 读整个 JSON -> append -> indent=4 重写。
+# 中断时最多丢掉最后一行未写完的记录，重跑时自动截掉。
+#
+# cal_total_em_f1.py / report_generation/*.py / cal_eff.py 仍然读 <save>.json，
+# 由 compact_results（或本文件的 compact 命令）在结束时一次性导出。
+
+
+def jsonl_path_for(save_json_path):
+    return Path(save_json_path).with_suffix(".jsonl")
+
+
+def _iter_jsonl(jsonl_path):
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # 中断留下的半行
+                print(f"[WARN] Skip broken line in {jsonl_path}")
+
+
+def iter_results(save_json_path):
+    """优先读 .jsonl；只有旧的 list-JSON 时读旧文件。"""
+    jsonl_path = jsonl_path_for(save_json_path)
+    if jsonl_path.exists():
+        yield from _iter_jsonl(jsonl_path)
+    elif Path(save_json_path).exists():
+        yield from iter_json_records(save_json_path)
+
+
+def load_processed_keys(save_json_path, key="id"):
+    """流式构建已处理集合（断点续跑用）。"""
+    return {item[key] for item in iter_results(save_json_path) if key in item}
+
+
+def _repair_tail(jsonl_path):
+    """文件不是以换行结尾时，截掉最后一行残缺记录。"""
+    with open(jsonl_path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+
+        pos = size
+        while pos > 0:
+            step = min(1 << 16, pos)
+            pos -= step
+            f.seek(pos)
+            nl = f.read(step).rfind(b"\n")
+            if nl >= 0:
+                f.truncate(pos + nl + 1)
+                break
+        else:
+            f.truncate(0)
+    print(f"[WARN] Truncated incomplete last record in {jsonl_path}")
+
+
+class ResultsWriter:
+    """
+    with ResultsWriter(save_json_path) as writer:
+        writer.write(save_item)
+
+    fsync_every / fsync_interval：累计条数或距上次 fsync 的秒数，任一达到就 fsync。
+    第一次使用时如果只有旧的 list-JSON，先把旧结果转成 JSONL，保证续跑不丢。
+    """
+
+    def __init__(self, save_json_path, fsync_every=32, fsync_interval=5.0):
+        self.save_json_path = Path(save_json_path)
+        self.jsonl_path = jsonl_path_for(save_json_path)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.count = 0
+
+        self.jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.jsonl_path.exists():
+            _repair_tail(self.jsonl_path)
+        elif self.save_json_path.exists():
+            n = self._seed_from_legacy()
+            print(f"[INFO] Converted {n} legacy results -> {self.jsonl_path}")
+
+        self._f = open(self.jsonl_path, "ab")
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _seed_from_legacy(self):
+        tmp_path = self.jsonl_path.with_suffix(".jsonl.tmp")
+        n = 0
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            for record in iter_json_records(self.save_json_path):
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                n += 1
+        os.replace(tmp_path, self.jsonl_path)
+        return n
+
+    def write(self, record):
+        self._f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._f.flush()
+        self.count += 1
+        self._pending += 1
+
+        if (self._pending >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        if self._pending:
+            os.fsync(self._f.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._f.closed:
+            return
+        self.sync()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def header_path_for(save_json_path):
+    # 不用 .json 后缀：各汇总脚本按 *.json 扫描结果目录
+    return Path(save_json_path).with_suffix(".header")
+
+
+def read_header(save_json_path):
+    path = header_path_for(save_json_path)
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def update_header(save_json_path, **sections):
+    """
+    结果文件的 header（<save>.header，JSON）：整次运行的元信息，按 section 合并更新，值为 None 时删除该 section。
+    list-JSON 本身保持纯样本列表，下游脚本不受影响。
+    """
+    header = read_header(save_json_path)
+    for name, value in sections.items():
+        if value is None:
+            header.pop(name, None)
+        else:
+            header[name] = value
+    path = header_path_for(save_json_path)
+    if not header:
+        if path.exists():
+            path.unlink()
+        return header
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(header, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return header
+
+
+def compact_results(save_json_path, key="id", indent=4):
+    """
+    <save>.jsonl -> <save>.json（旧格式 list-JSON，indent=4）。
+    同一 key 出现多次时只保留最后一条（重复续跑留下的）。
+    两遍扫描，内存只保存 key -> 行号。
+    """
+    save_json_path = Path(save_json_path)
+    jsonl_path = jsonl_path_for(save_json_path)
+    if not jsonl_path.exists():
+        print(f"[WARN] No results to compact: {jsonl_path}")
+        return 0
+
+    last_seen = {}
+    for i, record in enumerate(_iter_jsonl(jsonl_path)):
+        if key in record:
+            last_seen[record[key]] = i
+
+    tmp_path = save_json_path.with_suffix(".json.tmp")
+    n = 0
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        out.write("[")
+        for i, record in enumerate(_iter_jsonl(jsonl_path)):
+            if key in record and last_seen[record[key]] != i:
+                continue
+            body = json.dumps(record, indent=indent, ensure_ascii=False)
+            if indent:
+                body = "\n".join(" " * indent + line for line in body.split("\n"))
+            out.write(("\n" if n == 0 else ",\n") + body)
+            n += 1
+        out.write("\n]" if n else "]")
+    os.replace(tmp_path, save_json_path)
+    return n
+
+
+# ======================
+# CLI: 中断后或批量导出
+# ======================
+# python oddgrid_common/results_store.py compact IOL_type/eval/mnist_output
+# python oddgrid_common/results_store.py compact Effective/iol_output/xxx.json
+def main():
+    parser = argparse.ArgumentParser(description="Compact JSONL results into legacy list-JSON")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("compact")
+    p.add_argument("paths", nargs="+", help="结果 .json / .jsonl 文件，或包含它们的目录")
+    p.add_argument("--key", type=str, default="id", help="去重字段（single_eff 用 path）")
+    args = parser.parse_args()
+
+    targets = []
+    for path in map(Path, args.paths):
+        if path.is_dir():
+            targets.extend(sorted(path.rglob("*.jsonl")))
+        else:
+            targets.append(path)
+
+    for path in targets:
+        save_json_path = path.with_suffix(".json")
+        n = compact_results(save_json_path, key=args.key)
+        print(f"[INFO] {jsonl_path_for(save_json_path)} -> {save_json_path} ({n} items)")
+
+
+if __name__ == "__main__":
+    main()
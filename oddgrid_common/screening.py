@@ -0,0 +1,148 @@
+import math
+import random
+
+# ======================
+# 逐轮减半（successive halving）筛 checkpoint
+# ======================
+# 挑最好的 RL checkpoint 时不再每个 step × 每个数据集全量评测：
+#   第 0 轮：所有 checkpoint 在每个数据集的 n0 条分层子集上评测
+#   之后每轮：按宏平均分数去掉较差的一半，子集翻倍（子集是嵌套的，上一轮的结果直接复用）
+#   剩下 finalists 个（或子集已覆盖全集）时停止，只有 finalists 跑全量
+#
+# 分层：stratified_order 把每个数据集的样本排成一个序列，任意前缀都近似按层（grid 大小、异常数等）比例抽样。
+# 置信区间：每个数据集按样本均值的正态近似（带有限总体修正，子集 = 全集时宽度为 0），
+# 宏平均的方差 = 各数据集方差之和 / D²。
+#
+# 评测本身由调用方提供：evaluate(candidate, data_type, ids) -> 这些样本的逐条分数列表。
+# 具体脚本见 IOL_type/eval/checkpoint_screening.py、SOI_type/eval/checkpoint_screening.py。
+
+Z_95 = 1.96
+
+
+def stratified_order(items, key_fn, seed=0):
+    """
+    items -> 重排后的列表，任意前缀都近似是按 key_fn 分层的等比例抽样（不同长度的前缀互相嵌套）。
+    每层内随机打乱后，第 i 个成员的位置取 (i + u) / 层大小，再按位置合并各层。
+    """
+    rng = random.Random(seed)
+    strata = {}
+    for item in items:
+        strata.setdefault(key_fn(item), []).append(item)
+
+    keyed = []
+    for members in strata.values():
+        rng.shuffle(members)
+        offset = rng.random()
+        for i, item in enumerate(members):
+            keyed.append(((i + offset) / len(members), len(keyed), item))
+    keyed.sort(key=lambda t: t[:2])
+    return [item for _, _, item in keyed]
+
+
+def mean_se(values, population=None):
+    """样本均值与标准误；population：总体大小（有限总体修正）"""
+    n = len(values)
+    if n == 0:
+        return 0.0, float("inf")
+    mean = sum(values) / n
+    if n == 1:
+        return mean, 0.0 if population == 1 else float("inf")
+    var = sum((v - mean) ** 2 for v in values) / (n - 1)
+    fpc = max(0.0, 1 - n / population) if population else 1.0
+    return mean, math.sqrt(var / n * fpc)
+
+
+def macro_score(per_dataset, sizes, z=Z_95):
+    """
+    per_dataset: {data_type: [逐条分数]}；sizes: {data_type: 全集大小}
+    返回 (宏平均, CI 半宽)
+    """
+    if not per_dataset:
+        return 0.0, float("inf")
+    means, var = [], 0.0
+    for data_type, values in per_dataset.items():
+        mean, se = mean_se(values, sizes.get(data_type))
+        means.append(mean)
+        var += se ** 2
+    d = len(per_dataset)
+    return sum(means) / d, z * math.sqrt(var) / d
+
+
+def successive_halving(candidates, orders, evaluate, n0=32, finalists=2, eta=2, z=Z_95, on_round=None):
+    """
+    candidates: checkpoint 列表
+    orders: {data_type: stratified_order 排好的样本 id 列表}
+    evaluate(candidate, data_type, ids) -> 逐条分数列表
+    返回 (finalists 的全量结果, 各轮记录, {(candidate, data_type): 评测过的样本数})；
+    每条结果 {"candidate", "score", "ci", "n"}
+    """
+    sizes = {d: len(ids) for d, ids in orders.items()}
+    survivors = list(candidates)
+    rounds = []
+    n = n0
+    evaluated = {}   # (candidate, data_type) -> 已评测的样本数（子集嵌套，只算新增）
+
+    def score_all(cands, n):
+        results = []
+        for cand in cands:
+            per_dataset = {}
+            for data_type, ids in orders.items():
+                subset = ids[:n]
+                per_dataset[data_type] = evaluate(cand, data_type, subset)
+                evaluated[(cand, data_type)] = max(evaluated.get((cand, data_type), 0), len(subset))
+            score, ci = macro_score(per_dataset, sizes, z)
+            results.append({
+                "candidate": cand,
+                "score": score,
+                "ci": ci,
+                "n": {d: len(v) for d, v in per_dataset.items()},
+            })
+        results.sort(key=lambda r: r["score"], reverse=True)
+        return results
+
+    def emit(record):
+        rounds.append(record)
+        if on_round is not None:
+            on_round(record)
+
+    while len(survivors) > finalists:
+        full = all(n >= size for size in sizes.values())
+        results = score_all(survivors, n)
+        keep = len(results) if full else max(finalists, math.ceil(len(results) / eta))
+        emit({"round": len(rounds), "n": n, "full": full, "results": results, "kept": keep})
+        survivors = [r["candidate"] for r in results[:keep]]
+        if full:
+            break
+        n *= eta
+
+    if not rounds or not rounds[-1]["full"]:
+        final = score_all(survivors, max(sizes.values()))
+        emit({"round": "final", "n": max(sizes.values()), "full": True, "results": final, "kept": len(final)})
+
+    return rounds[-1]["results"], rounds, evaluated
+
+
+def compute_saving(evaluated, candidates, sizes):
+    """(实际评测的样本数, 全量 sweep 的样本数)"""
+    used = sum(evaluated.values())
+    full = len(candidates) * sum(sizes.values())
+    return used, full
+
+
+def print_round(record, prefix="[SCREEN]"):
+    results = record["results"]
+    keep = record["kept"]
+    label = record["round"]
+    print(f"{prefix} round {label}: n≤{record['n']} per dataset{' (full set)' if record['full'] else ''}")
+    for i, r in enumerate(results):
+        status = "keep" if i < keep else "drop"
+        print(
+            f"{prefix}   {status}  {r['score'] * 100:6.2f} ± {r['ci'] * 100:5.2f}  "
+            f"n={sum(r['n'].values()):<6} {r['candidate']}"
+        )
+    if keep < len(results):
+        # 被淘汰的里有与保留的最后一名区间重叠的：提示子集还不足以区分
+        cutoff = results[keep - 1]
+        close = [r["candidate"] for r in results[keep:] if r["score"] + r["ci"] >= cutoff["score"] - cutoff["ci"]]
+        if close:
+            print(f"[WARN] {len(close)} dropped candidate(s) overlap the cutoff CI: {', '.join(close)}")
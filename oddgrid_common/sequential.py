@@ -0,0 +1,127 @@
+import math
+from statistics import NormalDist
+
+# ======================
+# 序贯评测：置信区间够窄就停
+# ======================
+# 日常回归 / 冒烟评测不需要跑完整个测试集：样本按分层随机顺序处理（screening.stratified_order），
+# 每处理 check_every 条重新算一次 EM / F1 的置信区间，半宽 <= target 时停止。
+#   EM（0/1）：Wilson 区间
+#   F1（连续）：百分位 bootstrap（固定种子，结果可复现）
+# 停止点与区间写进结果文件旁边的 header（results_store.update_header）。
+# 提前停止的结果只覆盖部分样本：warehouse（及其上的 cal_total_em_f1 / 报表）按 header 的 stopped_early 默认不计入。
+#
+# target 以百分点给出：--target_precision 1.5 表示 95% 置信下 ±1.5pt。
+
+DEFAULT_MIN_SAMPLES = 50
+DEFAULT_CHECK_EVERY = 10
+DEFAULT_BOOTSTRAP = 1000
+
+
+def z_value(confidence):
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+
+def wilson_interval(k, n, confidence=0.95):
+    if n == 0:
+        return 0.0, 1.0
+    z = z_value(confidence)
+    p = k / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def bootstrap_interval(values, confidence=0.95, n_boot=DEFAULT_BOOTSTRAP, seed=0):
+    n = len(values)
+    if n == 0:
+        return 0.0, 1.0
+    import numpy as np  # 只有 F1 区间用到；评测脚本 import 时不带进来
+    arr = np.asarray(values, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    means = arr[rng.integers(0, n, size=(n_boot, n))].mean(axis=1)
+    alpha = (1 - confidence) / 2
+    lo, hi = np.quantile(means, [alpha, 1 - alpha])
+    return float(lo), float(hi)
+
+
+class SequentialStopper:
+    """
+    add(em, f1) 每条样本调用一次，返回是否该停。
+    metric: "EM" / "F1" / "both"（两个都够窄才停）
+    population: 全集大小（跑完全集自然结束，区间按已跑样本给出）
+    """
+
+    def __init__(self, target, confidence=0.95, metric="EM", min_samples=DEFAULT_MIN_SAMPLES,
+                 check_every=DEFAULT_CHECK_EVERY, n_boot=DEFAULT_BOOTSTRAP, population=None):
+        self.target = target / 100.0
+        self.confidence = confidence
+        self.metric = metric
+        self.min_samples = min_samples
+        self.check_every = check_every
+        self.n_boot = n_boot
+        self.population = population
+        self.em = []
+        self.f1 = []
+        self.stopped = False
+        self.stop_at = None
+
+    def interval(self, metric):
+        if metric == "EM":
+            k = int(sum(self.em))
+            return sum(self.em) / max(len(self.em), 1), wilson_interval(k, len(self.em), self.confidence)
+        mean = sum(self.f1) / max(len(self.f1), 1)
+        # 种子随样本数变化：同一份结果重算得到同样的区间
+        return mean, bootstrap_interval(self.f1, self.confidence, self.n_boot, seed=len(self.f1))
+
+    def half_width(self, metric):
+        _, (lo, hi) = self.interval(metric)
+        return (hi - lo) / 2
+
+    def _metrics(self):
+        return ["EM", "F1"] if self.metric == "both" else [self.metric]
+
+    def add(self, em, f1):
+        # 停止后仍然记录（并发时在飞的请求还会回来），区间按全部已写结果给出
+        self.em.append(em)
+        self.f1.append(f1)
+        n = len(self.em)
+        if self.stopped or n < self.min_samples or n % self.check_every:
+            return self.stopped
+        if all(self.half_width(m) <= self.target for m in self._metrics()):
+            self.stopped = True
+            self.stop_at = n
+        return self.stopped
+
+    def header(self):
+        n = len(self.em)
+        out = {
+            "target_precision": self.target * 100,
+            "confidence": self.confidence,
+            "metric": self.metric,
+            "stopped_early": self.stopped,
+            "stop_at": self.stop_at,
+            "samples": n,
+            "population": self.population,
+        }
+        for m in ("EM", "F1"):
+            mean, (lo, hi) = self.interval(m)
+            out[m] = {
+                "mean": mean * 100,
+                "ci": [lo * 100, hi * 100],
+                "method": "wilson" if m == "EM" else "bootstrap",
+            }
+        return out
+
+    def report(self, prefix="[SEQUENTIAL]"):
+        h = self.header()
+        pop = f"/{h['population']}" if h["population"] else ""
+        state = f"stopped at {self.stop_at}" if self.stopped else "ran to the end"
+        print(
+            f"{prefix} {state}, {h['samples']}{pop} samples written "
+            f"(target ±{h['target_precision']:g}pt {self.metric} @ {self.confidence:.0%})"
+        )
+        for m in ("EM", "F1"):
+            r = h[m]
+            print(f"{prefix}   {m}={r['mean']:.2f} [{r['ci'][0]:.2f}, {r['ci'][1]:.2f}] ({r['method']})")
@@ -0,0 +1,177 @@
+import json
+import os
+from pathlib import Path
+
+# ======================
+# 流式合并：逐条读 -> 逐条写 JSONL + 偏移索引
+# ======================
+# 输出：
+#   xxx.jsonl   每行一条记录
+#   xxx.idx     每行 "<id>\t<offset>\t<length>"，加载成 dict 后按 id O(1) 定位
+#   xxx.json    （可选）旧格式的 list-JSON，同样逐条写出，供 json.load 的老脚本使用
+# 合并过程中只持有当前一条记录，内存与数据集数量/样本数无关。
+
+
+def iter_json_records(path):
+    """
+    逐条产出记录：
+    - .jsonl：逐行解析
+    - .json：有 ijson 时流式解析（list 取元素，dict 取 value），否则回退 json.load
+    """
+    path = Path(path)
+
+    if path.suffix == ".jsonl":
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        return
+
+    with path.open("rb") as f:
+        head = f.read(4096).lstrip()
+        first = head[:1]
+        f.seek(0)
+
+        try:
+            import ijson
+        except ImportError:
+            ijson = None
+
+        if ijson is not None and first in (b"[", b"{"):
+            if first == b"[":
+                yield from ijson.items(f, "item", use_float=True)
+            else:
+                for _, value in ijson.kvitems(f, "", use_float=True):
+                    yield value
+            return
+
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        yield from data.values()
+    elif isinstance(data, list):
+        yield from data
+    else:
+        raise TypeError(f"Unsupported json format in {path}")
+
+
+class JsonlIndexWriter:
+    """追加写 JSONL，同时写偏移索引；legacy_json_path 不为空时同步写 list-JSON。"""
+
+    def __init__(self, jsonl_path, key="id", legacy_json_path=None):
+        self.jsonl_path = Path(jsonl_path)
+        self.index_path = self.jsonl_path.with_suffix(".idx")
+        self.key = key
+        self.count = 0
+
+        self.jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+        self._jsonl = self.jsonl_path.open("wb")
+        self._index = self.index_path.open("w", encoding="utf-8")
+        self._legacy = None
+        if legacy_json_path is not None:
+            self._legacy = Path(legacy_json_path).open("w", encoding="utf-8")
+            self._legacy.write("[")
+
+    def write(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        offset = self._jsonl.tell()
+        self._jsonl.write(line)
+
+        rid = record.get(self.key)
+        if rid is not None:
+            self._index.write(f"{rid}\t{offset}\t{len(line)}\n")
+
+        if self._legacy is not None:
+            self._legacy.write("\n" if self.count == 0 else ",\n")
+            self._legacy.write(json.dumps(record, ensure_ascii=False))
+
+        self.count += 1
+
+    def close(self):
+        self._jsonl.close()
+        self._index.close()
+        if self._legacy is not None:
+            self._legacy.write("\n]\n")
+            self._legacy.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class JsonlIndex:
+    """按 id 随机读取 JSONL 记录。"""
+
+    def __init__(self, jsonl_path):
+        self.jsonl_path = Path(jsonl_path)
+        self.offsets = {}
+        with self.jsonl_path.with_suffix(".idx").open("r", encoding="utf-8") as f:
+            for line in f:
+                rid, offset, length = line.rstrip("\n").split("\t")
+                self.offsets[rid] = (int(offset), int(length))
+        self._f = self.jsonl_path.open("rb")
+
+    def __contains__(self, rid):
+        return str(rid) in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, rid):
+        loc = self.offsets.get(str(rid))
+        if loc is None:
+            return None
+        self._f.seek(loc[0])
+        return json.loads(self._f.read(loc[1]))
+
+    def close(self):
+        self._f.close()
+
+
+def merge_details_streaming(src_root, image_dir, data_type):
+    """
+    Indu_IOL_main.merge_all_details / Indu_SOI_main.merge_all_soi_details 的流式版本。
+    读取 <src_root>/*/<data_type>_test_data.json，补上 category / dataset_name / image_dir，
+    写出 all_<data_type>_combined_metadata.{jsonl,idx,json}。
+    """
+    src_root = Path(src_root)
+    json_files = sorted(src_root.glob(f"*/{data_type}_test_data.json"))
+    print(f"[INFO] Merging {len(json_files)} {data_type.upper()} metadata files...")
+
+    base = src_root / f"all_{data_type}_combined_metadata"
+    with JsonlIndexWriter(
+        base.with_suffix(".jsonl"),
+        legacy_json_path=base.with_suffix(".json"),
+    ) as writer:
+        for json_file in json_files:
+            category = json_file.parent.name.replace(f"{data_type}_data_", "")
+            for entry in iter_json_records(json_file):
+                entry["category"] = category
+                entry["dataset_name"] = str(src_root.parent)
+                entry["image_dir"] = image_dir
+                writer.write(entry)
+
+    print(f"[SUCCESS] Total merged entries: {writer.count}")
+    print(f"[SUCCESS] Final metadata saved to: {base.with_suffix('.jsonl')} (+ .idx, .json)")
+    return writer.count
+
+
+def export_legacy_json(jsonl_path, json_path=None):
+    """JSONL -> list-JSON（逐条写，不整体加载）。"""
+    jsonl_path = Path(jsonl_path)
+    json_path = Path(json_path) if json_path else jsonl_path.with_suffix(".json")
+    tmp_path = json_path.with_suffix(json_path.suffix + ".tmp")
+
+    n = 0
+    with tmp_path.open("w", encoding="utf-8") as out:
+        out.write("[")
+        for record in iter_json_records(jsonl_path):
+            out.write("\n" if n == 0 else ",\n")
+            out.write(json.dumps(record, ensure_ascii=False))
+            n += 1
+        out.write("\n]\n")
+    os.replace(tmp_path, json_path)
+    return n
@@ -0,0 +1,195 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ======================
+# 本地假 OpenAI-compatible 服务
+# ======================
+# 只实现 POST /v1/chat/completions（含 stream=True 的 SSE），返回固定回答 + 注入延迟 / 失败，
+# 用来在没有 GPU 的机器上跑通并测试 Effective / Ablation / 压测脚本。
+#
+#   python oddgrid_common/stub_openai_server.py --port 8081 --delay 0.2 --jitter 0.1 --token_delay 0.01
+#
+# delay 相当于排队 + prefill（首 token 之前），token_delay 是流式时每个 chunk 的间隔。
+#
+# 在代码里：server, url = start_stub_server(delay=0.05)；用完 server.shutdown()
+#
+# responder(payload) -> dict 或 None：按请求内容决定回答与时延（trace_replay.py 的回放服务），
+# dict 可含 reply / usage / delay / token_delay / chunk_chars，缺的用默认值；None 返回 404。
+
+DEFAULT_REPLY = "The odd one is \\boxed{(1,1)}"
+
+
+def _count_images(messages):
+    n = 0
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, list):
+            n += sum(1 for part in content if part.get("type") == "image_url")
+    return n
+
+
+def _text_chars(messages):
+    n = 0
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, str):
+            n += len(content)
+        elif isinstance(content, list):
+            n += sum(len(part.get("text", "")) for part in content if part.get("type") == "text")
+    return n
+
+
+class StubServer(ThreadingHTTPServer):
+    # 默认 backlog=5，高并发压测时连接会排队重传（~1s 的假尾延迟）
+    request_queue_size = 1024
+    daemon_threads = True
+    # 置 True 模拟节点故障：/health 与所有请求返回 503
+    down = False
+
+
+def make_handler(reply=DEFAULT_REPLY, delay=0.0, jitter=0.0, fail_rate=0.0, tokens_per_image=256,
+                 token_delay=0.0, chunk_chars=4, responder=None):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send_json(self, code, obj):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            # vllm serve 的健康检查 / 模型列表
+            path = self.path.rstrip("/")
+            if getattr(self.server, "down", False):
+                self._send_json(503, {"error": "server down"})
+            elif path == "/health":
+                self._send_json(200, {})
+            elif path.endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+            else:
+                self._send_json(404, {"error": f"unknown path {self.path}"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": f"unknown path {self.path}"})
+                return
+
+            if getattr(self.server, "down", False):
+                self._send_json(503, {"error": "server down"})
+                return
+
+            spec = {}
+            if responder is not None:
+                spec = responder(payload)
+                if spec is None:
+                    self._send_json(404, {"error": "request not in trace"})
+                    return
+
+            time.sleep(max(0.0, spec.get("delay", delay + random.uniform(-jitter, jitter))))
+
+            if fail_rate and random.random() < fail_rate:
+                self._send_json(503, {"error": "injected failure"})
+                return
+
+            text = spec.get("reply", reply)
+            usage = spec.get("usage")
+            if not usage:
+                messages = payload.get("messages", [])
+                prompt_tokens = _text_chars(messages) // 4 + _count_images(messages) * tokens_per_image
+                completion_tokens = max(1, len(text) // 4)
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }
+
+            if payload.get("stream"):
+                try:
+                    self._send_stream(payload, usage, text, spec.get("token_delay", token_delay),
+                                      spec.get("chunk_chars", chunk_chars))
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前断开（例如 early_stop），与 vLLM 一样直接放弃该请求
+                    pass
+                return
+
+            self._send_json(200, {
+                "id": "stub-0",
+                "object": "chat.completion",
+                "model": payload.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        def _send_stream(self, payload, usage, text, token_delay, chunk_chars):
+            # 不写 Content-Length，发完关闭连接
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            def event(obj):
+                self.wfile.write(f"data: {json.dumps(obj)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            base = {"id": "stub-0", "object": "chat.completion.chunk", "model": payload.get("model", "stub")}
+            pieces = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+            for i, piece in enumerate(pieces):
+                if i:
+                    time.sleep(token_delay)
+                event({**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+            event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if (payload.get("stream_options") or {}).get("include_usage"):
+                event({**base, "choices": [], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return StubHandler
+
+
+def start_stub_server(host="127.0.0.1", port=0, **handler_kwargs):
+    """后台线程启动，返回 (server, api_url)。port=0 时随机端口。"""
+    server = StubServer((host, port), make_handler(**handler_kwargs))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1/chat/completions"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible chat server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--delay", type=float, default=0.1, help="每个请求的固定延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的均匀抖动（秒）")
+    parser.add_argument("--fail_rate", type=float, default=0.0, help="返回 503 的概率")
+    parser.add_argument("--token_delay", type=float, default=0.0, help="流式输出时 chunk 间隔（秒）")
+    parser.add_argument("--reply", type=str, default=DEFAULT_REPLY)
+    args = parser.parse_args()
+
+    server = StubServer(
+        (args.host, args.port),
+        make_handler(reply=args.reply, delay=args.delay, jitter=args.jitter,
+                     fail_rate=args.fail_rate, token_delay=args.token_delay),
+    )
+    print(f"[INFO] Stub server on http://{args.host}:{args.port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,110 @@
+import math
+import os
+
+from PIL import Image
+
+# ======================
+# 视觉 token 预算 / 客户端预缩放
+# ======================
+# IOL 画布最大 2048px，SOI 一条样本 9~20 张最大 600px 的裁剪图，
+# 不同数据集的 prompt token（prefill 时间）差好几倍。
+# 给定每条请求的视觉 token 上限，按同一个比例缩小这条请求里的所有图片（保持相对大小），
+# 图片尺寸只读文件头，不解码。
+#
+# 各模型的视觉 token 估算（与各自 processor 的默认设置一致，数值是估计）：
+#   Qwen2 / 2.5-VL        patch 14 × merge 2 -> 每 28×28 像素 1 个 token
+#   Qwen3-VL / Qwen3.5    patch 16 × merge 2 -> 每 32×32 像素 1 个 token
+#   InternVL              448px tile，每个 tile 256 token（多 tile 时另加一个缩略图）
+#   Gemma                 每张图固定 256 token（缩放只影响上传大小，不影响 token）
+
+MIN_SIDE = 56
+
+
+def image_size(path):
+    with Image.open(path) as img:
+        return img.size
+
+
+def _pixel_unit(model_name):
+    name = os.path.basename(model_name).lower()
+    if "qwen3" in name:
+        return 32
+    if "qwen" in name:
+        return 28
+    return None
+
+
+def visual_tokens(model_name, width, height, max_tiles=1):
+    name = os.path.basename(model_name).lower()
+    if "gemma" in name:
+        return 256
+    if "internvl" in name:
+        tiles = min(max_tiles, math.ceil(width / 448) * math.ceil(height / 448))
+        return 256 * (tiles + (1 if tiles > 1 else 0))
+
+    unit = _pixel_unit(model_name) or 28
+    # smart_resize：各边四舍五入到 unit 的倍数，且不小于一个 unit
+    w = max(unit, round(width / unit) * unit)
+    h = max(unit, round(height / unit) * unit)
+    return (w // unit) * (h // unit)
+
+
+def is_resizable(model_name):
+    """token 数随分辨率变化的模型才有必要预缩放"""
+    name = os.path.basename(model_name).lower()
+    return "gemma" not in name and "internvl" not in name
+
+
+def scaled_size(size, scale):
+    w, h = size
+    return max(MIN_SIDE, int(w * scale)), max(MIN_SIDE, int(h * scale))
+
+
+def plan_scale(sizes, model_name, budget):
+    """
+    sizes: 这条请求里每张图的 (w, h)
+    返回 (scale, 原始视觉 token 总数, 缩放后的视觉 token 总数, 缩放后的尺寸列表)；scale <= 1
+    """
+    def total(scale):
+        return sum(visual_tokens(model_name, *scaled_size(s, scale)) for s in sizes)
+
+    tokens = total(1.0)
+    if not budget or tokens <= budget or not is_resizable(model_name):
+        return 1.0, tokens, tokens, list(sizes)
+
+    # 面积与 token 近似成正比，先按平方根估一个比例，再因取整逐步收紧
+    scale = math.sqrt(budget / tokens)
+    while scale > 0.05 and total(scale) > budget:
+        scale *= 0.97
+    return scale, tokens, total(scale), [scaled_size(s, scale) for s in sizes]
+
+
+def resize_image(img, scale):
+    if scale >= 1.0:
+        return img
+    return img.resize(scaled_size(img.size, scale), Image.BICUBIC)
+
+
+class TokenBudgetLog:
+    """累计每条请求的实际分辨率与视觉 token，结束时打印一行汇总。"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.stats = {"requests": 0, "resized": 0, "tokens": 0, "tokens_before": 0, "pixels": 0}
+
+    def add(self, tokens_before, tokens, sizes, scale):
+        s = self.stats
+        s["requests"] += 1
+        s["resized"] += scale < 1.0
+        s["tokens"] += tokens
+        s["tokens_before"] += tokens_before
+        s["pixels"] += sum(w * h for w, h in sizes)
+
+    def report(self, prefix="[TOKENS]"):
+        s = self.stats
+        n = max(s["requests"], 1)
+        print(
+            f"{prefix} budget={self.budget} requests={s['requests']} resized={s['resized']} "
+            f"avg_visual_tokens={s['tokens'] / n:.0f} (before {s['tokens_before'] / n:.0f}) "
+            f"avg_megapixels={s['pixels'] / n / 1e6:.2f}"
+        )
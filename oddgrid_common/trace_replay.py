@@ -0,0 +1,359 @@
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from io import BytesIO
+from pathlib import Path
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from oddgrid_common.response_cache import payload_key, request_key
+from oddgrid_common.stub_openai_server import StubServer, make_handler
+
+# ======================
+# 请求 / 回答 trace：录制与回放
+# ======================
+# 在 GPU 上真实跑一次，把每条请求的 key、回答、usage、时延记进 trace（JSONL，一行一条）；
+# 之后在只有 CPU 的机器上用 trace 代替模型，测客户端开销、续跑逻辑、吞吐，或者跑端到端 CI。
+#
+# HTTP 路径（Effective / Ablation / vllm_infer.py，key = payload_key）：
+#   录制：在客户端和 vllm serve 之间加一层代理，脚本的 --api_url 指向代理
+#     python oddgrid_common/trace_replay.py record --upstream http://gpu:8081/v1/chat/completions \
+#         --port 8090 --out traces/iol_mnist.jsonl
+#   回放：起一个假服务，按请求内容查 trace 返回原回答，时延 = 原时延 × latency_scale
+#     python oddgrid_common/trace_replay.py serve --trace traces/iol_mnist.jsonl --port 8081 --latency_scale 0.5
+#   流式请求按记录的 TTFT / ITL 回放；客户端提前断开（early_stop）的回答不完整，不记录。
+#
+# 直连路径（vllm_infer_dire.py，key = direct_key）：
+#   --trace_record traces/x.jsonl  每个 llm.chat batch 的结果追加进 trace（时延 = 整个 batch 的耗时）
+#   --trace_replay traces/x.jsonl  不加载模型（也不 import vLLM），batch 的时延 = 其中最慢一条 × latency_scale
+#   图片按解码后的像素哈希，与 vLLM 版本用 image_pil 还是 data URL 无关。
+#
+# trace 里找不到的请求：HTTP 回放默认返回 404（--on_miss sample 改为随机挑一条记录的回答与时延，只用于压测），
+# 直连回放返回 None 并计数：vllm_infer_dire 不写这些样本的结果（仍是待跑），之后的真实运行续跑时补上。
+# 回放时通常加 --no_cache，否则命中推理结果缓存的请求不经过 trace。
+
+DEFAULT_LATENCY_SCALE = 1.0
+
+
+def _pixel_digest(part):
+    from PIL import Image
+    from oddgrid_common.response_cache import _image_digest
+
+    if part.get("type") == "image_pil":
+        return _image_digest(part)
+    url = (part.get("image_url") or {}).get("url", "")
+    if not url.startswith("data:"):
+        return _image_digest(part)
+    with Image.open(BytesIO(base64.b64decode(url.split(",", 1)[1]))) as img:
+        # 与 image_cache.load_pil_image 一致
+        img = img.convert("RGB") if img.mode not in ("RGB", "RGBA") else img.copy()
+    return _image_digest({"type": "image_pil", "image_pil": img})
+
+
+def direct_key(model, messages, sampling):
+    """直连路径的 key：模型名 + 采样参数 + messages（图片按像素哈希）"""
+    canonical = []
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, list):
+            content = [
+                {"type": "image", "digest": _pixel_digest(part)}
+                if part.get("type") in ("image_url", "image_pil") else part
+                for part in content
+            ]
+        canonical.append({**msg, "content": content})
+    return request_key(os.path.basename(str(model).rstrip("/")), canonical, sampling)
+
+
+class TraceWriter:
+    """追加写 trace（线程安全，每条 flush，进程中断也不丢已完成的记录）"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, key, text, usage=None, latency=None, **extra):
+        record = {"key": key, "text": text, "usage": usage or {}, "latency": latency, **extra, "ts": time.time()}
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._f.write(line + "\n")
+            self._f.flush()
+            self.count += 1
+
+    def write_batch(self, keys, texts, elapsed, **extra):
+        for key, text in zip(keys, texts):
+            if text is not None:
+                self.write(key, text, latency=elapsed, batch_size=len(keys), **extra)
+
+    def report(self, prefix="[TRACE]"):
+        print(f"{prefix} recorded {self.count} responses -> {self.path}")
+
+    def close(self):
+        self._f.close()
+
+
+class Trace:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.records = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    self.records[record["key"]] = record    # 同一请求录了多次：取最后一次
+        self._values = list(self.records.values())
+        self._lock = threading.Lock()
+        self.stats = {"hit": 0, "miss": 0}
+
+    def lookup(self, key):
+        record = self.records.get(key)
+        with self._lock:
+            self.stats["hit" if record is not None else "miss"] += 1
+        return record
+
+    def sample(self, rng):
+        return rng.choice(self._values) if self._values else None
+
+    def replay_batch(self, keys, latency_scale=DEFAULT_LATENCY_SCALE):
+        """直连回放：返回文本列表（miss 为 None）；batch 在最慢的一条录制时延 × latency_scale 后返回"""
+        records = [self.lookup(key) for key in keys]
+        latency = max((r.get("latency") or 0.0 for r in records if r is not None), default=0.0)
+        time.sleep(latency * latency_scale)
+        return [r["text"] if r is not None else None for r in records]
+
+    def latency_summary(self):
+        values = sorted(r["latency"] for r in self._values if r.get("latency") is not None)
+        if not values:
+            return {}
+        pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+        return {"mean": sum(values) / len(values), "p50": pick(0.5), "p90": pick(0.9), "max": values[-1]}
+
+    def report(self, prefix="[TRACE]"):
+        s = self.stats
+        lat = self.latency_summary()
+        lat_str = " ".join(f"{k}={v:.3f}s" for k, v in lat.items())
+        print(f"{prefix} {len(self.records)} records ({self.path}); hit={s['hit']} miss={s['miss']} | latency {lat_str}")
+
+
+def replay_timing(record, stream, latency_scale=DEFAULT_LATENCY_SCALE):
+    """记录 -> stub 服务的 delay / token_delay / chunk_chars"""
+    text = record.get("text") or ""
+    ttft, itl = record.get("ttft"), record.get("itl")
+    if stream and ttft is not None and itl is not None:
+        n_tokens = (record.get("usage") or {}).get("completion_tokens") or max(1, len(text) // 4)
+        return {
+            "delay": ttft * latency_scale,
+            "token_delay": itl * latency_scale,
+            "chunk_chars": max(1, math.ceil(len(text) / n_tokens)),
+        }
+    return {"delay": (record.get("latency") or 0.0) * latency_scale, "token_delay": 0.0}
+
+
+def make_responder(trace, latency_scale=DEFAULT_LATENCY_SCALE, on_miss="error", seed=0):
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def responder(payload):
+        record = trace.lookup(payload_key(payload))
+        if record is None:
+            if on_miss != "sample":
+                return None
+            with lock:
+                record = trace.sample(rng)
+            if record is None:
+                return None
+        return {
+            "reply": record["text"],
+            "usage": record.get("usage"),
+            **replay_timing(record, bool(payload.get("stream")), latency_scale),
+        }
+
+    return responder
+
+
+def start_replay_server(trace, host="127.0.0.1", port=0, latency_scale=DEFAULT_LATENCY_SCALE, on_miss="error"):
+    """后台线程启动回放服务，返回 (server, api_url)"""
+    server = StubServer((host, port), make_handler(responder=make_responder(trace, latency_scale, on_miss)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1/chat/completions"
+
+
+# ======================
+# 录制代理
+# ======================
+def make_proxy_handler(upstream, writer, timeout=600):
+    import httpx
+
+    client = httpx.Client(
+        timeout=httpx.Timeout(timeout),
+        limits=httpx.Limits(max_connections=256, max_keepalive_connections=256),
+    )
+    base = upstream.split("/v1/")[0]
+
+    class RecordingProxyHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, code, body, content_type="application/json"):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            # /health、/v1/models 原样转发（dispatcher 的健康检查）
+            try:
+                resp = client.get(base + self.path)
+                self._send(resp.status_code, resp.content, resp.headers.get("content-type", "application/json"))
+            except httpx.HTTPError as e:
+                self._send(502, json.dumps({"error": f"{type(e).__name__}: {e}"}).encode("utf-8"))
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            payload = json.loads(body or b"{}")
+            key = payload_key(payload)
+            start = time.perf_counter()
+            if payload.get("stream"):
+                self._relay_stream(body, payload, key, start)
+                return
+            try:
+                resp = client.post(upstream, content=body, headers={"Content-Type": "application/json"})
+            except httpx.HTTPError as e:
+                self._send(502, json.dumps({"error": f"{type(e).__name__}: {e}"}).encode("utf-8"))
+                return
+            latency = time.perf_counter() - start
+            if resp.status_code == 200:
+                data = resp.json()
+                writer.write(key, data["choices"][0]["message"]["content"], data.get("usage"), latency,
+                             model=payload.get("model"), source="http")
+            self._send(resp.status_code, resp.content, resp.headers.get("content-type", "application/json"))
+
+        def _relay_stream(self, body, payload, key, start):
+            parts, gaps, usage = [], [], {}
+            first = last = None
+            try:
+                with client.stream("POST", upstream, content=body, headers={"Content-Type": "application/json"}) as resp:
+                    if resp.status_code >= 400:
+                        resp.read()
+                        self._send(resp.status_code, resp.content, resp.headers.get("content-type", "application/json"))
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    self.close_connection = True
+
+                    for line in resp.iter_lines():
+                        self.wfile.write((line + "\n").encode("utf-8"))
+                        if not line:
+                            self.wfile.flush()
+                            continue
+                        if not line.startswith("data:") or line[5:].strip() == "[DONE]":
+                            continue
+                        chunk = json.loads(line[5:].strip())
+                        if chunk.get("usage"):
+                            usage = chunk["usage"]
+                        for choice in chunk.get("choices") or []:
+                            delta = (choice.get("delta") or {}).get("content")
+                            if delta:
+                                now = time.perf_counter()
+                                if first is not None:
+                                    gaps.append(now - last)
+                                first = first or now
+                                last = now
+                                parts.append(delta)
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端提前断开（early_stop）：回答不完整，不记录
+                return
+            except httpx.HTTPError as e:
+                print(f"[WARN] upstream stream failed: {type(e).__name__}: {e}")
+                return
+
+            writer.write(
+                key, "".join(parts), usage, time.perf_counter() - start,
+                ttft=(first - start) if first is not None else None,
+                itl=sum(gaps) / len(gaps) if gaps else None,
+                model=payload.get("model"), source="http",
+            )
+
+    return RecordingProxyHandler
+
+
+def start_recording_proxy(upstream, out_path, host="127.0.0.1", port=0, timeout=600):
+    """后台线程启动录制代理，返回 (server, api_url, writer)"""
+    writer = TraceWriter(out_path)
+    server = StubServer((host, port), make_proxy_handler(upstream, writer, timeout))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1/chat/completions", writer
+
+
+# ======================
+# CLI
+# ======================
+def main():
+    parser = argparse.ArgumentParser(description="Record / replay request-response traces")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("record", help="录制代理：转发到 upstream，同时把回答写进 trace")
+    p.add_argument("--upstream", required=True, help="真实服务的 chat/completions 地址")
+    p.add_argument("--out", required=True, help="trace 文件（JSONL，追加写）")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8090)
+    p.add_argument("--timeout", type=float, default=600)
+
+    p = sub.add_parser("serve", help="回放服务：按请求内容返回 trace 里的回答")
+    p.add_argument("--trace", required=True)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8081)
+    p.add_argument("--latency_scale", type=float, default=DEFAULT_LATENCY_SCALE, help="时延倍数，0 表示不等待")
+    p.add_argument("--on_miss", choices=["error", "sample"], default="error",
+                   help="trace 里没有的请求：404，或随机挑一条记录的回答与时延")
+
+    p = sub.add_parser("summary", help="trace 的条数与时延分布")
+    p.add_argument("trace")
+    args = parser.parse_args()
+
+    if args.cmd == "record":
+        server, url, writer = start_recording_proxy(args.upstream, args.out, args.host, args.port, args.timeout)
+        print(f"[TRACE] recording proxy on {url} -> {args.upstream}, writing {args.out}")
+    elif args.cmd == "serve":
+        trace = Trace(args.trace)
+        server, url = start_replay_server(trace, args.host, args.port, args.latency_scale, args.on_miss)
+        trace.report()
+        print(f"[TRACE] replay server on {url} (latency × {args.latency_scale:g}, on_miss={args.on_miss})")
+    else:
+        Trace(args.trace).report()
+        return
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        if args.cmd == "record":
+            writer.report()
+            writer.close()
+        else:
+            trace.report()
+
+
+if __name__ == "__main__":
+    main()
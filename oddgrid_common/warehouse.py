@@ -0,0 +1,488 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from oddgrid_common.results_store import header_path_for, read_header
+from oddgrid_common.stream_merge import iter_json_records
+
+# ======================
+# 评测结果仓库（一次解析，多处查询）
+# ======================
+# cal_total_em_f1.py、Error_Analysis/*.py、report_generation/*.py 以前各自 glob + json.load 每个结果文件，
+# 各自用一套正则重新解析 extract_answer。这里把结果文件一次性规范化进 sqlite（默认 <repo>/.cache/results.sqlite）：
+#   files   每个结果文件一行：路径、eval_dir、数据集目录（xxx_output）、模型（文件名）、task、mtime / size、N / EM / F1
+#   samples 每条样本一行：解析后的 gt / pred 集合（JSON，pred 解析失败为 NULL）、em / f1 / tp / fp / fn、错误类型
+#           （整文件一次性由 bitmask_metrics 向量化计算）
+# 增量：按 (mtime, size, task) 判断文件是否变过，没变的不再读；删掉的文件连同样本一起清掉。
+# 序贯评测（--target_precision）提前停下的结果文件只跑了部分样本，header（<model>.header）里 sequential.stopped_early=true：
+# files.stopped_early 记下这一点，所有查询默认排除（打印 [WARN]），include_partial=True 才算进去。
+#
+# 读的是 compact 之后的 <model>.json（与报表一致，不读推理中的 .jsonl）。
+# 目录约定与各报表脚本一致：<eval_dir>/<dataset>_output/<model>.json，
+# 以及 cross_type 报表回退用的 <eval_dir>/z_oldoutput/<dataset>_output/<model>.json（old=1）。
+#
+# 报表脚本只用查询接口（查询前自动增量扫描该 eval_dir）：
+#   wh = open_warehouse()
+#   wh.metrics("IOL_type/eval", "iol", percent=True)    -> {dataset: {model: {"EM", "F1", "N"}}}
+#   wh.file_metrics(path, "soi")                        -> {"EM", "F1", "N"} 或 None
+#   wh.error_stats("SOI_type/eval", "soi")              -> {dataset: {model: {"n", "counts": Counter}}}
+#   wh.samples(path, "iol")                             -> 逐条 {"id", "gt", "pred", "em", "f1", ...}
+#   wh.sample_scores("IOL_type/eval", "iol")            -> {dataset: {model: {sample_id: (em, f1)}}}
+# 另有 bootstrap 表：oddgrid_common/bootstrap.py 的重采样结果按数据哈希缓存在这里（load_draws / save_draws）。
+#
+# 命令行：
+#   python oddgrid_common/warehouse.py ingest                       # 默认 IOL_type/eval、SOI_type/eval
+#   python oddgrid_common/warehouse.py ingest --root Ablation/eval:iol
+#   python oddgrid_common/warehouse.py summary IOL_type/eval --task iol
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_WAREHOUSE_PATH = ROOT_DIR / ".cache" / "results.sqlite"
+DEFAULT_ROOTS = [(ROOT_DIR / "IOL_type" / "eval", "iol"), (ROOT_DIR / "SOI_type" / "eval", "soi")]
+OLD_OUTPUT_DIR = "z_oldoutput"
+
+# samples.meta 不保存的大字段
+_HEAVY_FIELDS = {"answer", "extract_answer", "predict", "prompt", "response", "messages", "image", "images"}
+
+IOL_COORD_RE = re.compile(r"^\((\d+),(\d+)\)$")
+SOI_IMAGE_RE = re.compile(r"^image(\d+)$")
+
+
+# ======================
+# 规范化 + 逐条 EM / F1
+# ======================
+# 全仓库只有这一份：cal_total_em_f1.py、vllm_infer_dire / Effective 的序贯评测（score_sample）、
+# token_budget_sweep.py 都从这里 import。
+def normalize_iol_gt(answer):
+    out = []
+    for item in answer or []:
+        if isinstance(item, (list, tuple)) and len(item) == 2:
+            out.append((int(item[0]), int(item[1])))
+    return out
+
+
+def normalize_iol_pred(extract_answer):
+    # "" / None 表示没解析出答案；只有 [] 是明确的“无异常”
+    if extract_answer is None or extract_answer == "":
+        return None
+    if not isinstance(extract_answer, list):
+        return None
+    out = []
+    for item in extract_answer:
+        if not isinstance(item, str):
+            return None
+        match = IOL_COORD_RE.match(item.strip())
+        if not match:
+            return None
+        out.append((int(match.group(1)), int(match.group(2))))
+    return out
+
+
+def normalize_soi_gt(answer):
+    return [int(x) for x in (answer or [])]
+
+
+def normalize_soi_pred(extract_answer):
+    if extract_answer is None or extract_answer == "":
+        return None
+    if isinstance(extract_answer, list):
+        parts = extract_answer
+    elif isinstance(extract_answer, str) and extract_answer.strip():
+        parts = extract_answer.split(",")
+    else:
+        return None
+    out = []
+    for item in parts:
+        if not isinstance(item, str):
+            return None
+        match = SOI_IMAGE_RE.match(item.strip())
+        if not match:
+            return None
+        out.append(int(match.group(1)))
+    return out
+
+
+NORMALIZERS = {
+    "iol": (normalize_iol_gt, normalize_iol_pred),
+    "soi": (normalize_soi_gt, normalize_soi_pred),
+}
+
+
+def compute_em_f1(pred, gt):
+    """集合级 EM / F1；pred 为 None（格式错误）直接记错，gt 与 pred 都为空记满分"""
+    if pred is None:
+        return 0, 0.0
+    pred_set, gt_set = set(pred), set(gt)
+    if not gt_set and not pred_set:
+        return 1, 1.0
+    tp = len(pred_set & gt_set)
+    precision = tp / len(pred_set) if pred_set else 0.0
+    recall = tp / len(gt_set) if gt_set else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    return int(pred_set == gt_set), f1
+
+
+def score_sample(sample, task):
+    """单条结果 -> (EM, F1)"""
+    normalize_gt, normalize_pred = NORMALIZERS[task]
+    return compute_em_f1(normalize_pred(sample.get("extract_answer", "")), normalize_gt(sample.get("answer", [])))
+
+
+def _encode_set(values):
+    if values is None:
+        return None
+    return json.dumps(sorted(set(values)))
+
+
+def _decode_set(text, task):
+    if text is None:
+        return None
+    values = json.loads(text)
+    return [tuple(v) for v in values] if task == "iol" else values
+
+
+def _meta(sample):
+    return {k: v for k, v in sample.items()
+            if k not in _HEAVY_FIELDS and isinstance(v, (str, int, float, bool, type(None)))}
+
+
+def _split_path(path):
+    """<eval_dir>/[z_oldoutput/]<dataset>/<model>.json -> (eval_dir, dataset, model, old)"""
+    path = Path(path).resolve()
+    dataset_dir = path.parent
+    old = dataset_dir.parent.name == OLD_OUTPUT_DIR
+    eval_dir = dataset_dir.parent.parent if old else dataset_dir.parent
+    return str(eval_dir), dataset_dir.name, path.stem, int(old)
+
+
+def _result_files(eval_dir):
+    eval_dir = Path(eval_dir)
+    yield from sorted(eval_dir.glob("*_output/*.json"))
+    yield from sorted(eval_dir.glob(f"{OLD_OUTPUT_DIR}/*_output/*.json"))
+
+
+class Warehouse:
+    def __init__(self, path=None):
+        self.path = Path(path or os.environ.get("ODDGRID_WAREHOUSE") or DEFAULT_WAREHOUSE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " id INTEGER PRIMARY KEY, path TEXT UNIQUE, eval_dir TEXT, dataset TEXT, model TEXT, old INTEGER,"
+            " task TEXT, mtime REAL, size INTEGER, n INTEGER, em REAL, f1 REAL, error TEXT, ingested_at REAL,"
+            " header_mtime REAL DEFAULT -1, stopped_early INTEGER DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS files_dir ON files (eval_dir, task);"
+            "CREATE TABLE IF NOT EXISTS samples ("
+            " file_id INTEGER, idx INTEGER, sample_id TEXT, gt TEXT, pred TEXT,"
+            " em INTEGER, f1 REAL, tp INTEGER, fp INTEGER, fn INTEGER, error_type TEXT, meta TEXT);"
+            "CREATE INDEX IF NOT EXISTS samples_file ON samples (file_id);"
+            "CREATE TABLE IF NOT EXISTS bootstrap (key TEXT PRIMARY KEY, created_at REAL, draws BLOB);"
+        )
+        columns = {r[1] for r in self._conn.execute("PRAGMA table_info(files)")}
+        for name, decl in (("header_mtime", "REAL DEFAULT -1"), ("stopped_early", "INTEGER DEFAULT 0")):
+            if name not in columns:   # 旧库：加列，header 状态在下次扫描时补上
+                self._conn.execute(f"ALTER TABLE files ADD COLUMN {name} {decl}")
+        self._conn.commit()
+        self._scanned = set()   # 本进程内已扫描过的 (eval_dir, task)
+        self._warned = set()
+        self.stats = {"ingested": 0, "unchanged": 0, "removed": 0, "samples": 0, "scan_time": 0.0}
+
+    # ---------- 写入 ----------
+    def _header_state(self, path):
+        """(header mtime, 是否序贯评测提前停止)；没有 header 时 mtime 为 0"""
+        header_path = header_path_for(path)
+        if not header_path.exists():
+            return 0.0, 0
+        try:
+            sequential = read_header(path).get("sequential") or {}
+        except (OSError, ValueError) as exc:
+            print(f"[WARN] unreadable header {header_path}: {exc}")
+            sequential = {}
+        return header_path.stat().st_mtime, int(bool(sequential.get("stopped_early")))
+
+    def ingest_file(self, path, task):
+        """文件没变时直接返回 False（只有 header 变了时只更新 stopped_early，不重新解析样本）"""
+        path = Path(path).resolve()
+        st = path.stat()
+        header_mtime, stopped_early = self._header_state(path)
+        row = self._conn.execute(
+            "SELECT id, mtime, size, task, header_mtime FROM files WHERE path = ?", (str(path),)
+        ).fetchone()
+        if row is not None and (row[1], row[2], row[3]) == (st.st_mtime, st.st_size, task):
+            if row[4] != header_mtime:
+                with self._conn:
+                    self._conn.execute(
+                        "UPDATE files SET header_mtime = ?, stopped_early = ? WHERE id = ?",
+                        (header_mtime, stopped_early, row[0]),
+                    )
+            self.stats["unchanged"] += 1
+            return False
+
+        from oddgrid_common.bitmask_metrics import ERROR_TYPES, MaskEncoder, score  # 有文件要解析时才加载 numpy
+
+        normalize_gt, normalize_pred = NORMALIZERS[task]
+        rows, error = [], None
+        encoder = MaskEncoder(task)
+        try:
+            for sample in iter_json_records(path):
+                gt = normalize_gt(sample.get("answer", []))
+                pred = normalize_pred(sample.get("extract_answer", ""))
+                encoder.add(gt, pred, valid=())   # 集合级指标不需要有效单元
+                rows.append((str(sample.get("id")), _encode_set(gt), _encode_set(pred),
+                             json.dumps(_meta(sample), ensure_ascii=False)))
+        except Exception as exc:
+            print(f"[WARN] skip {path}: {exc}")
+            rows, error = [], str(exc)
+
+        n = len(rows)
+        em = f1 = 0.0
+        if n:
+            scores = score(encoder.batch())
+            em, f1 = float(scores["em"].mean()), float(scores["f1"].mean())
+            columns = [scores[k].tolist() for k in ("em", "f1", "tp", "fp", "fn", "error")]
+            rows = [
+                (idx, sample_id, gt, pred, *(c[idx] for c in columns[:5]), ERROR_TYPES[columns[5][idx]], meta)
+                for idx, (sample_id, gt, pred, meta) in enumerate(rows)
+            ]
+        eval_dir, dataset, model, old = _split_path(path)
+        with self._conn:
+            if row is not None:
+                self._conn.execute("DELETE FROM samples WHERE file_id = ?", (row[0],))
+                self._conn.execute("DELETE FROM files WHERE id = ?", (row[0],))
+            cur = self._conn.execute(
+                "INSERT INTO files (path, eval_dir, dataset, model, old, task, mtime, size, n, em, f1, error, ingested_at,"
+                " header_mtime, stopped_early) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(path), eval_dir, dataset, model, old, task, st.st_mtime, st.st_size, n, em, f1, error, time.time(),
+                 header_mtime, stopped_early),
+            )
+            self._conn.executemany(
+                "INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(cur.lastrowid, *r) for r in rows],
+            )
+        self.stats["ingested"] += 1
+        self.stats["samples"] += n
+        return True
+
+    def ingest(self, eval_dir, task, force=False):
+        """增量扫描一个 eval 目录；同一进程内重复调用只扫一次（force=True 重扫）"""
+        eval_dir = Path(eval_dir).resolve()
+        key = (str(eval_dir), task)
+        if key in self._scanned and not force:
+            return
+        start = time.perf_counter()
+        seen = set()
+        for path in _result_files(eval_dir):
+            seen.add(str(path.resolve()))
+            self.ingest_file(path, task)
+        stale = [
+            file_id for file_id, path in self._conn.execute(
+                "SELECT id, path FROM files WHERE eval_dir = ? AND task = ?", key
+            )
+            if path not in seen
+        ]
+        with self._conn:
+            for file_id in stale:
+                self._conn.execute("DELETE FROM samples WHERE file_id = ?", (file_id,))
+                self._conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+        self.stats["removed"] += len(stale)
+        self.stats["scan_time"] += time.perf_counter() - start
+        self._scanned.add(key)
+
+    # ---------- 查询 ----------
+    def _warn_partial(self, eval_dir, task, include_partial):
+        """提前停止的文件每个只提示一次"""
+        rows = self._conn.execute(
+            "SELECT path, n FROM files WHERE eval_dir = ? AND task = ? AND stopped_early = 1",
+            (str(Path(eval_dir).resolve()), task),
+        ).fetchall()
+        for path, n in rows:
+            if path in self._warned:
+                continue
+            self._warned.add(path)
+            action = "included" if include_partial else "excluded"
+            print(f"[WARN] {action} {path}: sequential run stopped early ({n} samples, see .header)")
+
+    def metrics(self, eval_dir, task, percent=False, include_old=False, include_partial=False):
+        """{dataset: {model: {"EM", "F1", "N"}}}，空文件 / 读不了的文件 / 提前停止的序贯评测不出现"""
+        self.ingest(eval_dir, task)
+        self._warn_partial(eval_dir, task, include_partial)
+        scale = 100.0 if percent else 1.0
+        out = {}
+        for dataset, model, n, em, f1 in self._conn.execute(
+            "SELECT dataset, model, n, em, f1 FROM files"
+            " WHERE eval_dir = ? AND task = ? AND n > 0 AND old <= ? AND stopped_early <= ? ORDER BY dataset, model",
+            (str(Path(eval_dir).resolve()), task, int(include_old), int(include_partial)),
+        ):
+            out.setdefault(dataset, {})[model] = {"EM": em * scale, "F1": f1 * scale, "N": n}
+        return out
+
+    def _file_row(self, path, task):
+        path = Path(path).resolve()
+        if not path.exists():
+            return None
+        self.ingest_file(path, task)
+        return self._conn.execute(
+            "SELECT id, n, em, f1, stopped_early FROM files WHERE path = ?", (str(path),)
+        ).fetchone()
+
+    def is_stopped_early(self, path, task):
+        row = self._file_row(path, task)
+        return bool(row and row[4])
+
+    def file_metrics(self, path, task, percent=False, include_partial=False):
+        """单个文件的 {"EM", "F1", "N"}；空文件、提前停止的序贯评测（include_partial=False 时）返回 None"""
+        row = self._file_row(path, task)
+        if row is None or not row[1]:
+            return None
+        if row[4] and not include_partial:
+            if str(Path(path).resolve()) not in self._warned:
+                self._warned.add(str(Path(path).resolve()))
+                print(f"[WARN] excluded {path}: sequential run stopped early ({row[1]} samples, see .header)")
+            return None
+        scale = 100.0 if percent else 1.0
+        return {"EM": row[2] * scale, "F1": row[3] * scale, "N": row[1]}
+
+    def error_stats(self, eval_dir, task, include_partial=False):
+        """{dataset: {model: {"n", "counts": Counter(error_type)}}}"""
+        self.ingest(eval_dir, task)
+        self._warn_partial(eval_dir, task, include_partial)
+        out = {}
+        for dataset, model, error_type, count in self._conn.execute(
+            "SELECT f.dataset, f.model, s.error_type, COUNT(*) FROM samples s JOIN files f ON s.file_id = f.id"
+            " WHERE f.eval_dir = ? AND f.task = ? AND f.old = 0 AND f.stopped_early <= ? GROUP BY f.id, s.error_type",
+            (str(Path(eval_dir).resolve()), task, int(include_partial)),
+        ):
+            stats = out.setdefault(dataset, {}).setdefault(model, {"n": 0, "counts": Counter()})
+            stats["n"] += count
+            stats["counts"][error_type] += count
+        return out
+
+    def sample_scores(self, eval_dir, task, include_partial=False):
+        """{dataset: {model: {sample_id: (em, f1)}}}，bootstrap / 配对检验按 sample_id 对齐用"""
+        self.ingest(eval_dir, task)
+        self._warn_partial(eval_dir, task, include_partial)
+        out = {}
+        for dataset, model, idx, sample_id, em, f1 in self._conn.execute(
+            "SELECT f.dataset, f.model, s.idx, s.sample_id, s.em, s.f1 FROM samples s JOIN files f ON s.file_id = f.id"
+            " WHERE f.eval_dir = ? AND f.task = ? AND f.old = 0 AND f.stopped_early <= ?",
+            (str(Path(eval_dir).resolve()), task, int(include_partial)),
+        ):
+            # 没有 id 的结果按文件内顺序对齐
+            key = sample_id if sample_id != "None" else f"#{idx}"
+            out.setdefault(dataset, {}).setdefault(model, {})[key] = (em, f1)
+        return out
+
+    def samples(self, path, task):
+        """逐条样本（按文件内顺序）；gt / pred 为列表，IOL 的坐标是 (r, c) 元组，pred 解析失败为 None"""
+        row = self._file_row(path, task)
+        if row is None:
+            return []
+        return [
+            {"id": sample_id, "gt": _decode_set(gt, task), "pred": _decode_set(pred, task),
+             "em": em, "f1": f1, "tp": tp, "fp": fp, "fn": fn, "error_type": error_type, **json.loads(meta)}
+            for sample_id, gt, pred, em, f1, tp, fp, fn, error_type, meta in self._conn.execute(
+                "SELECT sample_id, gt, pred, em, f1, tp, fp, fn, error_type, meta FROM samples"
+                " WHERE file_id = ? ORDER BY idx",
+                (row[0],),
+            )
+        ]
+
+    # ---------- bootstrap 缓存（oddgrid_common/bootstrap.py，key 是数据内容的哈希） ----------
+    def load_draws(self, keys):
+        out = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            out.update(self._conn.execute(
+                f"SELECT key, draws FROM bootstrap WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        return out
+
+    def save_draws(self, items):
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO bootstrap VALUES (?, ?, ?)",
+                [(key, now, blob) for key, blob in items.items()],
+            )
+
+    def report(self, prefix="[WAREHOUSE]"):
+        s = self.stats
+        print(
+            f"{prefix} ingested={s['ingested']} unchanged={s['unchanged']} removed={s['removed']} "
+            f"samples={s['samples']} scan={s['scan_time']:.2f}s ({self.path})"
+        )
+
+    def close(self):
+        self._conn.close()
+
+
+_DEFAULT = None
+
+
+def open_warehouse(path=None):
+    """进程内共享一个默认仓库：几个报表在同一进程里跑时每个 eval_dir 只扫描一次"""
+    global _DEFAULT
+    if path is not None:
+        return Warehouse(path)
+    if _DEFAULT is None:
+        _DEFAULT = Warehouse()
+    return _DEFAULT
+
+
+# ======================
+# CLI
+# ======================
+def _parse_root(text):
+    path, _, task = text.rpartition(":")
+    if task not in NORMALIZERS or not path:
+        raise argparse.ArgumentTypeError(f"expected <eval_dir>:iol|soi, got {text!r}")
+    return Path(path), task
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Results warehouse (sqlite)")
+    parser.add_argument("--db", default=None, help=f"默认 {DEFAULT_WAREHOUSE_PATH}")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("ingest", help="增量导入结果文件")
+    p.add_argument("--root", action="append", type=_parse_root, default=None,
+                   help="<eval_dir>:iol|soi，可重复；默认 IOL_type/eval 与 SOI_type/eval")
+    p.add_argument("--force", action="store_true", help="忽略 mtime，全部重新解析")
+
+    p = sub.add_parser("summary", help="打印一个 eval 目录的 EM / F1")
+    p.add_argument("eval_dir")
+    p.add_argument("--task", choices=sorted(NORMALIZERS), required=True)
+    p.add_argument("--include_partial", action="store_true", help="也算提前停止的序贯评测结果")
+    args = parser.parse_args()
+
+    wh = Warehouse(args.db)
+    if args.cmd == "ingest":
+        if args.force:
+            wh._conn.execute("UPDATE files SET mtime = -1")
+            wh._conn.commit()
+        for eval_dir, task in args.root or DEFAULT_ROOTS:
+            if not eval_dir.is_dir():
+                print(f"[WARN] skip {eval_dir}: not a directory")
+                continue
+            wh.ingest(eval_dir, task)
+        wh.report()
+    else:
+        metrics = wh.metrics(args.eval_dir, args.task, percent=True, include_partial=args.include_partial)
+        for dataset, models in metrics.items():
+            print(f"=== {dataset} ===")
+            for model, m in models.items():
+                print(f"  {model:<50} EM={m['EM']:6.2f} F1={m['F1']:6.2f} N={m['N']}")
+        wh.report()
+    wh.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 import argparse
 import csv
-import json
-import re
+import sys
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parent
 PROJECT_ROOT = ROOT.parent
 
+sys.path.append(str(PROJECT_ROOT))
+from oddgrid_common.bootstrap import DEFAULT_RESAMPLES, Bootstrapper, stream_id
+from oddgrid_common.warehouse import open_warehouse
+
 ROW_SPECS = [
     ("Qwen3-VL-4B", "-", "-", "Qwen3-VL-4B-Instruct"),
     ("VCP-4B", "GRPO", "EM", "Qwen3_vl_4B_TOTAL_EM_grpo_step_200"),
@@ -31,6 +34,8 @@ DETAILED_DATASET_COLUMNS = (
     + [("View-Variant Scenario", label, names) for label, names in VIEW_VARIANT]
 )
 
+SIGNIFICANCE_LEVEL = 0.05
+
 DATASET_DISPLAY_NAMES = {
     "ICON": "IconSim",
     "MNIST": "DigitSim",
@@ -42,122 +47,9 @@ DATASET_DISPLAY_NAMES = {
     "GOODADS": "GoodsAD",
 }
 
-IOL_COORD_RE = re.compile(r"^\((\d+),(\d+)\)$")
-SOI_IMAGE_RE = re.compile(r"^image(\d+)$")
-
-
-def normalize_iol_gt(answer):
-    out = []
-    for item in answer or []:
-        if isinstance(item, (list, tuple)) and len(item) == 2:
-            out.append((int(item[0]), int(item[1])))
-    return out
-
-
-def normalize_iol_pred(extract_answer):
-    # Empty string means extraction failed/no parsed answer; only [] is an explicit empty prediction.
-    if extract_answer is None or extract_answer == "":
-        return None
-    if extract_answer == []:
-        return []
-    if not isinstance(extract_answer, list):
-        return None
-    out = []
-    for item in extract_answer:
-        if not isinstance(item, str):
-            return None
-        match = IOL_COORD_RE.match(item.strip())
-        if not match:
-            return None
-        out.append((int(match.group(1)), int(match.group(2))))
-    return out
-
-
-def normalize_soi_gt(answer):
-    return [int(x) for x in (answer or [])]
-
-
-def normalize_soi_pred(extract_answer):
-    # Empty string means extraction failed/no parsed answer; only [] is an explicit empty prediction.
-    if extract_answer is None or extract_answer == "":
-        return None
-    if extract_answer == []:
-        return []
-    if isinstance(extract_answer, list):
-        parts = extract_answer
-    elif isinstance(extract_answer, str) and extract_answer.strip():
-        parts = [p.strip() for p in extract_answer.split(",")]
-    else:
-        return None
-    out = []
-    for item in parts:
-        if not isinstance(item, str):
-            return None
-        match = SOI_IMAGE_RE.match(item.strip())
-        if not match:
-            return None
-        out.append(int(match.group(1)))
-    return out
-
-
-def compute_em_f1(pred, gt):
-    if pred is None:
-        return 0.0, 0.0
-    pred_set = set(pred)
-    gt_set = set(gt)
-    if not pred_set and not gt_set:
-        return 1.0, 1.0
-    em = 1.0 if pred_set == gt_set else 0.0
-    tp = len(pred_set & gt_set)
-    fp = len(pred_set - gt_set)
-    fn = len(gt_set - pred_set)
-    precision = tp / (tp + fp) if tp + fp else 0.0
-    recall = tp / (tp + fn) if tp + fn else 0.0
-    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
-    return em, f1
-
-
-def eval_json_file(path, task):
-    try:
-        data = json.loads(Path(path).read_text(encoding="utf-8"))
-    except Exception as exc:
-        print(f"[WARN] skip {path}: {exc}")
-        return None
-    if not isinstance(data, list):
-        return None
-    em_sum = 0.0
-    f1_sum = 0.0
-    n = 0
-    for sample in data:
-        if task == "iol":
-            gt = normalize_iol_gt(sample.get("answer", []))
-            pred = normalize_iol_pred(sample.get("extract_answer", ""))
-        else:
-            gt = normalize_soi_gt(sample.get("answer", []))
-            pred = normalize_soi_pred(sample.get("extract_answer", ""))
-        em, f1 = compute_em_f1(pred, gt)
-        em_sum += em
-        f1_sum += f1
-        n += 1
-    if not n:
-        return None
-    return {"EM": em_sum / n * 100.0, "F1": f1_sum / n * 100.0}
-
-
 def collect_results(eval_dir, task):
-    results = {}
-    eval_dir = Path(eval_dir)
-    for dataset_dir in sorted(eval_dir.glob("*_output")):
-        if not dataset_dir.is_dir():
-            continue
-        dataset_results = {}
-        for json_path in sorted(dataset_dir.glob("*.json")):
-            metrics = eval_json_file(json_path, task)
-            if metrics is not None:
-                dataset_results[json_path.stem] = metrics
-        if dataset_results:
-            results[dataset_dir.name] = dataset_results
-    return results
+    # 结果文件由 oddgrid_common/warehouse.py 统一解析，这里只查询（未变的文件不再重读）
+    return open_warehouse().metrics(eval_dir, task, percent=True)
 
 
 def average_metrics(items):
@@ -205,6 +97,125 @@ def build_csv_rows(results, dataset_columns, include_dataset_row=True):
         rows.append(row)
     return rows
 
+# ======================
+# Bootstrap CI and paired significance (checkpoint vs base, GRPO/GSPO vs DAPO with the same reward)
+# ======================
+def comparison_refs():
+    """{row index: [(label, reference row index)]}"""
+    base_idx = 0
+    dapo = {reward: idx for idx, (_, strategy, reward, _) in enumerate(ROW_SPECS) if strategy == "DAPO"}
+    refs = {}
+    for idx, (_, strategy, reward, _) in enumerate(ROW_SPECS):
+        if idx == base_idx:
+            continue
+        refs[idx] = [("Base", base_idx)]
+        if strategy != "DAPO" and reward in dapo:
+            refs[idx].append(("DAPO", dapo[reward]))
+    return refs
+
+
+def aligned_draws(scores, model_keys, dataset_names, bootstrapper):
+    """
+    model_keys 在每个数据集上按 sample_id 取交集对齐后的宏平均（与 metric_for_model 一致）。
+    只用参与比较的这几个模型的交集：单个模型就是它的完整结果文件，两个模型就是这一对都有的样本，
+    均值 / 差值和 p 来自同一批样本；同一数据集共用重采样（同一 stream），draws 相减即配对差。
+    返回 {"n", "full_n": [每个模型的样本数], "EM" / "F1": [每个模型的 draws], "point": {"EM" / "F1": [每个模型的均值]}}，
+    有数据集缺结果时返回 None。
+    """
+    per_dataset = []
+    for dataset in dataset_names:
+        by_model = scores.get(dataset, {})
+        if any(key not in by_model for key in model_keys):
+            return None
+        common = sorted(set.intersection(*(set(by_model[key]) for key in model_keys)))
+        if not common:
+            return None
+        arrays = []
+        for key in model_keys:
+            arrays.append([by_model[key][sid][0] * 100.0 for sid in common])
+            arrays.append([by_model[key][sid][1] * 100.0 for sid in common])
+        draws = bootstrapper.draws(arrays, stream=stream_id(dataset))
+        per_dataset.append({
+            "n": len(common),
+            "full_n": [len(by_model[key]) for key in model_keys],
+            "draws": draws,
+            "point": [sum(values) / len(common) for values in arrays],
+        })
+
+    k = len(per_dataset)
+    out = {
+        "n": sum(d["n"] for d in per_dataset),
+        "full_n": [sum(d["full_n"][i] for d in per_dataset) for i in range(len(model_keys))],
+        "point": {},
+    }
+    for metric_idx, metric in enumerate(("EM", "F1")):
+        cols = range(metric_idx, 2 * len(model_keys), 2)
+        out[metric] = [sum(d["draws"][c] for d in per_dataset) / k for c in cols]
+        out["point"][metric] = [sum(d["point"][c] for d in per_dataset) / k for c in cols]
+    return out
+
+
+def prefetch_draws(scores, bootstrapper):
+    """每个数据集的完整结果文件一次批量重采样（一次矩阵乘）；样本集合相同的配对比较随后直接命中缓存"""
+    model_keys = [model_key for *_, model_key in ROW_SPECS]
+    for dataset, by_model in scores.items():
+        arrays = []
+        for key in model_keys:
+            if key in by_model:
+                ids = sorted(by_model[key])
+                arrays.append([by_model[key][sid][0] * 100.0 for sid in ids])
+                arrays.append([by_model[key][sid][1] * 100.0 for sid in ids])
+        if arrays:
+            bootstrapper.draws(arrays, stream=stream_id(dataset))
+
+
+def build_ci_rows(scores, dataset_columns, bootstrapper, task_name=""):
+    """
+    返回 (CSV 行, {(数据行下标, 列): 相对 base 的 p})。
+    CI 行用模型自己的全部样本；对比行用这一对模型的样本交集，N / Delta / CI / p 都来自这批对齐样本。
+    交集比任一方的结果文件小（有结果文件没跑完）时给出 [WARN]，这一格不进 LaTeX 显著性标记
+    （表里的 Delta 是两个完整文件的均值差，和 p 不是同一批样本）。
+    """
+    rows = [[
+        "Models", "Strategy", "Reward", "Scenario", "Dataset", "Metric", "N", "Mean", "CI Low", "CI High",
+        "Compared To", "Paired N", "Delta", "Delta CI Low", "Delta CI High", "p",
+    ]]
+    significance = {}
+    refs = comparison_refs()
+    for row_idx, (model_display, strategy, reward, model_key) in enumerate(ROW_SPECS):
+        for col_idx, (scenario, label, dataset_names) in enumerate(dataset_columns):
+            cell = aligned_draws(scores, [model_key], dataset_names, bootstrapper)
+            if cell is None:
+                continue
+            pairs = []
+            for ref_label, ref_idx in refs.get(row_idx, []):
+                ref_key = ROW_SPECS[ref_idx][3]
+                pair = aligned_draws(scores, [model_key, ref_key], dataset_names, bootstrapper)
+                if pair is None:
+                    continue
+                if pair["n"] < max(pair["full_n"]):
+                    print(
+                        f"[WARN] {task_name} {scenario}/{label}: {model_key} vs {ref_key} 只有 {pair['n']} 条对齐样本 "
+                        f"(各自 {pair['full_n'][0]} / {pair['full_n'][1]})，差值与 p 只在对齐样本上计算"
+                    )
+                pairs.append((ref_label, pair))
+
+            for metric_idx, metric in enumerate(("EM", "F1")):
+                lo, hi = bootstrapper.interval(cell[metric][0])
+                prefix = [model_display, strategy, reward, scenario, label, metric, cell["n"],
+                          f"{cell['point'][metric][0]:.2f}", f"{lo:.2f}", f"{hi:.2f}"]
+                if not pairs:
+                    rows.append(prefix + ["", "", "", "", "", ""])
+                for ref_label, pair in pairs:
+                    draws_a, draws_b = pair[metric]
+                    d_lo, d_hi, p = bootstrapper.compare(draws_a, draws_b)
+                    delta = pair["point"][metric][0] - pair["point"][metric][1]
+                    rows.append(prefix + [ref_label, pair["n"], f"{delta:+.2f}", f"{d_lo:+.2f}", f"{d_hi:+.2f}", f"{p:.4f}"])
+                    if ref_label == "Base" and pair["n"] == max(pair["full_n"]):
+                        significance[(row_idx, 3 + 2 * col_idx + metric_idx)] = p
+    return rows, significance
+
+
 def write_csv(path, rows):
     path = Path(path)
     path.parent.mkdir(parents=True, exist_ok=True)
@@ -290,7 +301,7 @@ def format_delta(delta):
     return rf" {{\scriptsize\textcolor{{red}}{{↓{delta:.1f}}}}}"
 
 
-def format_metric(value, best_value=None, baseline_value=None, bold_best=True, show_delta=False):
+def format_metric(value, best_value=None, baseline_value=None, bold_best=True, show_delta=False, p_value=None):
     value = value.strip()
     if not value:
         return "--"
@@ -300,6 +311,8 @@ def format_metric(value, best_value=None, baseline_value=None, bold_best=True, s
         formatted = rf"\textbf{{{formatted}}}"
     if show_delta and numeric is not None and baseline_value is not None:
         formatted += format_delta(numeric - baseline_value)
+        if p_value is not None and p_value < SIGNIFICANCE_LEVEL and abs(numeric - baseline_value) >= 0.05:
+            formatted += r"$^{*}$"
     return formatted
 
 def latex_row_model_cell(row_idx, data_rows):
@@ -311,7 +324,7 @@ def latex_row_model_cell(row_idx, data_rows):
     return ""
 
 
-def make_latex_core(rows, bold_best=True, width=r"\columnwidth"):
+def make_latex_core(rows, bold_best=True, width=r"\columnwidth", significance=None):
     if len(rows) < 3:
         raise ValueError("CSV must contain header rows and at least one data row")
 
@@ -386,6 +399,7 @@ def make_latex_core(rows, bold_best=True, width=r"\columnwidth"):
                     baseline.get(col),
                     bold_best,
                     show_delta=row_idx > 0,
+                    p_value=(significance or {}).get((row_idx, col)),
                 )
             )
         lines.append(" & ".join(cells) + r" \\")
@@ -421,13 +435,18 @@ def make_latex_table(rows, task_name, table_kind, bold_best=True):
     return "\n".join(lines)
 
 
-def make_combined_latex_table(task_rows, bold_best=True):
+def make_combined_latex_table(task_rows, bold_best=True, significance=None):
+    significance = significance or {}
+    note = (
+        rf" $^{{*}}$: paired bootstrap difference vs.\ the baseline, $p<{SIGNIFICANCE_LEVEL:g}$."
+        if any(p < SIGNIFICANCE_LEVEL for cells in significance.values() for p in cells.values()) else ""
+    )
     lines = [
         r"\begin{table}[t]",
         r"\centering",
         r"\scriptsize",
         r"\setlength{\tabcolsep}{1.5pt}",
-        r"\caption{Grid-based and Sequence-based 4B baseline plus GRPO/GSPO/DAPO total-data EM- and F1-reward scenario-total results.}",
+        rf"\caption{{Grid-based and Sequence-based 4B baseline plus GRPO/GSPO/DAPO total-data EM- and F1-reward scenario-total results.{note}}}",
         r"\label{tab:vdp-models}",
     ]
     for idx, (task_name, rows) in enumerate(task_rows):
@@ -436,18 +455,20 @@ def make_combined_latex_table(task_rows, bold_best=True):
         panel = chr(ord("a") + idx)
         lines.extend([
             rf"\textbf{{({panel}) {latex_escape(latex_task_display_name(task_name))}}}\\[2pt]",
-            make_latex_core(rows, bold_best=bold_best, width=r"\columnwidth"),
+            make_latex_core(rows, bold_best=bold_best, width=r"\columnwidth", significance=significance.get(task_name)),
         ])
     lines.extend([r"\end{table}", ""])
     return "\n".join(lines)
 
-def generate(iol_dir, soi_dir, out_dir, latex_dir, bold_best=True):
+def generate(iol_dir, soi_dir, out_dir, latex_dir, bold_best=True, n_boot=DEFAULT_RESAMPLES, seed=0):
     out_dir = Path(out_dir)
     latex_dir = Path(latex_dir)
     latex_dir.mkdir(parents=True, exist_ok=True)
     outputs = []
     summary_task_rows = []
     detailed_task_rows = []
+    summary_significance = {}
+    bootstrapper = Bootstrapper(n_boot=n_boot, seed=seed, warehouse=open_warehouse()) if n_boot else None
 
     for task_name, eval_dir, task in [
         ("IOL", iol_dir, "iol"),
@@ -467,9 +488,25 @@ def generate(iol_dir, soi_dir, out_dir, latex_dir, bold_best=True):
         write_csv(detailed_csv_path, detailed_rows)
         outputs.append(detailed_csv_path)
 
+        if bootstrapper is not None:
+            scores = open_warehouse().sample_scores(eval_dir, task)
+            prefetch_draws(scores, bootstrapper)
+            ci_rows, summary_significance[task_name] = build_ci_rows(
+                scores, SUMMARY_DATASET_COLUMNS, bootstrapper, task_name
+            )
+            detailed_ci_rows, _ = build_ci_rows(scores, DETAILED_DATASET_COLUMNS, bootstrapper, task_name)
+            ci_csv_path = out_dir / f"{task_name}_4b_total_algo_reward_em_f1_ci.csv"
+            write_csv(ci_csv_path, ci_rows + detailed_ci_rows[1:])
+            outputs.append(ci_csv_path)
+
     summary_combined_path = latex_dir / "IOL_SOI_4b_total_algo_reward_em_f1_tables.tex"
-    summary_combined_path.write_text(make_combined_latex_table(summary_task_rows, bold_best=bold_best), encoding="utf-8")
+    summary_combined_path.write_text(
+        make_combined_latex_table(summary_task_rows, bold_best=bold_best, significance=summary_significance),
+        encoding="utf-8",
+    )
     outputs.append(summary_combined_path)
+    if bootstrapper is not None:
+        bootstrapper.report()
 
     # detailed_combined_path = latex_dir / "IOL_SOI_4b_total_algo_reward_em_f1_detailed_tables.tex"
     # detailed_combined_path.write_text(make_combined_latex_table(detailed_task_rows, bold_best=bold_best), encoding="utf-8")
@@ -484,6 +521,9 @@ def main():
     parser.add_argument("--out-dir", default=str(ROOT / "merged_reports"))
     parser.add_argument("--latex-dir", default=str(ROOT / "merged_reports" / "latex_tables"))
     parser.add_argument("--no-bold-best", action="store_true", help="Do not bold the best value in each EM/F1 column")
+    parser.add_argument("--bootstrap", type=int, default=DEFAULT_RESAMPLES,
+                        help="Bootstrap resamples for the CI / paired significance CSV (0 disables)")
+    parser.add_argument("--seed", type=int, default=0, help="Bootstrap seed")
     args = parser.parse_args()
 
     outputs = generate(
@@ -492,6 +532,8 @@ def main():
         args.out_dir,
         args.latex_dir,
         bold_best=not args.no_bold_best,
+        n_boot=args.bootstrap,
+        seed=args.seed,
     )
     for path in outputs:
         print(f"Saved: {path}")
@@ -2,13 +2,15 @@
 #!/usr/bin/env python3
 import argparse
 import csv
-import json
-import re
+import sys
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parent
 PROJECT_ROOT = ROOT.parent
 
+sys.path.append(str(PROJECT_ROOT))
+from oddgrid_common.warehouse import open_warehouse
+
 MODEL_ROWS = [
     ("InternVL3.5-2B", "InternVL3_5-2B"),
     ("InternVL3.5-4B", "InternVL3_5-4B"),
@@ -32,122 +34,9 @@ FIXED = [("MVTEC", ["MVTEC_output"]), ("VISA", ["VisA_output"]), ("Btec", ["BTec
 VIEW_VARIANT = [("MPDD/RAD", ["MPDD_output", "RAD_output"]), ("GOODADS", ["GOODADS_output"])]
 DATASET_COLUMNS = SYNTHETIC + [("Total", [name for _, names in SYNTHETIC for name in names])] + FIXED + [("Total", [name for _, names in FIXED for name in names])] + VIEW_VARIANT + [("Total", [name for _, names in VIEW_VARIANT for name in names])]
 
-IOL_COORD_RE = re.compile(r"^\((\d+),(\d+)\)$")
-SOI_IMAGE_RE = re.compile(r"^image(\d+)$")
-
-
-def normalize_iol_gt(answer):
-    out = []
-    for item in answer or []:
-        if isinstance(item, (list, tuple)) and len(item) == 2:
-            out.append((int(item[0]), int(item[1])))
-    return out
-
-
-def normalize_iol_pred(extract_answer):
-    # Empty string means extraction failed/no parsed answer; only [] is an explicit empty prediction.
-    if extract_answer is None or extract_answer == "":
-        return None
-    if extract_answer == []:
-        return []
-    if not isinstance(extract_answer, list):
-        return None
-    out = []
-    for item in extract_answer:
-        if not isinstance(item, str):
-            return None
-        match = IOL_COORD_RE.match(item.strip())
-        if not match:
-            return None
-        out.append((int(match.group(1)), int(match.group(2))))
-    return out
-
-
-def normalize_soi_gt(answer):
-    return [int(x) for x in (answer or [])]
-
-
-def normalize_soi_pred(extract_answer):
-    # Empty string means extraction failed/no parsed answer; only [] is an explicit empty prediction.
-    if extract_answer is None or extract_answer == "":
-        return None
-    if extract_answer == []:
-        return []
-    if isinstance(extract_answer, list):
-        parts = extract_answer
-    elif isinstance(extract_answer, str) and extract_answer.strip():
-        parts = [p.strip() for p in extract_answer.split(",")]
-    else:
-        return None
-    out = []
-    for item in parts:
-        if not isinstance(item, str):
-            return None
-        match = SOI_IMAGE_RE.match(item.strip())
-        if not match:
-            return None
-        out.append(int(match.group(1)))
-    return out
-
-
-def compute_em_f1(pred, gt):
-    if pred is None:
-        return 0.0, 0.0
-    pred_set = set(pred)
-    gt_set = set(gt)
-    if not pred_set and not gt_set:
-        return 1.0, 1.0
-    em = 1.0 if pred_set == gt_set else 0.0
-    tp = len(pred_set & gt_set)
-    fp = len(pred_set - gt_set)
-    fn = len(gt_set - pred_set)
-    precision = tp / (tp + fp) if tp + fp else 0.0
-    recall = tp / (tp + fn) if tp + fn else 0.0
-    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
-    return em, f1
-
-
-def eval_json_file(path, task):
-    try:
-        data = json.loads(Path(path).read_text(encoding="utf-8"))
-    except Exception as exc:
-        print(f"[WARN] skip {path}: {exc}")
-        return None
-    if not isinstance(data, list):
-        return None
-    em_sum = 0.0
-    f1_sum = 0.0
-    n = 0
-    for sample in data:
-        if task == "iol":
-            gt = normalize_iol_gt(sample.get("answer", []))
-            pred = normalize_iol_pred(sample.get("extract_answer", ""))
-        else:
-            gt = normalize_soi_gt(sample.get("answer", []))
-            pred = normalize_soi_pred(sample.get("extract_answer", ""))
-        em, f1 = compute_em_f1(pred, gt)
-        em_sum += em
-        f1_sum += f1
-        n += 1
-    if not n:
-        return None
-    return {"EM": em_sum / n * 100.0, "F1": f1_sum / n * 100.0}
-
-
 def collect_results(eval_dir, task):
-    results = {}
-    eval_dir = Path(eval_dir)
-    for dataset_dir in sorted(eval_dir.glob("*_output")):
-        if not dataset_dir.is_dir():
-            continue
-        dataset_results = {}
-        for json_path in sorted(dataset_dir.glob("*.json")):
-            metrics = eval_json_file(json_path, task)
-            if metrics is not None:
-                dataset_results[json_path.stem] = metrics
-        if dataset_results:
-            results[dataset_dir.name] = dataset_results
-    return results
+    # 结果文件由 oddgrid_common/warehouse.py 统一解析，这里只查询（未变的文件不再重读）
+    return open_warehouse().metrics(eval_dir, task, percent=True)
 
 
 def average_metrics(items):
@@ -3,6 +3,7 @@ import argparse
 import csv
 import json
 import re
+import sys
 from dataclasses import dataclass
 from pathlib import Path
 
@@ -10,6 +11,9 @@ from pathlib import Path
 ROOT = Path(__file__).resolve().parent
 PROJECT_ROOT = ROOT.parent
 
+sys.path.append(str(PROJECT_ROOT))
+from oddgrid_common.bitmask_metrics import MaskEncoder, score
+
 MODEL_SPECS = [
     ("Qwen3-VL-32B", "Qwen3-VL-32B-Instruct"),
     # The local result files use Qwen3.5-27B for the large Qwen3.5 model.
@@ -259,31 +263,27 @@ def valid_iol_cells_from_total_count(grid_size, total_count):
     return cells
 
 
+def confusion_from_encoder(encoder):
+    # 整个文件一次性位运算；units 是有效单元数（IOL 无效 / 越界的预测只计入 FP）
+    scores = score(encoder.batch())
+    return Confusion(
+        tp=int(scores["cell_tp"].sum()),
+        fp=int(scores["cell_fp"].sum()),
+        tn=int(scores["cell_tn"].sum()),
+        fn=int(scores["cell_fn"].sum()),
+        samples=len(encoder),
+        units=int(scores["cell_valid"].sum()),
+    )
+
+
 def eval_iol_file(path, iol_meta_lookup=None):
-    stat = Confusion()
+    encoder = MaskEncoder("iol")
     for sample in read_json(path):
         gt = normalize_iol_gt(sample.get("answer", []))
         pred = normalize_iol_pred(sample.get("extract_answer", ""))
         grid_size = parse_grid_size(sample.get("grid_size", [3, 3]))
-        current_pred = pred if pred is not None else set()
-        valid_cells = get_valid_iol_cells(sample, grid_size, iol_meta_lookup)
-        valid_set = set(valid_cells)
-
-        fp = len(current_pred - valid_set)
-        tp = tn = fn = 0
-        for cell in valid_cells:
-            is_pred = cell in current_pred
-            is_gt = cell in gt
-            if is_gt and is_pred:
-                tp += 1
-            elif is_gt and not is_pred:
-                fn += 1
-            elif not is_gt and is_pred:
-                fp += 1
-            else:
-                tn += 1
-        stat.add(Confusion(tp=tp, fp=fp, tn=tn, fn=fn, samples=1, units=len(valid_cells)))
-    return stat
+        encoder.add(gt, pred, valid=get_valid_iol_cells(sample, grid_size, iol_meta_lookup))
+    return confusion_from_encoder(encoder)
 
 
 def normalize_soi_gt(answer):
@@ -307,26 +307,13 @@ def normalize_soi_pred(extract_answer):
 
 
 def eval_soi_file(path):
-    stat = Confusion()
+    encoder = MaskEncoder("soi")
     for sample in read_json(path):
         gt = normalize_soi_gt(sample.get("answer", []))
         pred = normalize_soi_pred(sample.get("extract_answer", ""))
-        current_pred = pred if pred is not None else set()
         total_count = int(sample.get("total_images") or sample.get("image_num") or 9)
-        tp = fp = tn = fn = 0
-        for idx in range(1, total_count + 1):
-            is_pred = idx in current_pred
-            is_gt = idx in gt
-            if is_gt and is_pred:
-                tp += 1
-            elif is_gt and not is_pred:
-                fn += 1
-            elif not is_gt and is_pred:
-                fp += 1
-            else:
-                tn += 1
-        stat.add(Confusion(tp=tp, fp=fp, tn=tn, fn=fn, samples=1, units=tp + fp + tn + fn))
-    return stat
+        encoder.add(gt, pred, total_count=total_count)
+    return confusion_from_encoder(encoder)
 
 
 def eval_ablation_file(path):